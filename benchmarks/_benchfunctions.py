@@ -0,0 +1,10 @@
+"""Hither functions used by the benchmarks (in a module of their own so that their code can be generated for workers)."""
+import hither2 as hi
+
+@hi.function('bench_identity', '0.1.0')
+def bench_identity(x):
+    return x
+
+@hi.function('bench_sum', '0.1.0')
+def bench_sum(values):
+    return sum(values)
@@ -0,0 +1,29 @@
+"""Helpers shared by the benchmark scripts."""
+import argparse
+import json
+import time
+
+def _time_it(f, num_repeats):
+    # best of num_repeats, along with the return value of f
+    best = None
+    for _ in range(num_repeats):
+        timer = time.perf_counter()
+        ret = f()
+        elapsed = time.perf_counter() - timer
+        best = elapsed if best is None else min(best, elapsed)
+    return best, ret
+
+def _main(description, run):
+    # Runs the benchmarks of a script, printing one json line per result
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--output', default=None, help='Path of the json results file')
+    parser.add_argument('--quick', action='store_true', help='Use smaller sizes (for a quick check)')
+    args = parser.parse_args()
+    results = []
+    for r in run(quick=args.quick):
+        print(json.dumps(r))
+        results.append(r)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    return results
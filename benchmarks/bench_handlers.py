@@ -0,0 +1,45 @@
+"""Measure the throughput of the ParallelJobHandler and of the SlurmJobHandler (with use_slurm=False).
+
+Usage: python benchmarks/bench_handlers.py [--output results.json] [--quick]
+"""
+import os
+import tempfile
+import time
+import hither2 as hi
+from _benchutil import _main
+from _benchfunctions import bench_identity
+
+def _run_jobs(job_handler, num_jobs):
+    hi.reset()
+    timer = time.perf_counter()
+    with hi.Config(container=False, job_handler=job_handler):
+        jobs = [bench_identity.run(x=i) for i in range(num_jobs)]
+    results = [job.wait() for job in jobs]
+    elapsed = time.perf_counter() - timer
+    assert results == list(range(num_jobs))
+    return elapsed
+
+def bench_parallel_job_handler(*, num_jobs, num_workers):
+    elapsed = _run_jobs(hi.ParallelJobHandler(num_workers=num_workers), num_jobs)
+    return dict(name='parallel_job_handler', num_jobs=num_jobs, num_workers=num_workers,
+        total_sec=elapsed, jobs_per_sec=num_jobs / elapsed)
+
+def bench_slurm_job_handler(*, num_jobs, num_workers_per_batch):
+    with tempfile.TemporaryDirectory() as working_dir:
+        job_handler = hi.SlurmJobHandler(working_dir=working_dir, use_slurm=False,
+            num_workers_per_batch=num_workers_per_batch, num_cores_per_job=1)
+        try:
+            elapsed = _run_jobs(job_handler, num_jobs)
+        finally:
+            job_handler.cleanup()
+    return dict(name='slurm_job_handler', num_jobs=num_jobs, num_workers_per_batch=num_workers_per_batch,
+        total_sec=elapsed, jobs_per_sec=num_jobs / elapsed)
+
+def run(quick=False):
+    if not os.getenv('KACHERY_STORAGE_DIR'):
+        raise Exception('You must set the environment variable: KACHERY_STORAGE_DIR')
+    yield bench_parallel_job_handler(num_jobs=8 if quick else 64, num_workers=4)
+    yield bench_slurm_job_handler(num_jobs=8 if quick else 32, num_workers_per_batch=4)
+
+if __name__ == '__main__':
+    _main(__doc__, run)
@@ -0,0 +1,44 @@
+"""Measure the time to import hither2 in a fresh interpreter, and check that the import
+needed by the workers (job handler processes, the runner of containerized jobs) stays within a budget.
+
+Usage: python benchmarks/bench_import.py [--output results.json] [--quick]
+
+Exits with a non-zero status if the worker import exceeds WORKER_IMPORT_BUDGET_SEC.
+"""
+import statistics
+import subprocess
+import sys
+from _benchutil import _main
+
+# Time to import what the worker scripts import (see hither2/runtime.py), beyond the startup of the interpreter
+WORKER_IMPORT_BUDGET_SEC = 0.1
+
+_STATEMENTS = dict(
+    minimal='import hither2',
+    worker='import hither2.runtime',
+    decorator='import hither2; hither2.function',
+    client='import hither2; hither2.Config',
+    full='from hither2 import *'
+)
+
+def _import_time(statement, num_repeats):
+    # median over fresh interpreters, measured inside the interpreter so that its startup is excluded
+    code = f'import time; timer = time.perf_counter(); {statement}; print(time.perf_counter() - timer)'
+    elapsed = []
+    for _ in range(num_repeats):
+        out = subprocess.check_output([sys.executable, '-c', code])
+        elapsed.append(float(out.decode().strip().splitlines()[-1]))
+    return statistics.median(elapsed)
+
+def run(quick=False):
+    for name, statement in _STATEMENTS.items():
+        ret = dict(name='import', which=name, import_sec=_import_time(statement, 3 if quick else 11))
+        if name == 'worker':
+            ret['budget_sec'] = WORKER_IMPORT_BUDGET_SEC
+            ret['within_budget'] = ret['import_sec'] <= WORKER_IMPORT_BUDGET_SEC
+        yield ret
+
+if __name__ == '__main__':
+    results = _main(__doc__, run)
+    if not all([r.get('within_budget', True) for r in results]):
+        sys.exit(1)
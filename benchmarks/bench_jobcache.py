@@ -0,0 +1,50 @@
+"""Measure the latency of JobCache hits and misses, against an in-memory stand-in for the Mongo database.
+
+Usage: python benchmarks/bench_jobcache.py [--output results.json] [--quick]
+"""
+import os
+import statistics
+import sys
+import time
+import hither2 as hi
+from _benchutil import _main
+from _benchfunctions import bench_sum
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tests._inmemorydatabase import _InMemoryDatabase
+
+def bench_jobcache(*, num_jobs, num_values):
+    hi.reset()
+    job_cache = hi.JobCache(database=_InMemoryDatabase(database='hither2_benchmarks'))
+    kwargs_list = [dict(values=[float(i + j) for j in range(num_values)]) for i in range(num_jobs)]
+    with hi.Config(container=False, job_cache=job_cache):
+        jobs = [bench_sum.run(**kwargs) for kwargs in kwargs_list]
+    hi.wait()
+
+    def check_jobs(kwargs_list, expect_found):
+        latencies = []
+        for kwargs in kwargs_list:
+            with hi.Config(container=False):
+                job = bench_sum.run(**kwargs)
+            timer = time.perf_counter()
+            found = job_cache.check_job(job)
+            latencies.append(time.perf_counter() - timer)
+            assert found == expect_found
+        hi.reset()
+        return latencies
+
+    hit_latencies = check_jobs(kwargs_list, expect_found=True)
+    miss_latencies = check_jobs([dict(values=[-1.0] + kwargs['values'][1:]) for kwargs in kwargs_list], expect_found=False)
+    return dict(
+        name='jobcache',
+        num_jobs=num_jobs,
+        num_values=num_values,
+        hit_median_sec=statistics.median(hit_latencies),
+        miss_median_sec=statistics.median(miss_latencies)
+    )
+
+def run(quick=False):
+    yield bench_jobcache(num_jobs=20 if quick else 200, num_values=1000)
+
+if __name__ == '__main__':
+    _main(__doc__, run)
@@ -0,0 +1,40 @@
+"""Compare encode/decode time and size of the job payload formats.
+
+Usage: python benchmarks/bench_payload.py [--output results.json] [--quick]
+"""
+import numpy as np
+import hither2 as hi
+from _benchutil import _time_it, _main
+
+def _make_kwargs(num_arrays, array_size):
+    return dict(
+        arrays=[np.random.normal(size=(array_size,)) for _ in range(num_arrays)],
+        labels=[f'item-{i}' for i in range(num_arrays)],
+        params=dict(alpha=0.5, beta=(1, 2, 3))
+    )
+
+def bench_payload(*, num_arrays, array_size, payload_format, num_repeats=5):
+    kwargs = _make_kwargs(num_arrays, array_size)
+    encode_arrays = (payload_format == 'json')
+    def encode():
+        return hi._encode_payload(hi._serialize_item(kwargs, encode_arrays=encode_arrays), payload_format)
+    encode_sec, data = _time_it(encode, num_repeats)
+    decode_sec, _ = _time_it(lambda: hi._deserialize_item(hi._decode_payload(data)), num_repeats)
+    return dict(
+        name='payload',
+        payload_format=payload_format,
+        num_arrays=num_arrays,
+        array_size=array_size,
+        encode_sec=encode_sec,
+        decode_sec=decode_sec,
+        num_bytes=len(data)
+    )
+
+def run(quick=False):
+    for num_arrays, array_size in [(100, 100), (10, 2000)]:
+        for payload_format in hi.PAYLOAD_FORMATS:
+            yield bench_payload(num_arrays=num_arrays, array_size=array_size, payload_format=payload_format,
+                num_repeats=2 if quick else 5)
+
+if __name__ == '__main__':
+    _main(__doc__, run)
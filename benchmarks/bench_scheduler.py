@@ -0,0 +1,66 @@
+"""Measure the overhead of submitting, dispatching and waiting for trivial jobs.
+
+Usage: python benchmarks/bench_scheduler.py [--output results.json] [--quick]
+"""
+import statistics
+import time
+import hither2 as hi
+from _benchutil import _main
+from _benchfunctions import bench_identity, bench_sum
+
+def bench_submit(*, num_jobs):
+    hi.reset()
+    with hi.Config(container=False):
+        timer = time.perf_counter()
+        jobs = [bench_identity.run(x=i) for i in range(num_jobs)]
+        elapsed = time.perf_counter() - timer
+    hi.wait()
+    assert jobs[-1].wait() == num_jobs - 1
+    return dict(name='submit', num_jobs=num_jobs, sec_per_job=elapsed / num_jobs)
+
+def bench_wait_latency(*, num_repeats):
+    hi.reset()
+    latencies = []
+    with hi.Config(container=False):
+        for i in range(num_repeats):
+            timer = time.perf_counter()
+            assert bench_identity.run(x=i).wait() == i
+            latencies.append(time.perf_counter() - timer)
+    return dict(name='wait_latency', num_repeats=num_repeats,
+        median_sec=statistics.median(latencies), max_sec=max(latencies))
+
+def bench_dag_wide(*, width):
+    # one job -> width jobs depending on it -> one job depending on all of them
+    hi.reset()
+    timer = time.perf_counter()
+    with hi.Config(container=False):
+        root = bench_identity.run(x=1)
+        middle = [bench_identity.run(x=root) for _ in range(width)]
+        result = bench_sum.run(values=middle).wait()
+    elapsed = time.perf_counter() - timer
+    assert result == width
+    num_jobs = width + 2
+    return dict(name='dag_wide', width=width, total_sec=elapsed, jobs_per_sec=num_jobs / elapsed)
+
+def bench_dag_deep(*, depth):
+    # a chain of depth jobs, each depending on the previous one
+    hi.reset()
+    timer = time.perf_counter()
+    with hi.Config(container=False):
+        job = bench_identity.run(x=7)
+        for _ in range(depth - 1):
+            job = bench_identity.run(x=job)
+        result = job.wait()
+    elapsed = time.perf_counter() - timer
+    assert result == 7
+    return dict(name='dag_deep', depth=depth, total_sec=elapsed, jobs_per_sec=depth / elapsed)
+
+def run(quick=False):
+    n = 50 if quick else 500
+    yield bench_submit(num_jobs=n)
+    yield bench_wait_latency(num_repeats=n // 5)
+    yield bench_dag_wide(width=n)
+    yield bench_dag_deep(depth=n // 5)
+
+if __name__ == '__main__':
+    _main(__doc__, run)
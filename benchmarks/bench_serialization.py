@@ -0,0 +1,39 @@
+"""Measure _serialize_item, _deserialize_item and hashing of large job kwargs.
+
+Usage: python benchmarks/bench_serialization.py [--output results.json] [--quick]
+"""
+import numpy as np
+import kachery as ka
+import hither2 as hi
+from _benchutil import _time_it, _main
+
+def _make_kwargs(num_items, array_size):
+    return dict(
+        records=[dict(id=i, name=f'record-{i}', values=[i, i + 1, i + 2], flags=(True, False)) for i in range(num_items)],
+        arrays=[np.random.normal(size=(array_size,)) for _ in range(10)],
+        params=dict(alpha=0.5, beta=None, gamma='x' * 100)
+    )
+
+def bench_serialization(*, num_items, array_size, num_repeats=5):
+    kwargs = _make_kwargs(num_items, array_size)
+    serialize_sec, serialized = _time_it(lambda: hi._serialize_item(kwargs), num_repeats)
+    deserialize_sec, _ = _time_it(lambda: hi._deserialize_item(serialized), num_repeats)
+    # as for the job cache (see JobCache._compute_job_hash)
+    hash_sec, _ = _time_it(lambda: ka.get_object_hash(hi._serialize_item(kwargs)), num_repeats)
+    return dict(
+        name='serialization',
+        num_items=num_items,
+        array_size=array_size,
+        serialize_sec=serialize_sec,
+        deserialize_sec=deserialize_sec,
+        serialize_and_hash_sec=hash_sec
+    )
+
+def run(quick=False):
+    for num_items, array_size in [(1000, 1000), (10000, 100000)]:
+        if quick:
+            num_items, array_size = num_items // 10, array_size // 10
+        yield bench_serialization(num_items=num_items, array_size=array_size, num_repeats=2 if quick else 5)
+
+if __name__ == '__main__':
+    _main(__doc__, run)
@@ -0,0 +1,42 @@
+"""Run all of the hither2 benchmarks and write the results to a single json file.
+
+Usage: python benchmarks/run_benchmarks.py [--output results.json] [--quick] [--only scheduler,jobcache]
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import time
+
+BENCHMARKS = ['import', 'scheduler', 'serialization', 'payload', 'handlers', 'jobcache']
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output', default=None, help='Path of the json results file')
+    parser.add_argument('--quick', action='store_true', help='Use smaller sizes (for a quick check)')
+    parser.add_argument('--only', default=None, help='Comma-separated names of the benchmarks to run (e.g., scheduler,jobcache)')
+    args = parser.parse_args()
+
+    names = args.only.split(',') if args.only else BENCHMARKS
+    results = []
+    for name in names:
+        module = importlib.import_module(f'bench_{name}')
+        for r in module.run(quick=args.quick):
+            print(json.dumps(r))
+            results.append(dict(r, benchmark=name))
+    output = dict(
+        timestamp=time.time(),
+        python_version=sys.version,
+        platform=platform.platform(),
+        cpu_count=os.cpu_count(),
+        quick=args.quick,
+        results=results
+    )
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=4)
+
+if __name__ == '__main__':
+    main()
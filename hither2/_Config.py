@@ -17,7 +17,8 @@ class Config:
         job_handler: Union[BaseJobHandler, Inherit]=Inherit.INHERIT,
         job_cache: Union[JobCache, Inherit, None]=Inherit.INHERIT,
         download_results: Union[bool, Inherit, None]=Inherit.INHERIT,
-        job_timeout: Union[float, Inherit, None]=Inherit.INHERIT
+        job_timeout: Union[float, Inherit, None]=Inherit.INHERIT,
+        profile: Union[bool, Inherit, None]=Inherit.INHERIT
     ):
         """Set hither2 config parameters in a context manager, inheriting unchanged parameters
         from the default config.
@@ -42,6 +43,9 @@ class Config:
             Whether to download results after the function job runs (applied to remote job handler), by default None
         job_timeout : Union[float, None], optional
             A timeout time (in seconds) for each function job, by default None
+        profile : Union[bool, None], optional
+            Whether to run each function job under cProfile (see hi.load_profiles); if None,
+            use the setting of the function (see hi.opts), by default None
         """
         old_config = Config.config_stack[-1] # throws if no default set
         self.new_config = dict()
@@ -56,6 +60,7 @@ class Config:
         self.coalesce('job_cache', job_cache)
         self.coalesce('download_results', download_results)
         self.coalesce('job_timeout', job_timeout)
+        self.coalesce('profile', profile)
 
 
     @staticmethod
@@ -63,7 +68,7 @@ class Config:
     def set_default_config(cfg: Dict[Any, Any]) -> None:
         # TODO: Add a guard against resetting default config when one already exists?
         # There is probably a better way to handle the known-fields enumeration.
-        known_fields = ['container', 'job_handler', 'job_cache', 'download_results', 'job_timeout']
+        known_fields = ['container', 'job_handler', 'job_cache', 'download_results', 'job_timeout', 'profile']
         for k in known_fields:
             if k not in cfg:
                 raise Exception(f"Proposed default configuration is missing a value for {k}")
@@ -1,23 +1,76 @@
-from .core import function, container, additional_files, local_modules, opts
-from .core import Config
-from .core import wait
-from .core import reset
-from ._identity import identity
-from ._temporarydirectory import TemporaryDirectory
-from ._shellscript import ShellScript
-from ._filelock import FileLock
-from ._consolecapture import ConsoleCapture
-from .core import _deserialize_job
-from ._util import _serialize_item, _deserialize_item, _copy_structure_with_changes
-from .defaultjobhandler import DefaultJobHandler
-from .paralleljobhandler import ParallelJobHandler
-from .slurmjobhandler import SlurmJobHandler
-from .remotejobhandler import RemoteJobHandler
-from .computeresource import ComputeResource
-from .database import Database
-from .jobcache import JobCache
-from ._enums import JobStatus, HitherFileType
-from .file import File
+import importlib
+from typing import Any, List
 
-# Run a function by name
-from .core import run
\ No newline at end of file
+# The attributes of hither2 are imported from their submodules on first use (PEP 562), so
+# that processes that need only a few of them (e.g., the workers of the parallel and slurm
+# job handlers and the runner of containerized jobs) do not import the job manager, the job
+# handlers, the database, kachery and numpy just to deserialize the kwargs of a job.
+_lazy_attributes = {
+    # name -> submodule
+    'function': '_decorators',
+    'container': '_decorators',
+    'additional_files': '_decorators',
+    'local_modules': '_decorators',
+    'opts': '_decorators',
+    'Config': 'core',
+    'wait': 'core',
+    'reset': 'core',
+    'identity': '_identity',
+    'TemporaryDirectory': '_temporarydirectory',
+    'ShellScript': '_shellscript',
+    'FileLock': '_filelock',
+    'ConsoleCapture': '_consolecapture',
+    'read_console_log': '_consolelog',
+    'tail_console_log': '_consolelog',
+    '_ResourceMonitor': '_resource_usage',
+    'enable_tracing': '_tracing',
+    'disable_tracing': '_tracing',
+    'export_trace': '_tracing',
+    'reset_trace': '_tracing',
+    '_span': '_tracing',
+    '_set_trace_process_name': '_tracing',
+    '_job_trace_events': '_tracing',
+    'load_profiles': '_profiling',
+    '_Profile': '_profiling',
+    '_deserialize_job': 'core',
+    '_serialize_item': '_util',
+    '_deserialize_item': '_util',
+    '_copy_structure_with_changes': '_util',
+    '_resolve_files_in_item': '_file_transfer',
+    '_encode_payload': '_payload',
+    '_decode_payload': '_payload',
+    'PAYLOAD_FORMATS': '_payload',
+    'DefaultJobHandler': 'defaultjobhandler',
+    'ParallelJobHandler': 'paralleljobhandler',
+    'SlurmJobHandler': 'slurmjobhandler',
+    'RemoteJobHandler': 'remotejobhandler',
+    'ComputeResource': 'computeresource',
+    'Database': 'database',
+    'LocalNotificationBus': '_notifications',
+    'JobCache': 'jobcache',
+    'JobStatus': '_enums',
+    'HitherFileType': '_enums',
+    'File': 'file',
+    # Run a function by name
+    'run': '_decorators'
+}
+
+__all__ = [name for name in _lazy_attributes.keys() if not name.startswith('_')]
+
+def __getattr__(name: str) -> Any:
+    if name not in _lazy_attributes:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    try:
+        module = importlib.import_module('.' + _lazy_attributes[name], __name__)
+    except ModuleNotFoundError as e:
+        if e.name != f'{__name__}.{_lazy_attributes[name]}':
+            raise
+        # e.g., with only the runtime part of hither2 (see runtime.py)
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r} (module {e.name!r} is not available)") from e
+    value = getattr(module, name)
+    # subsequent lookups do not go through __getattr__
+    globals()[name] = value
+    return value
+
+def __dir__() -> List[str]:
+    return sorted(set(globals().keys()) | set(_lazy_attributes.keys()))
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import shutil
+import stat
+import time
+from typing import Union
+from ._util import _random_string
+
+# The code directories are read-only, so they cannot be removed with a plain rm -rf. The ones that have
+# not been used for HITHER_CODE_CACHE_MAX_AGE_DAYS days are removed (at most every _CLEANUP_INTERVAL
+# seconds, when new code is materialized), and _remove_unused_code(0) removes all of them.
+_MAX_AGE_DAYS = float(os.getenv('HITHER_CODE_CACHE_MAX_AGE_DAYS', '30'))
+_CLEANUP_INTERVAL = 3600
+_timestamp_last_cleanup = 0.0
+
+def _get_code_cache_dir() -> str:
+    storage_dir = os.getenv('KACHERY_STORAGE_DIR', None)
+    if not storage_dir:
+        raise Exception('You must set the environment variable: KACHERY_STORAGE_DIR')
+    return os.path.join(storage_dir, 'hither2_code_cache')
+
+def _get_pycache_dir() -> str:
+    # Python bytecode for the cached code (used via PYTHONPYCACHEPREFIX, since the code directories are read-only)
+    return os.path.join(_get_code_cache_dir(), 'pycache')
+
+def _code_hash(code: dict) -> str:
+    return hashlib.sha1(json.dumps(code, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _materialize_code(code: dict, fingerprint: Union[str, None]=None) -> str:
+    """Write the code (see _generate_source_code_for_function) to the code cache, if not already there.
+
+    Returns the path of a read-only directory, named by the fingerprint of the code
+    (see _function_code_fingerprint) or else by its hash, that contains the code in a
+    function_src/ subdirectory. The directory is created atomically, so it can be
+    shared between concurrent jobs and processes.
+    """
+    cache_dir = _get_code_cache_dir()
+    path = os.path.join(cache_dir, fingerprint if fingerprint is not None else _code_hash(code))
+    if os.path.exists(path):
+        _mark_as_used(path)
+        return path
+    os.makedirs(cache_dir, exist_ok=True)
+    _remove_unused_code_if_due()
+    tmp_path = path + '.tmp_' + _random_string(8)
+    os.mkdir(tmp_path)
+    try:
+        _write_python_code_to_directory(os.path.join(tmp_path, 'function_src'), code)
+        _make_read_only(tmp_path)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # another process materialized the same code first
+            if not os.path.exists(path):
+                raise
+    finally:
+        if os.path.exists(tmp_path):
+            _make_writable(tmp_path)
+            shutil.rmtree(tmp_path)
+    return path
+
+def _mark_as_used(path: str) -> None:
+    # The modification time of a code directory is when it was last used
+    try:
+        os.utime(path)
+    except OSError:
+        pass # e.g., created by another user
+
+def _remove_unused_code_if_due() -> None:
+    global _timestamp_last_cleanup
+    if time.time() - _timestamp_last_cleanup < _CLEANUP_INTERVAL:
+        return
+    _timestamp_last_cleanup = time.time()
+    _remove_unused_code(max_age_sec=_MAX_AGE_DAYS * 24 * 3600)
+
+def _remove_unused_code(max_age_sec: float) -> None:
+    """Remove the code directories (and their bytecode) that have not been used for max_age_sec seconds."""
+    cache_dir = _get_code_cache_dir()
+    if not os.path.exists(cache_dir):
+        return
+    pycache_dir = _get_pycache_dir()
+    for name in os.listdir(cache_dir):
+        # the code directories (and the temporary ones of interrupted writes) are named by sha1 hashes
+        if len(name.split('.tmp_')[0]) != 40:
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            if time.time() - os.stat(path).st_mtime < max_age_sec:
+                continue
+            _make_writable(path)
+        except OSError:
+            continue # removed by another process, or created by another user
+        shutil.rmtree(path, ignore_errors=True)
+        # the bytecode is under the path of the code as seen by the job (see _run_serialized_job_in_container.py)
+        for code_path in [path, f'/hither2_code_cache/{name}', f'/kachery-storage/hither2_code_cache/{name}']:
+            shutil.rmtree(pycache_dir + code_path, ignore_errors=True)
+
+def _materialize_file(subdir: str, name: str, content: str) -> str:
+    """Write a text file to <code cache>/<subdir>/, if not already there, and return its path.
+
+    The file name is <name> with the hash of the content inserted before the extension
+    (e.g., run_<hash>.py), so the file never changes once written.
+    """
+    base, ext = os.path.splitext(name)
+    content_hash = hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+    dirname = os.path.join(_get_code_cache_dir(), subdir)
+    path = os.path.join(dirname, f'{base}_{content_hash}{ext}')
+    if os.path.exists(path):
+        return path
+    os.makedirs(dirname, exist_ok=True)
+    tmp_path = path + '.tmp_' + _random_string(8)
+    with open(tmp_path, 'w', newline='\n') as f:
+        f.write(content)
+    os.rename(tmp_path, path)
+    return path
+
+def _write_python_code_to_directory(dirname: str, code: dict) -> None:
+    if os.path.exists(dirname):
+        raise Exception(
+            'Cannot write code to already existing directory: {}'.format(dirname))
+    os.mkdir(dirname)
+    for item in code['files']:
+        fname0 = dirname + '/' + item['name']
+        with open(fname0, 'w', newline='\n') as f:
+            f.write(item['content'])
+    for item in code['dirs']:
+        _write_python_code_to_directory(
+            dirname + '/' + item['name'], item['content'])
+
+def _make_read_only(dirname: str) -> None:
+    for root, dirs, files in os.walk(dirname):
+        for fname in files:
+            os.chmod(os.path.join(root, fname), stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    for root, dirs, files in os.walk(dirname, topdown=False):
+        os.chmod(root, stat.S_IRUSR | stat.S_IXUSR | stat.S_IRGRP | stat.S_IXGRP | stat.S_IROTH | stat.S_IXOTH)
+
+def _make_writable(dirname: str) -> None:
+    for root, dirs, files in os.walk(dirname):
+        os.chmod(root, stat.S_IRWXU)
+        for fname in files:
+            os.chmod(os.path.join(root, fname), stat.S_IRUSR | stat.S_IWUSR)
@@ -1,40 +1,152 @@
-from typing import Any, Dict, Union
+from array import array
+import datetime
+from typing import Any, Dict, List, Union
+import os
 import sys
 import time
 import io
+from ._consolelog import _ConsoleLogWriter
+
+# Maximum number of console lines kept in memory by a ConsoleCapture (0 for no limit). When exceeded, the
+# first half of the limit (head) and the most recent lines (tail) are kept, and the rest are dropped.
+CONSOLE_MAX_LINES = int(os.getenv('HITHER_CONSOLE_MAX_LINES', '100000'))
+# Text written without a line ending is recorded as a line once it gets this long
+_MAX_PARTIAL_LINE_LENGTH = 10000
+
+class _ConsoleBuffer():
+    def __init__(self, max_lines: int=0):
+        """Compact storage of console lines: the texts, a parallel array of timestamps and a parallel array of stderr flags.
+
+        The dicts of the runtime info are only created in lines()
+        """
+        self._max_lines = max_lines
+        self._head_limit = max_lines // 2 if max_lines > 0 else -1
+        self._tail_limit = max_lines - self._head_limit if max_lines > 0 else -1
+        self._head = _ConsoleLines()
+        self._tail = _ConsoleLines()
+        self._tail_start = 0 # index in self._tail of the first retained line
+        self._num_dropped = 0
+
+    def append(self, timestamp: float, texts: List[str], stderr: bool) -> None:
+        if self._head_limit >= 0 and len(self._head) < self._head_limit:
+            n = min(len(texts), self._head_limit - len(self._head))
+            self._head.extend(timestamp, texts[:n], stderr)
+            texts = texts[n:]
+        if len(texts) == 0:
+            return
+        self._tail.extend(timestamp, texts, stderr)
+        if self._tail_limit >= 0:
+            num_retained = len(self._tail) - self._tail_start
+            if num_retained > self._tail_limit:
+                self._num_dropped += num_retained - self._tail_limit
+                self._tail_start = len(self._tail) - self._tail_limit
+            # compact once the dropped lines take as much space as the retained ones
+            if self._tail_start >= self._tail_limit:
+                self._tail.delete_first(self._tail_start)
+                self._tail_start = 0
+
+    def num_dropped(self) -> int:
+        return self._num_dropped
+
+    def lines(self) -> List[Dict[str, Any]]:
+        return self._head.to_dicts(0) + self._tail.to_dicts(self._tail_start)
+
+class _ConsoleLines():
+    def __init__(self):
+        self._texts: List[str] = []
+        self._timestamps = array('d')
+        self._stderr = bytearray()
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def extend(self, timestamp: float, texts: List[str], stderr: bool) -> None:
+        if len(texts) == 1:
+            self._texts.append(texts[0])
+            self._timestamps.append(timestamp)
+            self._stderr.append(1 if stderr else 0)
+            return
+        self._texts.extend(texts)
+        self._timestamps.extend([timestamp] * len(texts))
+        self._stderr.extend(b'\x01' * len(texts) if stderr else bytes(len(texts)))
+
+    def delete_first(self, n: int) -> None:
+        del self._texts[:n]
+        del self._timestamps[:n]
+        del self._stderr[:n]
+
+    def to_dicts(self, start: int) -> List[Dict[str, Any]]:
+        return [
+            dict(timestamp=self._timestamps[i], text=self._texts[i], stderr=bool(self._stderr[i]))
+            for i in range(start, len(self._texts))
+        ]
 
 class CustomStdout():
-    def __init__(self, label: str, console_out: dict, original_stdout, stderr: bool=False, show_console: bool=True):
+    def __init__(self, label: str, console_buffer: _ConsoleBuffer, original_stdout, stderr: bool=False, show_console: bool=True, log_writer: Union[_ConsoleLogWriter, None]=None):
         self._label = label
-        self._console_out = console_out
+        self._console_buffer = console_buffer
         self._original_stdout = original_stdout
-        self._stderr = False
+        self._stderr = stderr
         self._show_console = show_console
+        self._log_writer = log_writer
+        self._partial_line = ''
 
     def write(self, data: str) -> None:
-        lines = data.splitlines(keepends=False)
-        for line in lines:
-            if line:
-                a: Dict[Union[float, str, bool]] = dict(
-                    timestamp=time.time() - 0,
-                    text=line
-                )
-                a['stderr'] = self._stderr
-                self._console_out['lines'].append(a)
-                if self._show_console:
-                    print('{} {}: {}'.format(self._label, _fmt_time(a['timestamp']), a['text']), file=self._original_stdout)
-        
+        # print() writes its arguments and the line ending separately, so text is
+        # accumulated until a line is complete
+        if '\n' not in data and '\r' not in data and len(self._partial_line) < _MAX_PARTIAL_LINE_LENGTH:
+            self._partial_line += data
+            return
+        lines = (self._partial_line + data).splitlines(keepends=True)
+        self._partial_line = ''
+        if not lines[-1].endswith(('\n', '\r')) and len(lines[-1]) < _MAX_PARTIAL_LINE_LENGTH:
+            self._partial_line = lines.pop()
+        self._add_lines([line.rstrip('\r\n') for line in lines])
+
     def flush(self) -> None:
-        pass
+        # an explicit flush (e.g., after a progress message) makes the text so far visible
+        self._flush_partial_line()
+        if self._log_writer is not None:
+            self._log_writer.flush()
+
+    def _flush_partial_line(self) -> None:
+        if self._partial_line:
+            lines = [self._partial_line]
+            self._partial_line = ''
+            self._add_lines(lines)
+
+    def _add_lines(self, lines: List[str]) -> None:
+        lines = [line for line in lines if line]
+        if len(lines) == 0:
+            return
+        # all lines of a single write get the same timestamp, formatted at most once
+        timestamp = time.time()
+        if self._log_writer is not None:
+            for line in lines:
+                self._log_writer.append(timestamp, line, self._stderr)
+        else:
+            self._console_buffer.append(timestamp, lines, self._stderr)
+        if self._show_console:
+            prefix = '{} {}: '.format(self._label, _fmt_time(timestamp))
+            self._original_stdout.write(''.join([prefix + line + '\n' for line in lines]))
 
 def _fmt_time(t):
-    import datetime
     return datetime.datetime.fromtimestamp(t).isoformat()
 
 class ConsoleCapture():
-    def __init__(self, label: str='', show_console: bool=True):
+    def __init__(self, label: str='', show_console: bool=True, log_path: Union[str, None]=None, max_lines: Union[int, None]=None):
+        """Capture stdout and stderr
+
+        If log_path is given, the output is streamed to that file (see _consolelog.py) rather than
+        kept in memory, and the runtime info only holds a reference to the log. Otherwise at most
+        max_lines lines are kept (default: CONSOLE_MAX_LINES), see _ConsoleBuffer.
+        """
         self._label = label
-        self._console_out = dict(label=label, lines=[])
+        if max_lines is None:
+            max_lines = CONSOLE_MAX_LINES
+        self._console_buffer = _ConsoleBuffer(max_lines=max_lines)
+        self._log_path = log_path
+        self._log_writer: Union[_ConsoleLogWriter, None] = None
         self._time_start = None
         self._time_stop = None
         self._original_stdout = sys.stdout
@@ -50,23 +162,41 @@ class ConsoleCapture():
 
     def _start_capturing(self) -> None:
         self._time_start = time.time()
-        sys.stdout = CustomStdout(self._label, self._console_out, self._original_stdout, show_console=self._show_console)
-        sys.stderr = CustomStdout(self._label, self._console_out, self._original_stderr, stderr=True, show_console=self._show_console)
+        if self._log_path is not None:
+            self._log_writer = _ConsoleLogWriter(self._log_path)
+        self._custom_stdout = CustomStdout(self._label, self._console_buffer, self._original_stdout, show_console=self._show_console, log_writer=self._log_writer)
+        self._custom_stderr = CustomStdout(self._label, self._console_buffer, self._original_stderr, stderr=True, show_console=self._show_console, log_writer=self._log_writer)
+        sys.stdout = self._custom_stdout
+        sys.stderr = self._custom_stderr
 
     def _stop_capturing(self) -> None:
         self._time_stop = time.time()
+        self._custom_stdout._flush_partial_line()
+        self._custom_stderr._flush_partial_line()
         sys.stdout.flush()
         sys.stderr.flush()
         sys.stdout = self._original_stdout
         sys.stderr = self._original_stderr
+        if self._log_writer is not None:
+            self._log_writer.close()
 
     def runtime_info(self) -> dict:
         assert self._time_start is not None
         time_stop = self._time_stop
         if time_stop is None: time_stop = time.time()
+        if self._log_path is not None:
+            return dict(
+                start_time=self._time_start - 0,
+                end_time=time_stop - 0,
+                elapsed_sec = time_stop - self._time_start,
+                console_log=dict(label=self._label, path=self._log_path, sha1_path=None)
+            )
+        console_out: Dict[str, Any] = dict(label=self._label, lines=self._console_buffer.lines())
+        if self._console_buffer.num_dropped() > 0:
+            console_out['num_dropped_lines'] = self._console_buffer.num_dropped()
         return dict(
             start_time=self._time_start - 0,
             end_time=time_stop - 0,
             elapsed_sec = time_stop - self._time_start,
-            console_out=self._console_out
-        )
\ No newline at end of file
+            console_out=console_out
+        )
@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+import time
+from typing import Any, List, Tuple, Union
+
+# Console output of a job is appended to a JSON-lines file (one {timestamp, text, stderr} record per
+# line of output) while the job runs, in chunks of at most _MAX_CHUNK_LINES lines, at least every
+# _FLUSH_INTERVAL seconds. The job's runtime_info then only holds a reference to the log:
+#     runtime_info['console_log'] = dict(label=<label>, path=<local path>, sha1_path=<kachery sha1 path or None>)
+# When the job completes, the log is stored in the local kachery storage (sha1_path) and the local file is
+# removed (see _finalize_console_log); a compute resource then also stores it in its kachery for the client.
+_FLUSH_INTERVAL = 1
+_MAX_CHUNK_LINES = 1000
+
+def _get_console_logs_dir() -> str:
+    storage_dir = os.getenv('KACHERY_STORAGE_DIR', None)
+    if not storage_dir:
+        raise Exception('You must set the environment variable: KACHERY_STORAGE_DIR')
+    return os.path.join(storage_dir, 'hither2_console_logs')
+
+def _console_log_path(job_id: str) -> str:
+    return os.path.join(_get_console_logs_dir(), f'{job_id}.jsonl')
+
+class _ConsoleLogWriter:
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # the log of a job that is run again starts over
+        self._file = open(path, 'w', encoding='utf-8')
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        # flush periodically even if the job goes quiet
+        self._thread = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._thread.start()
+
+    def append(self, timestamp: float, text: str, stderr: bool) -> None:
+        record = json.dumps(dict(timestamp=timestamp, text=text, stderr=stderr))
+        with self._lock:
+            self._buffer.append(record)
+            if len(self._buffer) >= _MAX_CHUNK_LINES:
+                self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+            self._closed = True
+            self._file.close()
+
+    def _flush(self) -> None:
+        if self._closed or len(self._buffer) == 0:
+            return
+        self._file.write('\n'.join(self._buffer) + '\n')
+        self._file.flush()
+        self._buffer = []
+
+    def _flush_periodically(self) -> None:
+        while not self._closed:
+            time.sleep(_FLUSH_INTERVAL)
+            self.flush()
+
+def _finalize_console_log(console_log: dict) -> None:
+    # Once the job is complete the log is read from kachery, so the local file need not be kept
+    path = console_log.get('path', None)
+    if console_log.get('sha1_path', None) is not None or path is None or not os.path.exists(path):
+        return
+    import kachery as ka
+    console_log['sha1_path'] = ka.store_file(path)
+    if console_log['sha1_path'] is not None:
+        os.remove(path)
+
+def tail_console_log(console_log: Union[dict, Any], offset: int=0, kachery: Union[str, None]=None) -> Tuple[List[dict], int]:
+    """Read the console output of a job, starting from a byte offset of its log.
+
+    Can be called repeatedly while the job is running (on the machine where it runs) to
+    follow its output: pass the returned offset to the next call.
+
+    Parameters
+    ----------
+    console_log : dict or Job
+        The job's runtime_info['console_log'], or the Job itself
+    offset : int, optional
+        Where to start reading, by default 0
+    kachery : Union[str, None], optional
+        The kachery to load the log from once it was stored by the compute resource, by default None
+
+    Returns
+    -------
+    Tuple[List[dict], int]
+        The new console lines (each a dict with timestamp, text and stderr), and the offset to continue from
+    """
+    path = _local_console_log_path(console_log, kachery=kachery)
+    if path is None:
+        return [], offset
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    # only complete records
+    end = data.rfind(b'\n') + 1
+    lines = [json.loads(line) for line in data[:end].decode('utf-8').splitlines() if line]
+    return lines, offset + end
+
+def read_console_log(console_log: Union[dict, Any], kachery: Union[str, None]=None) -> List[dict]:
+    """Read all of the console output of a job (see tail_console_log)."""
+    lines, _ = tail_console_log(console_log, offset=0, kachery=kachery)
+    return lines
+
+def _local_console_log_path(console_log: Union[dict, Any], kachery: Union[str, None]) -> Union[str, None]:
+    if not isinstance(console_log, dict):
+        # a Job
+        job = console_log
+        runtime_info = job._runtime_info
+        if runtime_info is not None and runtime_info.get('console_log', None) is not None:
+            console_log = runtime_info['console_log']
+        else:
+            console_log = dict(path=_console_log_path(job._job_id), sha1_path=None)
+    path = console_log.get('path', None)
+    if path is not None and os.path.exists(path):
+        return path
+    if console_log.get('sha1_path', None) is not None:
+        import kachery as ka
+        return ka.load_file(console_log['sha1_path'], fr=kachery)
+    return None
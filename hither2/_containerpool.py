@@ -0,0 +1,327 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List, Union
+from ._containerregistry import _resolve_singularity_container
+from ._util import _docker_form_of_container_string, _random_string
+
+# Set HITHER_CONTAINER_POOL=TRUE to run containerized jobs in long-running worker containers
+# (one job at a time per worker) rather than starting a new container for each job.
+# Workers exit after being idle for HITHER_CONTAINER_POOL_IDLE_TIMEOUT seconds, or after running
+# HITHER_CONTAINER_POOL_MAX_JOBS_PER_WORKER jobs. At most HITHER_CONTAINER_POOL_MAX_WORKERS workers
+# are started per container image; when they are all busy, jobs run in one-off containers as usual.
+_MAX_WORKERS = int(os.getenv('HITHER_CONTAINER_POOL_MAX_WORKERS', '4'))
+_IDLE_TIMEOUT = float(os.getenv('HITHER_CONTAINER_POOL_IDLE_TIMEOUT', '300'))
+_MAX_JOBS_PER_WORKER = int(os.getenv('HITHER_CONTAINER_POOL_MAX_JOBS_PER_WORKER', '100'))
+
+# A worker that has not updated its heartbeat file for this many seconds is considered dead
+_HEARTBEAT_TIMEOUT = 20
+# Number of seconds to wait for a newly started worker to report that it is ready
+_STARTUP_TIMEOUT = 60
+
+# The worker runs inside the container, so it only relies on the standard library and
+# should stay compatible with older versions of Python.
+#
+# Protocol (all files are in the worker directory):
+#   heartbeat    touched by the worker every couple of seconds
+#   lock         flock-ed by the host process that is using the worker, and by the
+#                worker itself when it decides to exit for being idle
+#   job.json     written (atomically) by the host to submit a job
+#   done.json    written (atomically) by the worker when the job completes, with the
+#                job_id of job.json so that a stale one is never taken for the current job
+#   exited       written by the worker before it exits
+#   pid          (singularity only) process id of the host process running the worker
+_WORKER_SCRIPT = '''
+import fcntl
+import json
+import os
+import runpy
+import sys
+import time
+import traceback
+
+def main():
+    worker_dir = sys.argv[1]
+    idle_timeout = float(sys.argv[2])
+    max_jobs = int(sys.argv[3])
+    try:
+        # preload so that the forked jobs do not pay for the import
+        import numpy
+    except ImportError:
+        pass
+    job_fname = os.path.join(worker_dir, 'job.json')
+    heartbeat = _Heartbeat(os.path.join(worker_dir, 'heartbeat'))
+    num_jobs = 0
+    timestamp_last_job = time.time()
+    while True:
+        heartbeat.beat()
+        if os.path.exists(job_fname):
+            with open(job_fname, 'r') as f:
+                job = json.load(f)
+            os.remove(job_fname)
+            exit_code = _run_job(job, heartbeat)
+            num_jobs += 1
+            if num_jobs >= max_jobs:
+                _write_file(os.path.join(worker_dir, 'exited'), 'max_jobs')
+            _write_file(os.path.join(worker_dir, 'done.json'), json.dumps(dict(job_id=job['job_id'], exit_code=exit_code)))
+            if num_jobs >= max_jobs:
+                return
+            timestamp_last_job = time.time()
+            continue
+        if time.time() - timestamp_last_job > idle_timeout:
+            with open(os.path.join(worker_dir, 'lock'), 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    lock_file = None
+                if lock_file is not None and not os.path.exists(job_fname):
+                    _write_file(os.path.join(worker_dir, 'exited'), 'idle')
+                    return
+        time.sleep(0.01)
+
+class _Heartbeat:
+    def __init__(self, fname):
+        self._fname = fname
+        self._timestamp = 0
+    def beat(self):
+        if time.time() - self._timestamp > 2:
+            _write_file(self._fname, str(time.time()))
+            self._timestamp = time.time()
+
+def _run_job(job, heartbeat):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 1
+        try:
+            os.chdir(job['job_dir'])
+            for fd, fname in [(1, job['stdout']), (2, job['stderr'])]:
+                fd0 = os.open(fname, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                os.dup2(fd0, fd)
+                os.close(fd0)
+            os.environ.update(job['env'])
+            sys.path[0:0] = [job['job_dir']] + job['python_path']
+            sys.argv = [job['script']] + job['args']
+            runpy.run_path(job['script'], run_name='__main__')
+            exit_code = 0
+        except SystemExit as e:
+            if e.code is None:
+                exit_code = 0
+            elif isinstance(e.code, int):
+                exit_code = e.code
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exit_code)
+    while True:
+        pid0, status = os.waitpid(pid, os.WNOHANG)
+        if pid0 != 0:
+            break
+        heartbeat.beat()
+        time.sleep(0.01)
+    if os.WIFEXITED(status):
+        return os.WEXITSTATUS(status)
+    return 1
+
+def _write_file(fname, txt):
+    with open(fname + '.tmp', 'w') as f:
+        f.write(txt)
+    os.rename(fname + '.tmp', fname)
+
+if __name__ == '__main__':
+    main()
+'''
+
+def _container_pool_enabled() -> bool:
+    return (os.getenv('HITHER_CONTAINER_POOL', None) == 'TRUE') and (sys.platform != 'win32')
+
+def _run_job_in_pooled_container(*, container: str, job_dir: str, script: str, args: List[str], env: Dict[str, str], python_path: List[str],
+        stdout: str, stderr: str, timeout: Union[float, None]=None) -> Union[int, None]:
+    """Run a python script in a worker container from the pool for this container.
+
+    All paths are as seen from inside the container, where $KACHERY_STORAGE_DIR is
+    mounted at /kachery-storage. Returns the exit code of the script, or None if no
+    worker was available (in which case nothing was run). If the script does not
+    complete within timeout seconds, the worker is killed and an exception is raised.
+    """
+    worker = _acquire_worker(container)
+    if worker is None:
+        return None
+    try:
+        done_fname = os.path.join(worker.path, 'done.json')
+        # left over from a host that gave up on its job (e.g., it was killed)
+        if os.path.exists(done_fname):
+            os.remove(done_fname)
+        job_id = _random_string(10)
+        job = dict(job_id=job_id, job_dir=job_dir, script=script, args=args, env=env, python_path=python_path, stdout=stdout, stderr=stderr)
+        _write_file(os.path.join(worker.path, 'job.json'), json.dumps(job))
+        timestamp_alive = time.time()
+        timestamp_submitted = time.time()
+        while True:
+            if os.path.exists(done_fname):
+                with open(done_fname, 'r') as f:
+                    done = json.load(f)
+                os.remove(done_fname)
+                if done.get('job_id', None) == job_id:
+                    return done['exit_code']
+            if worker.is_alive():
+                timestamp_alive = time.time()
+            elif time.time() - timestamp_alive > 2:
+                # (a worker that reaches its job limit marks itself as exited just before writing done.json)
+                raise Exception(f'Worker container exited unexpectedly while running job: {worker.path}')
+            if timeout is not None and time.time() - timestamp_submitted > timeout:
+                # the worker is still busy with the job, so it cannot be reused
+                _remove_worker(worker.path)
+                raise Exception(f'Job timed out after {timeout} seconds in worker container: {worker.path}')
+            time.sleep(0.01)
+    finally:
+        worker.release()
+
+class _Worker:
+    def __init__(self, path: str, lock_file):
+        self.path = path
+        self._lock_file = lock_file
+
+    def is_alive(self) -> bool:
+        if os.path.exists(os.path.join(self.path, 'exited')):
+            return False
+        try:
+            heartbeat_time = os.stat(os.path.join(self.path, 'heartbeat')).st_mtime
+        except FileNotFoundError:
+            return False
+        return time.time() - heartbeat_time < _HEARTBEAT_TIMEOUT
+
+    def release(self) -> None:
+        self._lock_file.close()
+
+def _acquire_worker(container: str) -> Union[_Worker, None]:
+    pool_dir = _get_pool_dir(container)
+    os.makedirs(pool_dir, exist_ok=True)
+    num_workers = 0
+    for worker_id in sorted(os.listdir(pool_dir)):
+        worker_path = os.path.join(pool_dir, worker_id)
+        lock_file = _try_lock(worker_path)
+        if lock_file is None:
+            # busy (or starting up)
+            num_workers += 1
+            continue
+        worker = _Worker(worker_path, lock_file)
+        if worker.is_alive():
+            return worker
+        _remove_worker(worker_path)
+        worker.release()
+    if num_workers >= _MAX_WORKERS:
+        return None
+    return _start_worker(container, pool_dir)
+
+def _start_worker(container: str, pool_dir: str) -> Union[_Worker, None]:
+    worker_id = _random_string(10)
+    worker_path = os.path.join(pool_dir, worker_id)
+    os.mkdir(worker_path)
+    lock_file = _try_lock(worker_path)
+    assert lock_file is not None
+    worker = _Worker(worker_path, lock_file)
+    worker_path_in_container = _path_in_container(worker_path)
+    script_path_in_container = _path_in_container(_write_worker_script())
+    args = ['python3', script_path_in_container, worker_path_in_container, str(_IDLE_TIMEOUT), str(_MAX_JOBS_PER_WORKER)]
+    storage_dir = os.environ['KACHERY_STORAGE_DIR']
+    num_workers_env = os.getenv('NUM_WORKERS', '')
+    # these need to be set before numpy is imported by the worker
+    thread_env = dict(NUM_WORKERS=num_workers_env, MKL_NUM_THREADS=num_workers_env, NUMEXPR_NUM_THREADS=num_workers_env, OMP_NUM_THREADS=num_workers_env)
+    popen_env = None
+    if os.getenv('HITHER_USE_SINGULARITY', None) == 'TRUE':
+        cmd = ['singularity', 'exec', '-e', '-B', f'{storage_dir}:/kachery-storage', _resolve_singularity_container(container)] + args
+        popen_env = dict(os.environ, **{'SINGULARITYENV_' + k: v for k, v in thread_env.items()})
+    else:
+        container_name = 'hither2_pool_' + worker_id
+        with open(os.path.join(worker_path, 'container_name'), 'w') as f:
+            f.write(container_name)
+        cmd = ['docker', 'run', '-d', '--rm', '--name', container_name,
+            '-v', '/etc/localtime:/etc/localtime:ro',
+            '-v', '/etc/passwd:/etc/passwd', '-u', f'{os.getuid()}:{os.getgid()}',
+            '-v', f'{storage_dir}:/kachery-storage',
+            '-v', '/tmp:/tmp',
+            '-v', '{0}:{0}'.format(os.environ['HOME'])]
+        for k, v in thread_env.items():
+            cmd.extend(['-e', f'{k}={v}'])
+        cmd = cmd + [_docker_form_of_container_string(container)] + args
+    print(f'Starting worker container for {container}: {worker_id}')
+    with open(os.path.join(worker_path, 'log.txt'), 'w') as log_file:
+        process = subprocess.Popen(cmd, stdout=log_file, stderr=subprocess.STDOUT, env=popen_env, start_new_session=True)
+    if os.getenv('HITHER_USE_SINGULARITY', None) == 'TRUE':
+        # there is no container to remove, so the worker is stopped by killing its process group
+        with open(os.path.join(worker_path, 'pid'), 'w') as f:
+            f.write(str(process.pid))
+    timer = time.time()
+    while not worker.is_alive():
+        if time.time() - timer > _STARTUP_TIMEOUT:
+            print(f'Warning: worker container did not start for {container}. See {worker_path}/log.txt')
+            _remove_worker(worker_path)
+            worker.release()
+            return None
+        time.sleep(0.05)
+    return worker
+
+def _remove_worker(worker_path: str) -> None:
+    container_name_fname = os.path.join(worker_path, 'container_name')
+    if os.path.exists(container_name_fname):
+        with open(container_name_fname, 'r') as f:
+            container_name = f.read()
+        subprocess.run(['docker', 'rm', '-f', container_name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    pid_fname = os.path.join(worker_path, 'pid')
+    if os.path.exists(pid_fname):
+        with open(pid_fname, 'r') as f:
+            pid = int(f.read())
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    shutil.rmtree(worker_path, ignore_errors=True)
+
+def _try_lock(worker_path: str):
+    lock_file = open(os.path.join(worker_path, 'lock'), 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def _get_pool_root() -> str:
+    return os.path.join(os.environ['KACHERY_STORAGE_DIR'], 'hither2_container_pool')
+
+def _get_pool_dir(container: str) -> str:
+    singularity = os.getenv('HITHER_USE_SINGULARITY', None) == 'TRUE'
+    # workers running another version of the worker script may not follow the same protocol
+    script_hash = hashlib.sha1(_WORKER_SCRIPT.encode('utf-8')).hexdigest()[:16]
+    key = json.dumps([container, singularity, os.getenv('NUM_WORKERS', ''), script_hash])
+    return os.path.join(_get_pool_root(), hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+
+def _write_worker_script() -> str:
+    script_hash = hashlib.sha1(_WORKER_SCRIPT.encode('utf-8')).hexdigest()[:16]
+    path = os.path.join(_get_pool_root(), f'worker_{script_hash}.py')
+    if not os.path.exists(path):
+        _write_file(path, _WORKER_SCRIPT)
+    return path
+
+def _path_in_container(path: str) -> str:
+    # $KACHERY_STORAGE_DIR is mounted at /kachery-storage in the worker containers
+    relpath = os.path.relpath(path, os.environ['KACHERY_STORAGE_DIR'])
+    if relpath.startswith('..'):
+        raise Exception(f'Path is not in the kachery storage directory: {path}')
+    return '/kachery-storage/' + relpath
+
+def _write_file(fname: str, txt: str) -> None:
+    tmp_fname = fname + '.tmp_' + _random_string(6)
+    with open(tmp_fname, 'w') as f:
+        f.write(txt)
+    os.rename(tmp_fname, fname)
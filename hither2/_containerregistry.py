@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import subprocess
+import time
+from typing import Union
+from ._filelock import FileLock
+from ._util import _docker_form_of_container_string, _random_string
+
+# On-disk record of the containers that have been prepared (pulled/built) on this machine,
+# shared by all processes using the same $KACHERY_STORAGE_DIR. Each entry is a small json
+# file named by the hash of the container reference, next to a lock file that is held
+# while the container is being prepared.
+
+# A tag (e.g., :latest) may be moved to another image, so a docker image referenced by a tag is
+# pulled again when it was last pulled more than HITHER_DOCKER_PULL_TTL seconds ago. Images
+# referenced by digest (@sha256:...) never change, so they are not pulled again.
+DOCKER_PULL_TTL = float(os.getenv('HITHER_DOCKER_PULL_TTL', '3600'))
+
+def _get_registry_dir() -> Union[str, None]:
+    storage_dir = os.getenv('KACHERY_STORAGE_DIR', None)
+    if not storage_dir:
+        return None
+    return os.path.join(storage_dir, 'hither2_container_registry')
+
+def _entry_path(kind: str, container: str) -> Union[str, None]:
+    registry_dir = _get_registry_dir()
+    if registry_dir is None:
+        return None
+    key = hashlib.sha1(f'{kind}:{container}'.encode('utf-8')).hexdigest()
+    return os.path.join(registry_dir, kind, key)
+
+class _RegistryLock:
+    def __init__(self, kind: str, container: str):
+        """Held while a container is being prepared, so that concurrent processes prepare it only once."""
+        path = _entry_path(kind, container)
+        self._lock: Union[FileLock, None] = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._lock = FileLock(path + '.lock', exclusive=True)
+
+    def __enter__(self):
+        if self._lock is not None:
+            self._lock.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._lock is not None:
+            self._lock.__exit__(exc_type, exc_val, exc_tb)
+
+def _load_registry_entry(kind: str, container: str) -> Union[dict, None]:
+    path = _entry_path(kind, container)
+    if path is None or not os.path.exists(path + '.json'):
+        return None
+    try:
+        with open(path + '.json', 'r') as f:
+            return json.load(f)
+    except:
+        return None
+
+def _save_registry_entry(kind: str, container: str, entry: dict) -> None:
+    path = _entry_path(kind, container)
+    if path is None:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    entry = dict(entry, container=container, prepared_at=time.time())
+    tmp_path = path + '.json.tmp_' + _random_string(6)
+    with open(tmp_path, 'w') as f:
+        json.dump(entry, f)
+    os.rename(tmp_path, path + '.json')
+
+def _docker_pull_is_current(container: str, entry: Union[dict, None]) -> bool:
+    # Whether the image pulled before (see _save_registry_entry) can be used without pulling again
+    if entry is None or entry.get('image_id', None) is None or _docker_image_id(container) != entry['image_id']:
+        return False
+    if '@sha256:' in container:
+        return True
+    return time.time() - entry['prepared_at'] < DOCKER_PULL_TTL
+
+def _docker_image_id(container: str) -> Union[str, None]:
+    # The local id (digest) of the image, or None if the image is not present locally
+    try:
+        p = subprocess.run(['docker', 'image', 'inspect', '--format', '{{.Id}}', _docker_form_of_container_string(container)],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except FileNotFoundError:
+        return None
+    if p.returncode != 0:
+        return None
+    return p.stdout.decode('utf-8').strip()
+
+def _singularity_image_path(container: str) -> Union[str, None]:
+    # Where the SIF file for a singularity container reference (e.g., docker://...) is stored
+    path = _entry_path('singularity', container)
+    if path is None:
+        return None
+    return path + '.sif'
+
+def _resolve_singularity_container(container: str) -> str:
+    """The SIF file prepared for the container, if there is one, otherwise the container reference itself."""
+    entry = _load_registry_entry('singularity', container)
+    if entry is not None and os.path.exists(entry['sif_path']):
+        return entry['sif_path']
+    return container
@@ -0,0 +1,71 @@
+import inspect
+import os
+
+# The decorators of hither functions, which do not depend on the rest of hither2 (the jobs are
+# created by core.py when the functions are run). The code of the functions can then be imported
+# where only the runtime part of hither2 is available (see runtime.py).
+
+_global_registered_functions_by_name = dict()
+
+def container(container):
+    assert container.startswith('docker://'), f"Container string {container} must begin with docker://"
+    def wrap(f):
+        setattr(f, '_hither_container', container)
+        return f
+    return wrap
+
+def opts(no_resolve_input_files=None, profile=None):
+    def wrap(f):
+        if no_resolve_input_files is not None:
+            setattr(f, '_no_resolve_input_files', no_resolve_input_files)
+        if profile is not None:
+            setattr(f, '_hither_profile', profile)
+        return f
+    return wrap
+
+
+def additional_files(additional_files):
+    def wrap(f):
+        setattr(f, '_hither_additional_files', additional_files)
+        return f
+    return wrap
+
+def local_modules(local_modules):
+    def wrap(f):
+        setattr(f, '_hither_local_modules', local_modules)
+        return f
+    return wrap
+
+# run a registered function by name
+def run(function_name, **kwargs):
+    assert function_name in _global_registered_functions_by_name, f'Hither function {function_name} not registered'
+    f = _global_registered_functions_by_name[function_name]
+    return f.run(**kwargs)
+
+############################################################
+def function(name, version):
+    def wrap(f):
+        # register the function
+        assert f.__name__ == name, f"Name does not match function name: {name} <> {f.__name__}"
+        if name in _global_registered_functions_by_name:
+            path1 = _function_path(f)
+            path2 = _function_path(_global_registered_functions_by_name[name])
+            if path1 != path2:
+                print(f"Warning: Hither function with name {name} is registered in two different files: {path1} {path2}")
+        else:
+            _global_registered_functions_by_name[name] = f
+        
+        def run(**arguments_for_wrapped_function):
+            try:
+                from .core import _queue_function_job
+            except ModuleNotFoundError as e:
+                if e.name != 'hither2.core':
+                    raise
+                raise Exception('Unable to run a hither2 function from a function that was shipped with only the runtime part of hither2. Unset HITHER_RUNTIME_ONLY_CODE.') from e
+            return _queue_function_job(f, name=name, version=version, arguments_for_wrapped_function=arguments_for_wrapped_function)
+        setattr(f, 'run', run)
+        return f
+    return wrap
+
+def _function_path(f):
+    return os.path.abspath(inspect.getfile(f))
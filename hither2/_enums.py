@@ -12,6 +12,7 @@ class JobStatus(Enum):
     PENDING = 'pending' # remote-only status
     WAITING = 'waiting' # remote-only status
     QUEUED = 'queued'
+    PREPARING = 'preparing' # queued, waiting for its container to be prepared
     RUNNING = 'running'
     FINISHED = 'finished'
     CANCELED = 'canceled' # remote-only status (for compute resource/Slurm/etc)
@@ -22,11 +23,11 @@ class JobStatus(Enum):
 
     @classmethod
     def incomplete_statuses(cls: Type['JobStatus']) -> List['JobStatus']:
-        return [JobStatus.QUEUED, JobStatus.RUNNING]
+        return [JobStatus.QUEUED, JobStatus.PREPARING, JobStatus.RUNNING]
 
     @classmethod
     def prerun_statuses(cls: Type['JobStatus']) -> List['JobStatus']:
-        return [JobStatus.PENDING, JobStatus.QUEUED]
+        return [JobStatus.PENDING, JobStatus.QUEUED, JobStatus.PREPARING]
 
 class HitherFileType(Enum):
     FILE = 'file'
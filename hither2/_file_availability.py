@@ -0,0 +1,55 @@
+import os
+from typing import List, Set, Tuple, Union
+
+import kachery as ka
+from .file import File
+
+# (kachery storage dir, sha1 path) pairs known to be available locally during this session
+_known_local_sha1_paths: Set[Tuple[Union[str, None], str]] = set()
+
+def _files_are_available_locally(files: List[File]) -> bool:
+    """Check whether all the given Files are stored in the local kachery storage.
+
+    Rather than asking kachery about each file individually, sha1:// paths are
+    resolved directly to their location in the local storage directory, which
+    costs one os.path.exists per file. Anything not found that way (e.g.,
+    sha1dir:// paths) falls back to ka.get_file_info. Positive answers are
+    remembered for the rest of the session.
+    """
+    storage_dir = _local_kachery_storage_dir()
+    sha1_paths = []
+    seen: Set[str] = set()
+    for f in files:
+        key = (storage_dir, f._sha1_path)
+        if key not in _known_local_sha1_paths and f._sha1_path not in seen:
+            seen.add(f._sha1_path)
+            sha1_paths.append(f._sha1_path)
+
+    for sha1_path in sha1_paths:
+        if not _sha1_file_exists_in_storage(storage_dir, sha1_path):
+            if ka.get_file_info(sha1_path, fr=None) is None:
+                return False
+        _known_local_sha1_paths.add((storage_dir, sha1_path))
+    return True
+
+def _local_kachery_storage_dir() -> str:
+    # same default as kachery when KACHERY_STORAGE_DIR is not set
+    storage_dir = os.getenv('KACHERY_STORAGE_DIR', None)
+    if storage_dir is None:
+        storage_dir = os.path.join(os.path.expanduser('~'), 'kachery-storage')
+    return storage_dir
+
+def _sha1_file_exists_in_storage(storage_dir: str, sha1_path: str) -> bool:
+    sha1 = _sha1_of_path(sha1_path)
+    if sha1 is None:
+        return False
+    # kachery stores the file with hash abcdef... at <storage_dir>/sha1/ab/cd/ef/abcdef...
+    return os.path.exists(os.path.join(storage_dir, 'sha1', sha1[0:2], sha1[2:4], sha1[4:6], sha1))
+
+def _sha1_of_path(sha1_path: str) -> Union[str, None]:
+    if not sha1_path.startswith('sha1://'):
+        return None
+    sha1 = sha1_path[len('sha1://'):].split('/')[0]
+    if len(sha1) != 40:
+        return None
+    return sha1
@@ -0,0 +1,91 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Union
+
+from .file import File
+from ._util import _copy_structure_with_changes, _flatten_nested_collection
+
+# Upper bound on the number of simultaneous kachery transfers for a single job
+_MAX_WORKERS = int(os.getenv('HITHER_FILE_TRANSFER_MAX_WORKERS', '8'))
+# Upper bound on the number of simultaneous transfers against any one kachery host
+_MAX_PER_HOST = int(os.getenv('HITHER_FILE_TRANSFER_MAX_PER_HOST', '4'))
+
+_host_semaphores: Dict[str, threading.Semaphore] = dict()
+_host_semaphores_lock = threading.Lock()
+
+def _host_key(kachery: Union[str, dict, None]) -> str:
+    # The kachery argument may be None (local storage), a preset name, or a config dict
+    if kachery is None:
+        return 'local'
+    if isinstance(kachery, dict):
+        return str(kachery.get('url', kachery))
+    return str(kachery)
+
+def _host_semaphore(kachery: Union[str, dict, None]) -> threading.Semaphore:
+    key = _host_key(kachery)
+    with _host_semaphores_lock:
+        if key not in _host_semaphores:
+            _host_semaphores[key] = threading.Semaphore(_MAX_PER_HOST)
+        return _host_semaphores[key]
+
+def _for_each_file(files: List[File], action: Callable[[File], Any], *,
+        kachery: Union[str, dict, None]=None, label: Union[str, None]=None) -> List[Any]:
+    """Apply <action> to each File concurrently, returning the results in the same order.
+
+    At most _MAX_WORKERS actions run at once, and at most _MAX_PER_HOST of those
+    may target the same kachery host. The first exception raised by an action is
+    re-raised once all actions have completed. If <label> is given, progress
+    is printed as the actions complete.
+    """
+    if len(files) == 0:
+        return []
+    if len(files) == 1:
+        return [action(files[0])]
+    semaphore = _host_semaphore(kachery)
+    num_total = len(files)
+    progress = dict(num_done=0)
+    progress_lock = threading.Lock()
+    report_every = max(1, num_total // 4)
+
+    def do_action(f: File) -> Any:
+        with semaphore:
+            ret = action(f)
+        with progress_lock:
+            progress['num_done'] += 1
+            num_done = progress['num_done']
+        if label is not None and (num_done % report_every == 0 or num_done == num_total):
+            print(f'{label} files: {num_done}/{num_total}')
+        return ret
+
+    with ThreadPoolExecutor(max_workers=min(_MAX_WORKERS, num_total)) as executor:
+        futures = [executor.submit(do_action, f) for f in files]
+    return [fut.result() for fut in futures]
+
+def _ensure_files_available_locally(x: Any, kachery: Union[str, dict, None]=None) -> None:
+    """Download (concurrently) every File in the nested structure <x> that is not available locally.
+    """
+    files = _unique_files(_flatten_nested_collection(x, _type=File))
+    _for_each_file(files, lambda f: f.ensure_local_availability(kachery), kachery=kachery, label='Downloading')
+
+def _resolve_files_in_item(x: Any) -> Any:
+    """Return a copy of <x> where each File has been resolved (concurrently) to a local path or ndarray.
+    """
+    files = _unique_files(_flatten_nested_collection(x, _type=File))
+    resolved = _for_each_file(files, lambda f: f.resolve())
+    resolved_by_key = {_file_key(f): r for f, r in zip(files, resolved)}
+    return _copy_structure_with_changes(x, lambda f: resolved_by_key[_file_key(f)], _type=File, _as_side_effect=False)
+
+def _file_key(f: File) -> tuple:
+    return (f._sha1_path, f._item_type)
+
+def _unique_files(files: List[File]) -> List[File]:
+    # The same file may appear more than once in a structure; only transfer it once
+    seen = set()
+    ret = []
+    for f in files:
+        key = _file_key(f)
+        if key not in seen:
+            seen.add(key)
+            ret.append(f)
+    return ret
@@ -1,38 +1,46 @@
-from typing import List
+from typing import Dict, List, Tuple
+import hashlib
+import json
 import os
 import inspect
 import fnmatch
 import kachery as ka
 import simplejson
 
+# Set HITHER_RUNTIME_ONLY_CODE=TRUE to ship only the runtime part of hither2 with the code of the functions,
+# rather than the whole package. Functions that themselves run hither2 jobs need the whole package.
+RUNTIME_ONLY_CODE = os.getenv('HITHER_RUNTIME_ONLY_CODE', 'FALSE') == 'TRUE'
+
+# Memoized outputs of _read_python_code_of_directory, by (dirname, exclude_init, additional_files).
+# Each entry holds the stat listing (see _stat_python_code_of_directory) that the content was read with.
+_directory_code_cache: Dict[Tuple[str, bool, Tuple[str, ...]], Tuple[list, dict]] = dict()
+
 def _generate_source_code_for_function(function, *, name: str, additional_files: list, local_modules: list) -> dict:
-    try:
-        function_source_fname = os.path.abspath(inspect.getsourcefile(function))
-    except:
-        raise Exception('Unable to get source file for function {}. Cannot run in a container or remotely.'.format(name))
+    """Collect the source code needed to run the function elsewhere (e.g., in a container).
+
+    Directory contents are memoized and only re-read when the names, sizes or
+    modification times of their files change. The returned object may be shared
+    between calls and must not be modified.
+    """
+    function_source_fname = _get_function_source_fname(function, name=name)
     function_source_dirname = os.path.dirname(function_source_fname)
     function_source_basename = os.path.basename(function_source_fname)
     function_source_basename_noext = os.path.splitext(function_source_basename)[0]
     assert isinstance(function_source_dirname, str)
-    code = _read_python_code_of_directory(
+    function_dir_code = _read_python_code_of_directory_memoized(
         function_source_dirname,
         additional_files=additional_files,
         exclude_init=True
     )
-    code['files'].append(dict(
-        name='__init__.py',
-        content='from .{} import {}'.format(
-            function_source_basename_noext, name)
-    ))
-    hither_dir = os.path.dirname(os.path.realpath(__file__))
-    kachery_dir = os.path.dirname(os.path.realpath(ka.__file__))
-    simplejson_dir = os.path.dirname(os.path.realpath(simplejson.__file__))
-    local_module_paths: List[str] = []
-    for lm in local_modules:
-        if os.path.isabs(lm):
-            local_module_paths.append(lm)
-        else:
-            local_module_paths.append(os.path.join(function_source_dirname, lm))
+    code = dict(
+        files=function_dir_code['files'] + [dict(
+            name='__init__.py',
+            content='from .{} import {}'.format(
+                function_source_basename_noext, name)
+        )],
+        dirs=list(function_dir_code['dirs'])
+    )
+    local_module_paths = _get_local_module_paths(function_source_dirname, local_modules)
     code['dirs'].append(dict(
         name='_local_modules',
         content=dict(
@@ -40,27 +48,112 @@ def _generate_source_code_for_function(function, *, name: str, additional_files:
             dirs=[
                 dict(
                     name=os.path.basename(local_module_path),
-                    content=_read_python_code_of_directory(os.path.join(function_source_dirname, local_module_path), exclude_init=False)
+                    content=_read_python_code_of_directory_memoized(os.path.join(function_source_dirname, local_module_path), exclude_init=False)
                 )
-                for local_module_path in local_module_paths + [hither_dir, kachery_dir, simplejson_dir]
+                for local_module_path in local_module_paths
+            ] + [
+                dict(
+                    name=os.path.basename(package_dir),
+                    content=_read_package_code(package_dir)
+                )
+                for package_dir in _get_package_dirs()
             ]
         )
     ))
     return code
 
-def _read_python_code_of_directory(dirname, exclude_init, additional_files=[]):
+def _function_code_fingerprint(function, *, name: str, additional_files: list, local_modules: list) -> str:
+    """Return a hash that changes whenever the output of _generate_source_code_for_function would.
+
+    Only file names, sizes and modification times are looked at (no file contents are
+    read), so this is much cheaper than generating the code.
+    """
+    function_source_fname = _get_function_source_fname(function, name=name)
+    function_source_dirname = os.path.dirname(function_source_fname)
+    entries = [function_source_fname, name, list(additional_files), RUNTIME_ONLY_CODE]
+    entries.append(_stat_python_code_of_directory(function_source_dirname, additional_files=additional_files, exclude_init=True))
+    for local_module_path in _get_local_module_paths(function_source_dirname, local_modules) + _get_package_dirs():
+        entries.append(_stat_python_code_of_directory(os.path.join(function_source_dirname, local_module_path), exclude_init=False))
+    return hashlib.sha1(json.dumps(entries).encode('utf-8')).hexdigest()
+
+def _read_python_code_of_directory_memoized(dirname, exclude_init, additional_files=[]) -> dict:
+    key = (dirname, exclude_init, tuple(additional_files))
+    stat = _stat_python_code_of_directory(dirname, exclude_init=exclude_init, additional_files=additional_files)
+    cached = _directory_code_cache.get(key, None)
+    if cached is not None and cached[0] == stat:
+        return cached[1]
+    content = _read_python_code_of_directory(dirname, exclude_init=exclude_init, additional_files=additional_files)
+    _directory_code_cache[key] = (stat, content)
+    return content
+
+def _get_function_source_fname(function, *, name: str) -> str:
+    try:
+        return os.path.abspath(inspect.getsourcefile(function))
+    except:
+        raise Exception('Unable to get source file for function {}. Cannot run in a container or remotely.'.format(name))
+
+def _get_local_module_paths(function_source_dirname: str, local_modules: list) -> List[str]:
+    local_module_paths: List[str] = []
+    for lm in local_modules:
+        if os.path.isabs(lm):
+            local_module_paths.append(lm)
+        else:
+            local_module_paths.append(os.path.join(function_source_dirname, lm))
+    return local_module_paths
+
+def _get_hither_dir() -> str:
+    return os.path.dirname(os.path.realpath(__file__))
+
+def _get_package_dirs() -> List[str]:
+    # packages that are shipped along with the function code
+    hither_dir = _get_hither_dir()
+    kachery_dir = os.path.dirname(os.path.realpath(ka.__file__))
+    simplejson_dir = os.path.dirname(os.path.realpath(simplejson.__file__))
+    return [hither_dir, kachery_dir, simplejson_dir]
+
+def _read_package_code(package_dir: str) -> dict:
+    content = _read_python_code_of_directory_memoized(package_dir, exclude_init=False)
+    if package_dir == _get_hither_dir() and RUNTIME_ONLY_CODE:
+        # only the part of hither2 that is needed to run the function (see runtime.py)
+        from .runtime import RUNTIME_MODULES
+        return dict(
+            files=[f for f in content['files'] if f['name'] in RUNTIME_MODULES],
+            dirs=[]
+        )
+    return content
+
+def _stat_python_code_of_directory(dirname, exclude_init, additional_files=[]) -> list:
+    # Same traversal as _read_python_code_of_directory, collecting (name, size, mtime) instead of contents
+    ret = []
+    for fname in sorted(os.listdir(dirname)):
+        path = dirname + '/' + fname
+        if os.path.isfile(path):
+            if _is_code_file(fname, exclude_init=exclude_init, additional_files=additional_files):
+                st = os.stat(path)
+                ret.append([fname, st.st_size, st.st_mtime_ns])
+        elif os.path.isdir(path):
+            if (not fname.startswith('__')) and (not fname.startswith('.')):
+                content = _stat_python_code_of_directory(path, additional_files=additional_files, exclude_init=False)
+                if len(content) > 0:
+                    ret.append([fname, content])
+    return ret
+
+def _is_code_file(fname, *, exclude_init, additional_files) -> bool:
     patterns = ['*.py'] + additional_files
+    matches = False
+    for pattern in patterns:
+        if fnmatch.fnmatch(fname, pattern):
+            matches = True
+    if exclude_init and (fname == '__init__.py'):
+        matches = False
+    return matches
+
+def _read_python_code_of_directory(dirname, exclude_init, additional_files=[]):
     files = []
     dirs = []
     for fname in os.listdir(dirname):
         if os.path.isfile(dirname + '/' + fname):
-            matches = False
-            for pattern in patterns:
-                if fnmatch.fnmatch(fname, pattern):
-                    matches = True
-            if exclude_init and (fname == '__init__.py'):
-                matches = False
-            if matches:
+            if _is_code_file(fname, exclude_init=exclude_init, additional_files=additional_files):
                 with open(dirname + '/' + fname, 'rb') as f:
                     try:
                         txt = f.read().decode('utf-8')
@@ -1,64 +1,106 @@
+from concurrent.futures import Future, ThreadPoolExecutor
 import os
 import sys
+import threading
 import time
-from typing import Any, Union, Dict, List
+from typing import Any, Union, Dict, List, Tuple
 
 from ._enums import JobStatus
+from .file import File
 from .job import Job
+from ._prefetch import _Prefetcher
 from ._shellscript import ShellScript
-from ._util import _docker_form_of_container_string
+from ._util import _docker_form_of_container_string, _flatten_nested_collection, _random_string
+from ._containerregistry import _RegistryLock, _load_registry_entry, _save_registry_entry
+from ._containerregistry import _docker_image_id, _docker_pull_is_current, _singularity_image_path, _resolve_singularity_container
+from ._tracing import _span, _record_span, _add_trace_events, tracing_enabled
+
+# Maximum number of containers that are pulled/built at the same time
+_MAX_CONCURRENT_CONTAINER_PREPARATIONS = int(os.getenv('HITHER_MAX_CONCURRENT_CONTAINER_PREPARATIONS', '4'))
 
 class _JobManager:
     def __init__(self) -> None:
         self._queued_jobs = dict()
         self._running_jobs = dict()
+        self._prefetcher = _Prefetcher()
 
     def queue_job(self, job):
         job._status = JobStatus.QUEUED
+        setattr(job, '_timestamp_queued', time.time())
         self._queued_jobs[job._job_id] = job
 
     def process_job_queues(self):
         # Called periodically during wait()
         self.prune_job_queue()
         self.prepare_containers_for_queued_jobs()
+        self.prefetch_input_files_for_queued_jobs()
         self.run_queued_jobs()
         self.review_running_jobs()
 
     def prune_job_queue(self):
         for _id, job in list(self._queued_jobs.items()):
-            if job._status != JobStatus.QUEUED:
+            if job._status not in [JobStatus.QUEUED, JobStatus.PREPARING]:
                 del self._queued_jobs[_id]
+                self._prefetcher.release(_id)
 
     def prepare_containers_for_queued_jobs(self):
+        # Containers are prepared in background threads (see _start_preparing_container).
+        # Meanwhile their jobs are held in the PREPARING state, and jobs that do not need
+        # a container keep flowing.
+        failed_containers = set()
         for job in self._queued_jobs.values():
+            if job._status not in [JobStatus.QUEUED, JobStatus.PREPARING]: continue
             if not job.container_may_be_needed(): continue
             # TODO: Push this back to the Job
             # TODO: This would require a container collection that lives independently,
             # like the Configs, rather than as a property of a particular JobManager.
             # We'll explore this later.
-            try:
-                self.prepare_container(job._container)
-            except:
+            future = self._start_preparing_container(job._container)
+            if not future.done():
+                job._status = JobStatus.PREPARING
+            elif future.exception() is not None:
+                failed_containers.add(job._container)
                 job._status = JobStatus.ERROR
                 job._exception = Exception(f'Unable to prepare container for job {job._label}: {job._container}')
+            else:
+                job._status = JobStatus.QUEUED
+        # so that jobs queued later try again
+        for container in failed_containers:
+            self._forget_container_preparation(container)
+
+    def prefetch_input_files_for_queued_jobs(self):
+        # Start downloading the known input files of queued jobs (including those still
+        # waiting on upstream jobs) so that the transfers overlap with running jobs.
+        for _id, job in self._queued_jobs.items():
+            if self._prefetcher.has_request(_id): continue
+            if job._job_handler.is_remote or job._no_resolve_input_files: continue
+            files = _flatten_nested_collection(job._wrapped_function_arguments, _type=File)
+            self._prefetcher.request(_id, files)
 
     def run_queued_jobs(self):
         queued_job_ids = list(self._queued_jobs.keys())
         for _id in queued_job_ids:
             job: Job = self._queued_jobs[_id]
             if not job.is_ready_to_run(): continue
+            # let an in-progress prefetch finish rather than downloading the same files twice
+            if not self._prefetcher.is_done(_id): continue
 
             del self._queued_jobs[_id]
+            self._prefetcher.release(_id)
             if job._status == JobStatus.ERROR: continue
 
             self._running_jobs[_id] = job
+            _record_span('queued', getattr(job, '_timestamp_queued', time.time()), time.time(), job_id=_id, label=job._label)
+            setattr(job, '_timestamp_handled', time.time())
             job.resolve_wrapped_job_values()
             if job._job_cache is not None:
                 if not job._job_handler.is_remote:
-                    job._job_cache.check_job(job)
+                    with _span('job cache lookup', job_id=_id):
+                        job._job_cache.check_job(job)
             # TODO: Do we actually do anything with the results of that check?
 
-            job._job_handler.handle_job(job)
+            with _span('submit to job handler', job_id=_id, job_handler=type(job._job_handler).__name__):
+                job._job_handler.handle_job(job)
 
     def review_running_jobs(self):
         # Check which running jobs are finished and iterate job handlers of running or preparing jobs
@@ -74,15 +116,23 @@ class _JobManager:
 
     def finish_completed_job(self, job:Job) -> None:
         del self._running_jobs[job._job_id]
+        _record_span('in job handler', getattr(job, '_timestamp_handled', time.time()), time.time(), job_id=job._job_id,
+            label=job._label, status=job._status.value)
+        if job._runtime_info is not None and tracing_enabled():
+            # spans recorded in other processes (see _tracing.py)
+            _add_trace_events(job._runtime_info.get('trace_events', None))
         if job._download_results:
-            job.download_results_if_needed()
-        if job._job_cache is None or not job._job_handler.is_remote():
+            with _span('download results', job_id=job._job_id):
+                job.download_results_if_needed()
+        # the compute resource caches the results of remote jobs
+        if job._job_cache is None or job._job_handler.is_remote:
             return
         job._job_cache.cache_job_result(job)
 
     def reset(self):
         self._queued_jobs = dict()
         self._running_jobs = dict()
+        self._prefetcher = _Prefetcher()
     
     def wait(self, timeout: Union[float, None]=None):
         timer = time.time()
@@ -99,6 +149,10 @@ class _JobManager:
 
     _prepared_singularity_containers = dict()
     _prepared_docker_images = dict()
+    # In-progress and completed preparations, by (singularity or docker, container)
+    _container_preparations: Dict[Tuple[str, str], Future] = dict()
+    _container_preparations_lock = threading.Lock()
+    _container_preparation_executor: Union[ThreadPoolExecutor, None] = None
     
     # NOTE: What these 'container preparation' methods actually do is make sure that
     # whatever container configuration has been attached to a Job's function `f`
@@ -108,48 +162,104 @@ class _JobManager:
     # is passed, and should be a docker:// URL.
 
     def prepare_container(self, container):
+        # Blocks until the container is prepared (sharing any preparation already in progress)
+        future = self._start_preparing_container(container)
+        try:
+            future.result()
+        except:
+            self._forget_container_preparation(container)
+            raise
+
+    def _start_preparing_container(self, container) -> Future:
+        key = self._container_preparation_key(container)
+        with _JobManager._container_preparations_lock:
+            future = _JobManager._container_preparations.get(key, None)
+            if future is None:
+                if _JobManager._container_preparation_executor is None:
+                    _JobManager._container_preparation_executor = ThreadPoolExecutor(max_workers=_MAX_CONCURRENT_CONTAINER_PREPARATIONS)
+                future = _JobManager._container_preparation_executor.submit(self._do_prepare_container, container)
+                _JobManager._container_preparations[key] = future
+            return future
+
+    def _forget_container_preparation(self, container) -> None:
+        key = self._container_preparation_key(container)
+        with _JobManager._container_preparations_lock:
+            future = _JobManager._container_preparations.get(key, None)
+            if future is not None and future.done():
+                del _JobManager._container_preparations[key]
+
+    def _container_preparation_key(self, container) -> Tuple[str, str]:
         if os.getenv('HITHER_USE_SINGULARITY', None) == 'TRUE':
-            if container not in self._prepared_singularity_containers:
-                self._do_prepare_singularity_container(container)
-                self._prepared_singularity_containers[container] = True
-        else:
-            if os.getenv('HITHER_DO_NOT_PULL_DOCKER_IMAGES', None) != 'TRUE':
-                if container not in self._prepared_docker_images:
-                    self._do_pull_docker_image(container)
-                    self._prepared_docker_images[container] = True
+            return ('singularity', container)
+        return ('docker', container)
+
+    def _do_prepare_container(self, container):
+        with _span('prepare container', container=container):
+            if os.getenv('HITHER_USE_SINGULARITY', None) == 'TRUE':
+                if container not in self._prepared_singularity_containers:
+                    self._do_prepare_singularity_container(container)
+                    self._prepared_singularity_containers[container] = True
+            else:
+                if os.getenv('HITHER_DO_NOT_PULL_DOCKER_IMAGES', None) != 'TRUE':
+                    if container not in self._prepared_docker_images:
+                        self._do_pull_docker_image(container)
+                        self._prepared_docker_images[container] = True
 
 
     def _do_prepare_singularity_container(self, container):
-        print(f'Building singularity container: {container}')
-        ss = ShellScript(f'''
-            #!/bin/bash
+        # Container references such as docker://... are pulled to a SIF file in the container
+        # registry (see _containerregistry.py), which is then used to run the jobs. Other
+        # processes find it there without preparing the container again.
+        sif_path = _singularity_image_path(container) if '://' in container else None
+        with _RegistryLock('singularity', container):
+            if sif_path is not None:
+                if _resolve_singularity_container(container) != container:
+                    return
+                print(f'Pulling singularity container: {container}')
+                tmp_sif_path = f'{sif_path}.tmp_{_random_string(6)}'
+                ss = ShellScript(f'''
+                    #!/bin/bash
 
-            exec singularity run {container} echo "built {container}"
-        ''')
-        ss.start()
-        retcode = ss.wait()
-        if retcode != 0:
-            raise Exception(f'Problem building container {container}')
+                    exec singularity pull {tmp_sif_path} {container}
+                ''')
+            else:
+                print(f'Building singularity container: {container}')
+                ss = ShellScript(f'''
+                    #!/bin/bash
+
+                    exec singularity run {container} echo "built {container}"
+                ''')
+            ss.start()
+            retcode = ss.wait()
+            if retcode != 0:
+                if sif_path is not None and os.path.exists(tmp_sif_path):
+                    os.remove(tmp_sif_path)
+                raise Exception(f'Problem building container {container}')
+            if sif_path is not None:
+                os.rename(tmp_sif_path, sif_path)
+                _save_registry_entry('singularity', container, dict(sif_path=sif_path))
 
     def _do_pull_docker_image(self, container):
-        print(f'Pulling docker container: {container}')
-        container = _docker_form_of_container_string(container)
-        if (sys.platform == "win32"):
-            if 1: # pragma: no cover
+        with _RegistryLock('docker', container):
+            # Skip the pull if the image that was pulled before (by any process) is still present (and recent)
+            if _docker_pull_is_current(container, _load_registry_entry('docker', container)):
+                return
+            print(f'Pulling docker container: {container}')
+            container_docker_form = _docker_form_of_container_string(container)
+            if (sys.platform == "win32"):
+                if 1: # pragma: no cover
+                    ss = ShellScript(f'''
+                        docker pull {container_docker_form}
+                    ''')
+            else:
                 ss = ShellScript(f'''
-                    docker pull {container}
+                    #!/bin/bash
+                    set -ex
+                    
+                    exec docker pull {container_docker_form}
                 ''')
-        else:
-            ss = ShellScript(f'''
-                #!/bin/bash
-                set -ex
-                
-                exec docker pull {container}
-            ''')
-        ss.start()
-        retcode = ss.wait()
-        if retcode != 0:
-            raise Exception(f'Problem pulling container {container}')
-
-
-
+            ss.start()
+            retcode = ss.wait()
+            if retcode != 0:
+                raise Exception(f'Problem pulling container {container_docker_form}')
+            _save_registry_entry('docker', container, dict(image_id=_docker_image_id(container)))
@@ -5,7 +5,6 @@ import tempfile
 import json
 import stat
 import time
-from urllib import request
 from ._util import _random_string
 
 def _load_preset_config_from_github(*, url, name):
@@ -84,6 +83,7 @@ def _http_get_json(url: str, use_cache_on_success: bool=False, verbose: Optional
         verbose = (os.environ.get('HTTP_VERBOSE', '') == 'TRUE')
     if verbose:
         print('_http_get_json::: ' + url)
+    from urllib import request
     try:
         req = request.urlopen(url)
     except: # pragma: no cover
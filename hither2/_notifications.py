@@ -0,0 +1,97 @@
+import threading
+import time
+from typing import Any, Dict, List
+
+# When push notifications are active, the database is still polled at this interval (seconds)
+# as a safety net in case a notification is missed
+SAFETY_POLL_INTERVAL = 10
+
+class LocalNotificationBus:
+    def __init__(self):
+        """An in-process stand-in for Mongo change streams, mainly for tests.
+
+        Pass the same bus to each Database (e.g., the one used by a RemoteJobHandler and
+        the one used by a ComputeResource running in the same process). Writes made
+        through those objects are then published to the bus, waking up the watchers
+        whose match fields agree with the written fields. A match field that is not
+        present in a published document is not used to exclude it.
+        """
+        self._lock = threading.Lock()
+        self._subscriptions: List[dict] = []
+
+    def subscribe(self, collection_name: str, match: Dict[str, Any]) -> threading.Event:
+        event = threading.Event()
+        with self._lock:
+            self._subscriptions.append(dict(collection_name=collection_name, match=match, event=event))
+        return event
+
+    def publish(self, collection_name: str, doc: Dict[str, Any]) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for s in subscriptions:
+            if s['collection_name'] != collection_name:
+                continue
+            if all((k not in doc) or (doc[k] == v) for k, v in s['match'].items()):
+                s['event'].set()
+
+class _ChangeNotifier:
+    def __init__(self, event: threading.Event, push_active: bool=False):
+        """Tells a polling loop when a database poll is worthwhile.
+
+        The event is set whenever a relevant change may have occurred. If no
+        push mechanism is available (push_active is False), the caller's own
+        polling schedule applies.
+        """
+        self._event = event
+        self._push_active = push_active
+
+    def poll_due(self, elapsed_since_last_poll: float, poll_interval: float) -> bool:
+        if self._event.is_set():
+            # clear before polling so that changes made during the poll are not lost
+            self._event.clear()
+            return True
+        if self._push_active:
+            return elapsed_since_last_poll > max(poll_interval, SAFETY_POLL_INTERVAL)
+        return elapsed_since_last_poll > poll_interval
+
+    def push_active(self) -> bool:
+        return self._push_active
+
+    def close(self) -> None:
+        pass
+
+class _MongoChangeStreamNotifier(_ChangeNotifier):
+    def __init__(self, collection, match: Dict[str, Any]):
+        """Watches a collection with a Mongo change stream in a background thread.
+
+        Change streams require a replica set (or sharded cluster). When they are
+        not available, this behaves like plain polling, and the change stream is
+        retried periodically.
+        """
+        super().__init__(event=threading.Event(), push_active=False)
+        self._collection = collection
+        self._pipeline = [{'$match': {'fullDocument.' + k: v for k, v in match.items()}}]
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._closed = True
+
+    def _run(self) -> None:
+        while not self._closed:
+            try:
+                with self._collection.watch(self._pipeline, full_document='updateLookup', max_await_time_ms=1000) as stream:
+                    self._push_active = True
+                    # catch anything that happened before the stream was opened
+                    self._event.set()
+                    while not self._closed and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            self._event.set()
+            except Exception:
+                # e.g., the server is not a replica set, or the collection does not support watch()
+                pass
+            self._push_active = False
+            if not self._closed:
+                time.sleep(60)
@@ -0,0 +1,160 @@
+import json
+import os
+import pickle
+import struct
+import zlib
+from typing import Any, List, Union
+
+# Formats that may be used to encode serialized jobs and results.
+# 'json' is always supported; 'pickle5' is a binary envelope using pickle protocol 5
+# with out-of-band buffers, so that numpy arrays are transferred without copies or base64
+PAYLOAD_FORMATS = ['json', 'pickle5']
+
+# Database document fields (kwargs, result, runtime_info) are compressed when their
+# encoded size is at least _COMPRESS_MIN_BYTES, and the compressed data is moved to
+# kachery (leaving only a sha1 reference in the document) when it is at least _SPILL_MIN_BYTES
+_COMPRESS_MIN_BYTES = int(os.getenv('HITHER_COMPRESS_MIN_BYTES', str(16 * 1024)))
+_SPILL_MIN_BYTES = int(os.getenv('HITHER_SPILL_MIN_BYTES', str(4 * 1024 * 1024)))
+
+_MAGIC = b'HITHER2P'
+_HEADER = struct.Struct('<8s8sII') # magic, format name, pickle length, number of buffers
+_BUFFER_LENGTH = struct.Struct('<Q')
+
+def _check_payload_format(payload_format: str) -> None:
+    if payload_format not in PAYLOAD_FORMATS:
+        raise Exception(f'Unsupported payload format: {payload_format} (expected one of {PAYLOAD_FORMATS})')
+
+def _payload_file_extension(payload_format: str) -> str:
+    return 'json' if payload_format == 'json' else 'bin'
+
+def _encode_payload(x: Any, payload_format: str='json') -> bytes:
+    """Encode a serialized job or result (see Job._serialize and _serialize_item).
+
+    For 'json', the item must be jsonable and the output is plain utf-8 JSON,
+    identical to what json.dump would write. For 'pickle5', the item may also
+    contain numpy arrays (serialize with encode_arrays=False), whose data is
+    appended to the envelope as raw buffers.
+    """
+    _check_payload_format(payload_format)
+    if payload_format == 'json':
+        return json.dumps(x).encode('utf-8')
+    buffers: List[pickle.PickleBuffer] = []
+    main = pickle.dumps(x, protocol=5, buffer_callback=buffers.append)
+    raw_buffers = [b.raw() for b in buffers]
+    parts = [_HEADER.pack(_MAGIC, payload_format.encode('utf-8'), len(main), len(raw_buffers))]
+    for b in raw_buffers:
+        parts.append(_BUFFER_LENGTH.pack(b.nbytes))
+    parts.append(main)
+    parts.extend(raw_buffers)
+    return b''.join(parts)
+
+def _decode_payload(data: Union[bytes, bytearray, str]) -> Any:
+    """Decode the output of _encode_payload, detecting the format from the data itself.
+    """
+    if isinstance(data, str):
+        return json.loads(data)
+    if not data.startswith(_MAGIC):
+        return json.loads(data.decode('utf-8'))
+    # Arrays are reconstructed in place on top of the buffers, so make sure they are writable
+    view = memoryview(data if isinstance(data, bytearray) else bytearray(data))
+    _, payload_format, main_length, num_buffers = _HEADER.unpack_from(view, 0)
+    payload_format = payload_format.rstrip(b'\x00').decode('utf-8')
+    _check_payload_format(payload_format)
+    offset = _HEADER.size
+    buffer_lengths = []
+    for _ in range(num_buffers):
+        buffer_lengths.append(_BUFFER_LENGTH.unpack_from(view, offset)[0])
+        offset += _BUFFER_LENGTH.size
+    main = view[offset:offset + main_length]
+    offset += main_length
+    buffers = []
+    for length in buffer_lengths:
+        buffers.append(view[offset:offset + length])
+        offset += length
+    return pickle.loads(main, buffers=buffers)
+
+def _decode_document_payload(x: Any) -> Any:
+    """Decode a field of a database document that holds either a binary payload or plain (jsonable) data.
+    """
+    if isinstance(x, (bytes, bytearray)):
+        return _decode_payload(x)
+    return x
+
+def _compression_codecs() -> List[str]:
+    # The codecs that can be decompressed here, advertised to the other side (like PAYLOAD_FORMATS)
+    try:
+        import zstandard
+    except ImportError:
+        return ['zlib']
+    return ['zstd', 'zlib']
+
+def _compress_document_field(x: Any, *, kachery: Union[str, dict, None], codecs: Union[List[str], None]=None) -> Any:
+    """Compress a jsonable value or a binary payload for storage in a database document.
+
+    Small values are returned unchanged. Otherwise the value is compressed (zstd if
+    the zstandard package is available and zstd is among <codecs>, the codecs that
+    the reader of the document supports, else zlib), and if the compressed data is
+    still large it is stored in <kachery> and replaced by its sha1 path.
+    """
+    binary = isinstance(x, (bytes, bytearray))
+    raw = bytes(x) if binary else json.dumps(x).encode('utf-8')
+    if len(raw) < _COMPRESS_MIN_BYTES:
+        return x
+    codec, data = _compress(raw, codecs=codecs if codecs is not None else _compression_codecs())
+    ret = dict(
+        _type='hither2_compressed',
+        codec=codec,
+        binary=binary
+    )
+    if len(data) >= _SPILL_MIN_BYTES:
+        ret['sha1_path'] = _store_bytes(data, kachery=kachery)
+    else:
+        ret['data'] = data
+    return ret
+
+def _decompress_document_field(x: Any, *, kachery: Union[str, dict, None]) -> Any:
+    """Inverse of _compress_document_field. Values that were not compressed are returned unchanged.
+    """
+    if not (isinstance(x, dict) and x.get('_type', None) == 'hither2_compressed'):
+        return x
+    if 'sha1_path' in x:
+        data = _load_bytes(x['sha1_path'], kachery=kachery)
+    else:
+        data = x['data']
+    raw = _decompress(x['codec'], data)
+    if x['binary']:
+        return raw
+    return json.loads(raw.decode('utf-8'))
+
+def _compress(raw: bytes, *, codecs: List[str]):
+    # zlib is always supported
+    if 'zstd' not in codecs or 'zstd' not in _compression_codecs():
+        return 'zlib', zlib.compress(raw, 6)
+    import zstandard
+    return 'zstd', zstandard.ZstdCompressor(level=3).compress(raw)
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    elif codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    else:
+        raise Exception(f'Unexpected compression codec: {codec}')
+
+def _store_bytes(data: bytes, *, kachery: Union[str, dict, None]) -> str:
+    import kachery as ka
+    from ._temporarydirectory import TemporaryDirectory
+    with TemporaryDirectory(prefix='tmp_hither2_payload_') as tmpdir:
+        fname = os.path.join(tmpdir, 'payload.bin')
+        with open(fname, 'wb') as f:
+            f.write(data)
+        return ka.store_file(fname, to=kachery)
+
+def _load_bytes(sha1_path: str, *, kachery: Union[str, dict, None]) -> bytes:
+    import kachery as ka
+    path = ka.load_file(sha1_path, fr=kachery)
+    if path is None:
+        raise Exception(f'Unable to load payload from kachery: {sha1_path}')
+    with open(path, 'rb') as f:
+        return f.read()
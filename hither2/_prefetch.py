@@ -0,0 +1,104 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Union
+
+import kachery as ka
+from .file import File
+from ._file_transfer import _for_each_file, _unique_files
+
+# Default cap on the number of bytes that may be prefetched ahead of the jobs that need them
+DEFAULT_PREFETCH_MAX_BYTES = int(os.getenv('HITHER_PREFETCH_MAX_BYTES', str(1024 * 1024 * 1024)))
+
+class _PrefetchRequest:
+    def __init__(self, files: List[File], kachery: Union[str, dict, None], required: bool):
+        self.files = files
+        self.kachery = kachery
+        self.required = required
+        self.num_bytes = 0
+        self.released = False
+        self.future: Union[Future, None] = None
+
+class _Prefetcher:
+    def __init__(self, max_bytes: int=DEFAULT_PREFETCH_MAX_BYTES, max_workers: int=4):
+        """Download the input files of jobs in the background, ahead of when the jobs run.
+
+        Each request is identified by a key (typically the job id). Files of a
+        non-required request are only fetched while the total size of the
+        unreleased prefetched files stays within <max_bytes>; any skipped files
+        are simply downloaded by the job itself when it runs. A required request
+        (the job cannot run without its files) fetches all of its files without
+        waiting for room in the budget, but its bytes still count against the
+        budget of the non-required requests.
+
+        Parameters
+        ----------
+        max_bytes : int
+            Cap on the number of bytes held by unreleased requests
+        max_workers : int
+            Number of requests to process concurrently
+        """
+        self._max_bytes = max_bytes
+        self._max_workers = max_workers
+        self._executor: Union[ThreadPoolExecutor, None] = None
+        self._requests: Dict[str, _PrefetchRequest] = dict()
+        self._num_bytes = 0
+        self._lock = threading.Lock()
+
+    def request(self, key: str, files: List[File], kachery: Union[str, dict, None]=None, required: bool=False) -> None:
+        if key in self._requests:
+            return
+        r = _PrefetchRequest(files=_unique_files(files), kachery=kachery, required=required)
+        self._requests[key] = r
+        if len(r.files) == 0:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        r.future = self._executor.submit(self._fetch, r)
+
+    def has_request(self, key: str) -> bool:
+        return key in self._requests
+
+    def is_done(self, key: str) -> bool:
+        r = self._requests.get(key, None)
+        if r is None or r.future is None:
+            return True
+        return r.future.done()
+
+    def get_exception(self, key: str) -> Union[BaseException, None]:
+        r = self._requests.get(key, None)
+        if r is None or r.future is None or not r.future.done():
+            return None
+        return r.future.exception()
+
+    def release(self, key: str) -> None:
+        """Forget the request (the job has started) and free its share of the budget."""
+        r = self._requests.pop(key, None)
+        if r is None:
+            return
+        with self._lock:
+            r.released = True
+            self._num_bytes -= r.num_bytes
+            r.num_bytes = 0
+
+    def num_bytes(self) -> int:
+        return self._num_bytes
+
+    def _fetch(self, r: _PrefetchRequest) -> None:
+        def fetch_file(f: File) -> None:
+            if ka.get_file_info(f._sha1_path, fr=None) is not None:
+                return # already available locally
+            info = ka.get_file_info(f._sha1_path, fr=r.kachery)
+            size = int(info.get('size', 0)) if info is not None else 0
+            with self._lock:
+                if r.released:
+                    return
+                # A required request must not wait for room: its bytes are only released once
+                # all of its files are fetched, so it could wait for itself (or for another
+                # required request that is waiting in turn)
+                if not r.required and self._num_bytes + size > self._max_bytes:
+                    return # leave it for the job to download
+                self._num_bytes += size
+                r.num_bytes += size
+            f.ensure_local_availability(r.kachery)
+        _for_each_file(r.files, fetch_file, kachery=r.kachery)
@@ -0,0 +1,75 @@
+import os
+from typing import Any, List, Union
+from ._temporarydirectory import TemporaryDirectory
+
+# Jobs with profile=True (see hi.opts and hi.Config) run their function under cProfile. The
+# stats are stored in kachery and referenced from the job's runtime_info:
+#     runtime_info['profile'] = dict(function_name=<name>, sha1_path=<kachery sha1 path of the pstats file>)
+
+class _Profile():
+    def __init__(self, enabled: bool):
+        self._enabled = enabled
+        self._profile: Any = None # cProfile.Profile
+
+    def __enter__(self):
+        if self._enabled:
+            import cProfile
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._profile is not None:
+            self._profile.disable()
+
+    def store(self, function_name: str) -> Union[dict, None]:
+        """Store the stats in kachery, returning the reference for runtime_info['profile'] (or None if not profiling)"""
+        if self._profile is None:
+            return None
+        import kachery as ka
+        with TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'profile.pstats')
+            self._profile.dump_stats(fname)
+            sha1_path = ka.store_file(fname)
+        return dict(function_name=function_name, sha1_path=sha1_path)
+
+def load_profiles(jobs: Union[Any, List[Any]], kachery: Union[str, None]=None) -> Any:
+    """Load the cProfile stats of jobs that ran with profile=True, merged into a single pstats.Stats
+
+    Example usage:
+    ```
+    stats = hi.load_profiles([job1, job2, job3])
+    stats.sort_stats('cumulative').print_stats(20)
+    ```
+
+    Parameters
+    ----------
+    jobs : Job, runtime info dict, or a list of these
+        The completed jobs (typically of the same function)
+    kachery : Union[str, None], optional
+        The kachery to load the stats from, by default None
+
+    Returns
+    -------
+    pstats.Stats
+        The merged stats
+    """
+    import pstats
+    import kachery as ka
+    if not isinstance(jobs, list):
+        jobs = [jobs]
+    stats: Any = None # pstats.Stats
+    for job in jobs:
+        runtime_info = job if isinstance(job, dict) else job.get_runtime_info()
+        if runtime_info is None or runtime_info.get('profile', None) is None:
+            continue
+        fname = ka.load_file(runtime_info['profile']['sha1_path'], fr=kachery)
+        if fname is None:
+            raise Exception(f'Unable to load profile: {runtime_info["profile"]["sha1_path"]}')
+        if stats is None:
+            stats = pstats.Stats(fname)
+        else:
+            stats.add(fname)
+    if stats is None:
+        raise Exception('None of the jobs has a profile. Use hi.opts(profile=True) or hi.Config(profile=True).')
+    return stats
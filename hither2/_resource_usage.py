@@ -0,0 +1,268 @@
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Set, Union
+
+try:
+    import resource
+except ImportError: # pragma: no cover
+    # not available on windows
+    resource = None # type: ignore
+
+# Number of seconds between samples of the child processes of a job (see _ResourceMonitor)
+SAMPLE_INTERVAL = 1
+
+class _ResourceMonitor():
+    def __init__(self, *, per_thread: bool=False, cgroup: bool=False, sample_interval: float=SAMPLE_INTERVAL):
+        """Record the resources used while running a job, for runtime_info['resource_usage']
+
+        Parameters
+        ----------
+        per_thread : bool, optional
+            Count only the cpu time of the calling thread (for jobs that run in a process
+            that does other things), by default False. The memory, io and child processes
+            can only be measured for the whole process, so they are not recorded in this case.
+        cgroup : bool, optional
+            Also record the stats of the cgroup (i.e., the container) of the process, by default False
+        sample_interval : float, optional
+            Number of seconds between samples of the child processes, by default SAMPLE_INTERVAL
+        """
+        self._per_thread = per_thread
+        self._cgroup = cgroup
+        self._sample_interval = sample_interval
+        self._time_start: Optional[float] = None
+        self._time_stop: Optional[float] = None
+        self._start: Dict[str, dict] = dict()
+        self._stop: Dict[str, dict] = dict()
+        self._child_pids: Set[int] = set()
+        self._peak_children_rss = 0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        self._time_start = time.time()
+        self._start = self._snapshot()
+        if not self._per_thread:
+            self._thread = threading.Thread(target=self._sample_children, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stopped.set()
+        self._time_stop = time.time()
+        self._stop = self._snapshot()
+        if self._thread is not None:
+            self._thread.join()
+
+    def runtime_info(self) -> dict:
+        # For jobs that do not have a ConsoleCapture runtime info
+        assert self._time_start is not None
+        assert self._time_stop is not None
+        return dict(
+            start_time=self._time_start,
+            end_time=self._time_stop,
+            elapsed_sec=self._time_stop - self._time_start,
+            resource_usage=self.resource_usage()
+        )
+
+    def resource_usage(self) -> dict:
+        assert self._time_start is not None
+        assert self._time_stop is not None
+        start, stop = self._start, self._stop
+        ret: dict = dict(wall_time_sec=self._time_stop - self._time_start)
+        if self._per_thread:
+            if 'thread' in stop:
+                ret['cpu_user_sec'] = stop['thread']['user'] - start['thread']['user']
+                ret['cpu_system_sec'] = stop['thread']['system'] - start['thread']['system']
+            return ret
+        if 'self' in stop:
+            ret['cpu_user_sec'] = stop['self']['user'] - start['self']['user'] + stop['children']['user'] - start['children']['user']
+            ret['cpu_system_sec'] = stop['self']['system'] - start['self']['system'] + stop['children']['system'] - start['children']['system']
+            # the peak of the process (and of its largest waited-for child) over its lifetime
+            ret['peak_rss_bytes'] = max(stop['self']['maxrss'], stop['children']['maxrss'], self._peak_children_rss)
+        if 'io' in stop and 'io' in start:
+            ret['io_read_bytes'] = stop['io']['read_bytes'] - start['io']['read_bytes']
+            ret['io_write_bytes'] = stop['io']['write_bytes'] - start['io']['write_bytes']
+        ret['num_child_processes'] = len(self._child_pids)
+        if 'cgroup' in stop:
+            cgroup: dict = dict()
+            for k, v in stop['cgroup'].items():
+                if k == 'memory_peak_bytes':
+                    cgroup[k] = v
+                elif k in start.get('cgroup', {}):
+                    cgroup[k] = v - start['cgroup'][k]
+            ret['cgroup'] = cgroup
+        return ret
+
+    def _snapshot(self) -> Dict[str, dict]:
+        ret: Dict[str, dict] = dict()
+        if self._per_thread:
+            # not available on macos
+            if hasattr(resource, 'RUSAGE_THREAD'):
+                ret['thread'] = _rusage(resource.RUSAGE_THREAD)
+            return ret
+        if resource is not None:
+            ret['self'] = _rusage(resource.RUSAGE_SELF)
+            ret['children'] = _rusage(resource.RUSAGE_CHILDREN)
+        io = _read_proc_io()
+        if io is not None:
+            ret['io'] = io
+        if self._cgroup:
+            cgroup = _read_cgroup_stats()
+            if cgroup is not None:
+                ret['cgroup'] = cgroup
+        return ret
+
+    def _sample_children(self) -> None:
+        # Short-lived child processes may be missed
+        while True:
+            pids = _descendant_pids(os.getpid())
+            self._child_pids.update(pids)
+            self._peak_children_rss = max(self._peak_children_rss, sum([_rss_bytes(pid) for pid in pids]))
+            if self._stopped.wait(self._sample_interval):
+                return
+
+def _rusage(who: int) -> dict:
+    r = resource.getrusage(who)
+    # ru_maxrss is in kilobytes on linux and in bytes on macos
+    maxrss_factor = 1 if os.uname().sysname == 'Darwin' else 1024
+    return dict(user=r.ru_utime, system=r.ru_stime, maxrss=r.ru_maxrss * maxrss_factor)
+
+def _read_proc_io() -> Optional[Dict[str, int]]:
+    # Bytes actually read from and written to storage by the process (linux only)
+    try:
+        with open('/proc/self/io', 'r') as f:
+            txt = f.read()
+    except Exception:
+        return None
+    ret: Dict[str, int] = dict()
+    for line in txt.splitlines():
+        k, v = line.split(':')
+        ret[k.strip()] = int(v)
+    if 'read_bytes' not in ret or 'write_bytes' not in ret:
+        return None
+    return ret
+
+def _descendant_pids(pid: int) -> List[int]:
+    ret: List[int] = []
+    to_visit = [pid]
+    while len(to_visit) > 0:
+        p = to_visit.pop()
+        try:
+            task_ids = os.listdir(f'/proc/{p}/task')
+        except Exception:
+            continue
+        for tid in task_ids:
+            try:
+                with open(f'/proc/{p}/task/{tid}/children', 'r') as f:
+                    children = [int(c) for c in f.read().split()]
+            except Exception:
+                continue
+            ret.extend(children)
+            to_visit.extend(children)
+    return ret
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        return 0
+
+def _read_cgroup_stats() -> Optional[Dict[str, float]]:
+    # Stats of the cgroup of the process, which inside a container covers the whole container.
+    # cgroup v2 has a unified hierarchy at /sys/fs/cgroup; otherwise try the cgroup v1 controllers.
+    ret: Dict[str, float] = dict()
+    cpu_stat = _read_key_values('/sys/fs/cgroup/cpu.stat')
+    if cpu_stat is not None:
+        ret['cpu_usage_sec'] = cpu_stat.get('usage_usec', 0) / 1e6
+        ret['cpu_user_sec'] = cpu_stat.get('user_usec', 0) / 1e6
+        ret['cpu_system_sec'] = cpu_stat.get('system_usec', 0) / 1e6
+        memory_peak = _read_int('/sys/fs/cgroup/memory.peak')
+        if memory_peak is not None:
+            ret['memory_peak_bytes'] = memory_peak
+        io_stat = _read_text('/sys/fs/cgroup/io.stat')
+        if io_stat is not None:
+            ret['io_read_bytes'] = 0
+            ret['io_write_bytes'] = 0
+            for line in io_stat.splitlines():
+                for field in line.split()[1:]:
+                    k, v = field.split('=')
+                    if k == 'rbytes':
+                        ret['io_read_bytes'] += int(v)
+                    elif k == 'wbytes':
+                        ret['io_write_bytes'] += int(v)
+        return ret
+    cpu_usage = _read_int('/sys/fs/cgroup/cpuacct/cpuacct.usage')
+    if cpu_usage is None:
+        return None
+    ret['cpu_usage_sec'] = cpu_usage / 1e9
+    memory_peak = _read_int('/sys/fs/cgroup/memory/memory.max_usage_in_bytes')
+    if memory_peak is not None:
+        ret['memory_peak_bytes'] = memory_peak
+    io_service_bytes = _read_text('/sys/fs/cgroup/blkio/blkio.throttle.io_service_bytes')
+    if io_service_bytes is not None:
+        ret['io_read_bytes'] = 0
+        ret['io_write_bytes'] = 0
+        for line in io_service_bytes.splitlines():
+            vals = line.split()
+            if len(vals) == 3 and vals[1] == 'Read':
+                ret['io_read_bytes'] += int(vals[2])
+            elif len(vals) == 3 and vals[1] == 'Write':
+                ret['io_write_bytes'] += int(vals[2])
+    return ret
+
+def _read_text(path: str) -> Optional[str]:
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except Exception:
+        return None
+
+def _read_int(path: str) -> Optional[int]:
+    txt = _read_text(path)
+    if txt is None:
+        return None
+    try:
+        return int(txt.strip())
+    except ValueError:
+        return None
+
+def _read_key_values(path: str) -> Optional[Dict[str, int]]:
+    txt = _read_text(path)
+    if txt is None:
+        return None
+    ret: Dict[str, int] = dict()
+    for line in txt.splitlines():
+        vals = line.split()
+        if len(vals) == 2:
+            ret[vals[0]] = int(vals[1])
+    return ret
+
+def _cores_used(resource_usage: dict) -> Optional[float]:
+    # Average number of cores kept busy by the job
+    if 'cpu_user_sec' not in resource_usage or resource_usage['wall_time_sec'] <= 0:
+        return None
+    return (resource_usage['cpu_user_sec'] + resource_usage['cpu_system_sec']) / resource_usage['wall_time_sec']
+
+def _summarize_resource_usage(resource_usages: List[dict]) -> dict:
+    cores_used = sorted([c for c in [_cores_used(r) for r in resource_usages] if c is not None])
+    peak_rss = [r['peak_rss_bytes'] for r in resource_usages if 'peak_rss_bytes' in r]
+    ret: dict = dict(num_jobs=len(resource_usages))
+    if len(cores_used) > 0:
+        ret['cores_used_mean'] = sum(cores_used) / len(cores_used)
+        ret['cores_used_p90'] = cores_used[math.ceil(0.9 * len(cores_used)) - 1]
+        ret['cores_used_max'] = cores_used[-1]
+    if len(peak_rss) > 0:
+        ret['peak_rss_bytes_max'] = max(peak_rss)
+    ret['io_read_bytes_total'] = sum([r.get('io_read_bytes', 0) for r in resource_usages])
+    ret['io_write_bytes_total'] = sum([r.get('io_write_bytes', 0) for r in resource_usages])
+    return ret
+
+def _suggest_num_cores(resource_usages: List[dict]) -> Union[int, None]:
+    summary = _summarize_resource_usage(resource_usages)
+    if 'cores_used_p90' not in summary:
+        return None
+    # allow a little slack so that a job that keeps 2 cores busy is not rounded up to 3
+    return max(1, math.ceil(summary['cores_used_p90'] - 0.1))
@@ -5,120 +5,94 @@ import json
 import shutil
 import time
 from ._temporarydirectory import TemporaryDirectory
+from ._code_cache import _materialize_code, _materialize_file, _get_pycache_dir
+from ._consolelog import _console_log_path, _finalize_console_log
+from ._tracing import _span, _record_span, _add_trace_events, tracing_enabled
+from ._containerregistry import _resolve_singularity_container
+from ._containerpool import _container_pool_enabled, _run_job_in_pooled_container, _path_in_container
+from ._payload import _check_payload_format, _encode_payload, _payload_file_extension
 from ._shellscript import ShellScript
 import kachery as ka
 from ._util import _docker_form_of_container_string, _random_string
 from ._util import _deserialize_item, _serialize_item
 
-def _run_serialized_job_in_container(job_serialized):
+# Format of the job configuration file passed to the container (see _payload.py). With a binary format,
+# arrays are passed without base64 encoding, but the python in the container must support pickle protocol 5
+CONTAINER_PAYLOAD_FORMAT = os.getenv('HITHER_CONTAINER_PAYLOAD_FORMAT', 'json')
+
+def _run_serialized_job_in_container(job_serialized, payload_format: str='json'):
     name = job_serialized['function_name']
     version = job_serialized['function_version']
     label = job_serialized['label']
     if label is None:
         label = name
-    show_console = True
+    # The console output is already in the console log (see below), so it is not also echoed to the runner output
+    show_console = False
     gpu = False
-    # This variable is reserved for future use
-    timeout: Union[None, float] = None
+    timeout: Union[None, float] = job_serialized.get('job_timeout', None)
     
     code = job_serialized['code']
     container = job_serialized['container']
     no_resolve_input_files = job_serialized['no_resolve_input_files']
 
     kwargs = job_serialized['kwargs']
+    _check_payload_format(payload_format)
+
+    if not os.getenv('KACHERY_STORAGE_DIR'):
+        raise Exception('You must set the environment variable: KACHERY_STORAGE_DIR')
+
+    # The code is written once per distinct code bundle and shared (read-only) between jobs.
+    # Only the per-job files (job config, run.sh, result.json) go in the temporary directory.
+    with _span('materialize code', job_id=job_serialized['job_id']):
+        code_path = _materialize_code(code, fingerprint=job_serialized.get('code_fingerprint', None))
+    code_hash = os.path.basename(code_path)
+
+    # The console output is streamed to a log file that can be followed while the job runs (see _consolelog.py)
+    console_log_path = _console_log_path(job_serialized['job_id'])
 
     remove = True
     if os.getenv('HITHER_DEBUG', None) == 'TRUE':
         remove = False
     with TemporaryDirectory(prefix='tmp_hither2_run_in_container_' + name + '_', remove=remove) as temp_path:
-        _write_python_code_to_directory(os.path.join(temp_path, 'function_src'), code)
-        
         if container is not None:
             run_in_container_path = '/run_in_container'
+            code_in_container_path = f'/hither2_code_cache/{code_hash}'
             env_vars_inside_container = dict(
                 KACHERY_STORAGE_DIR='/kachery-storage',
-                PYTHONPATH=f'{run_in_container_path}/function_src/_local_modules',
+                PYTHONPATH=f'{code_in_container_path}:{code_in_container_path}/function_src/_local_modules',
+                PYTHONPYCACHEPREFIX='/kachery-storage/hither2_code_cache/pycache',
                 HOME='$HOME'
             )
         else:
             run_in_container_path = temp_path
+            code_in_container_path = code_path
             env_vars_inside_container = dict(
-                PYTHONPATH=f'{run_in_container_path}/function_src/_local_modules'
+                PYTHONPATH=f'{code_path}:{code_path}/function_src/_local_modules',
+                PYTHONPYCACHEPREFIX=_get_pycache_dir()
             )
 
-        run_py_script = """
-            #!/usr/bin/env python
-
-            import sys
-            import json
-            import traceback
-
-            def main():
-                try:
-                    import hither2
-                    ok_import_hither2 = True
-                except Exception as e:
-                    traceback.print_exc()
-                    retval = None
-                    success = False
-                    error = str(e)
-                    runtime_info = dict()
-                    ok_import_hither2 = False
-
-                if ok_import_hither2:
-                    from hither2 import ConsoleCapture
-                    from hither2 import _deserialize_item, _serialize_item, _copy_structure_with_changes
-                    from hither2 import File
-
-                    kwargs = json.loads('{kwargs_json}')
-                    kwargs = _deserialize_item(kwargs)
-                    with ConsoleCapture(label='{label}', show_console={show_console_str}) as cc:
-                        print('###### RUNNING: {label}')
-                        try:
-                            from function_src import {function_name}
-                            if not {no_resolve_input_files}:
-                                kwargs = _copy_structure_with_changes(kwargs,
-                                    lambda arg: arg.resolve(), _type = File)
-                            retval = {function_name}(**kwargs)
-                            retval = _copy_structure_with_changes(retval, File.kache_numpy_array)
-                            success = True
-                            error = None
-                        except Exception as e:
-                            traceback.print_exc()
-                            retval = None
-                            success = False
-                            error = str(e)
-                    
-                    retval = _serialize_item(retval)
-                    
-                    runtime_info = cc.runtime_info()
-                result = dict(
-                    retval=retval,
-                    success=success,
-                    runtime_info=runtime_info,
-                    error=error
-                )
-                with open('{run_in_container_path}/result.json', 'w') as f:
-                    json.dump(result, f)
-
-            if __name__ == "__main__":
-                try:
-                    main()
-                except:
-                    sys.stdout.flush()
-                    sys.stderr.flush()
-                    raise
-        """.format(
-            kwargs_json=json.dumps(kwargs),
+        # The job configuration (including the kwargs) goes in a file next to where the result will be written.
+        # The runner script itself is the same for all jobs.
+        job_config = dict(
+            job_id=job_serialized['job_id'],
             function_name=name,
             label=label,
-            show_console_str='True' if show_console else 'False',
-            run_in_container_path=run_in_container_path,
-            no_resolve_input_files='True' if no_resolve_input_files else 'False'
+            show_console=show_console,
+            no_resolve_input_files=no_resolve_input_files,
+            kwargs=kwargs,
+            in_container=(container is not None),
+            trace=tracing_enabled(),
+            profile=job_serialized.get('profile', False),
+            console_log_path=_path_in_container(console_log_path) if container is not None else console_log_path
         )
-
-        # For unindenting
-        ShellScript(run_py_script).write(os.path.join(temp_path, 'run.py'))
+        job_config_fname = 'job_config.' + _payload_file_extension(payload_format)
+        with open(os.path.join(temp_path, job_config_fname), 'wb') as f:
+            f.write(_encode_payload(job_config, payload_format))
+        runner_path = _materialize_runner_script()
+        if container is not None:
+            runner_in_container_path = _path_in_container(runner_path)
+        else:
+            runner_in_container_path = runner_path
 
         # See: https://wiki.bash-hackers.org/commands/builtin/exec
         run_inside_container_script = """
@@ -131,138 +105,180 @@ def _run_serialized_job_in_container(job_serialized):
             export OMP_NUM_THREADS=$NUM_WORKERS
 
             export {env_vars_inside_container}
-            exec python3 {run_in_container_path}/run.py >> /tmp/debug_log.txt 2>> /tmp/debug_log_err.txt
+            exec python3 {runner_in_container_path} {run_in_container_path}/{job_config_fname} > {run_in_container_path}/runner_out.txt 2>&1
         """.format(
             env_vars_inside_container=' '.join(['{}={}'.format(k, v) for k, v in env_vars_inside_container.items()]),
             num_workers_env=os.getenv('NUM_WORKERS', ''),
-            run_in_container_path=run_in_container_path
+            runner_in_container_path=runner_in_container_path,
+            run_in_container_path=run_in_container_path,
+            job_config_fname=job_config_fname
         )
 
         ShellScript(run_inside_container_script).write(os.path.join(temp_path, 'run.sh'))
 
-        if not os.getenv('KACHERY_STORAGE_DIR'):
-            raise Exception('You must set the environment variable: KACHERY_STORAGE_DIR')
-
-        docker_container_name = None
-
-        # fancy_command = 'bash -c "((bash /run_in_container/run.sh | tee /run_in_container/stdout.txt) 3>&1 1>&2 2>&3 | tee /run_in_container/stderr.txt) 3>&1 1>&2 1>&3 | tee /run_in_container/console_out.txt"'
-        if container is None:
-            run_outside_container_script = """
-                #!/bin/bash
-
-                exec {run_in_container_path}/run.sh
-            """.format(
-                run_in_container_path=run_in_container_path
-            )
-        elif os.getenv('HITHER_USE_SINGULARITY', None) == 'TRUE':
-            if gpu:
-                gpu_opt = '--nv'
-            else:
-                gpu_opt = ''
-            run_outside_container_script = """
-                #!/bin/bash
-
-                # {label} ({name} {version})
-
-                exec singularity exec -e {gpu_opt} \\
-                    -B $KACHERY_STORAGE_DIR:/kachery-storage \\
-                    -B {temp_path}:/run_in_container \\
-                    {container} \\
-                    bash /run_in_container/run.sh
-            """.format(
-                gpu_opt=gpu_opt,
+        timestamp_run = time.time()
+        retcode = None
+        did_timeout = False
+        if container is not None and _container_pool_enabled():
+            # Paths as seen from the worker container, where $KACHERY_STORAGE_DIR is mounted at /kachery-storage
+            code_in_worker_path = _path_in_container(code_path)
+            retcode = _run_job_in_pooled_container(
                 container=container,
-                temp_path=temp_path,
-                label=label,
-                name=name,
-                version=version
+                job_dir=_path_in_container(temp_path),
+                script=runner_in_container_path,
+                args=[_path_in_container(os.path.join(temp_path, job_config_fname))],
+                env=dict(
+                    KACHERY_STORAGE_DIR='/kachery-storage',
+                    PYTHONPYCACHEPREFIX='/kachery-storage/hither2_code_cache/pycache'
+                ),
+                python_path=[code_in_worker_path, f'{code_in_worker_path}/function_src/_local_modules'],
+                stdout=_path_in_container(os.path.join(temp_path, 'runner_out.txt')),
+                stderr=_path_in_container(os.path.join(temp_path, 'runner_out.txt')),
+                timeout=timeout
             )
-        else:
-            if gpu:
-                gpu_opt = '--gpus all'
-            else:
-                gpu_opt = ''
-            docker_container_name = _random_string(8) + '_' + name
-            # May not want to use -t below as it has the potential to mess up line feeds in the parent process!
-            if (sys.platform == "win32"):
-                if 1: # pragma: no cover
-                    ## This win32 section needs to be updated!
-                    winpath_ = lambda a : '/' + a.replace('\\','/').replace(':','')
-                    container_ = _docker_form_of_container_string(container)
-                    temp_path_ = winpath_(temp_path)
-                    kachery_storage_dir_ = winpath_(os.getenv('KACHERY_STORAGE_DIR'))
-                    print('temp_path_: ' + temp_path_)
-                    run_outside_container_script = f'''
-                        docker run --name {docker_container_name} -i {gpu_opt} ^
-                        -v {kachery_storage_dir_}:/kachery-storage ^
-                        -v {temp_path_}:/run_in_container ^
-                        {container_} ^
-                        bash /run_in_container/run.sh'''
-            else:
+        if retcode is None:
+            docker_container_name = None
+
+            # fancy_command = 'bash -c "((bash /run_in_container/run.sh | tee /run_in_container/stdout.txt) 3>&1 1>&2 2>&3 | tee /run_in_container/stderr.txt) 3>&1 1>&2 1>&3 | tee /run_in_container/console_out.txt"'
+            if container is None:
                 run_outside_container_script = """
-                #!/bin/bash
-
-                # {label} ({name} {version})
-
-                exec docker run --name {docker_container_name} -i {gpu_opt} \\
-                    -v /etc/localtime:/etc/localtime:ro \\
-                    -v /etc/passwd:/etc/passwd -u `id -u`:`id -g` \\
-                    -v $KACHERY_STORAGE_DIR:/kachery-storage \\
-                    -v {temp_path}:/run_in_container \\
-                    -v /tmp:/tmp \\
-                    -v $HOME:$HOME \\
-                    {container} \\
-                    bash /run_in_container/run.sh
+                    #!/bin/bash
+
+                    exec {run_in_container_path}/run.sh
+                """.format(
+                    run_in_container_path=run_in_container_path
+                )
+            elif os.getenv('HITHER_USE_SINGULARITY', None) == 'TRUE':
+                if gpu:
+                    gpu_opt = '--nv'
+                else:
+                    gpu_opt = ''
+                run_outside_container_script = """
+                    #!/bin/bash
+
+                    # {label} ({name} {version})
+
+                    exec singularity exec -e {gpu_opt} \\
+                        -B $KACHERY_STORAGE_DIR:/kachery-storage \\
+                        -B {temp_path}:/run_in_container \\
+                        -B {code_path}:{code_in_container_path}:ro \\
+                        {container} \\
+                        bash /run_in_container/run.sh
                 """.format(
-                    docker_container_name=docker_container_name,
                     gpu_opt=gpu_opt,
-                    container=_docker_form_of_container_string(container),
+                    container=_resolve_singularity_container(container),
                     temp_path=temp_path,
+                    code_path=code_path,
+                    code_in_container_path=code_in_container_path,
                     label=label,
                     name=name,
                     version=version
                 )
-        print('#############################################################')
-        print(run_outside_container_script)
-        print('#############################################################')
-
-        try:
-            ss = ShellScript(run_outside_container_script, keep_temp_files=False, label='run_outside_container', docker_container_name=docker_container_name)
-            ss.start()
-            timer = time.time()
-            did_timeout = False
-            while True:
-                retcode = ss.wait(0.02)
-                if retcode is not None:
-                    break
-                elapsed = time.time() - timer
-                # TODO: this code is currently unreachable but should be uncommented when `timeout` is used.
-                # if timeout is not None:
-                #     if elapsed > timeout:
-                #         print(f'Stopping job due to timeout {elapsed} > {timeout}')
-                #         did_timeout = True
-                #         ss.stop()
-        finally:
-            if docker_container_name is not None:
-                ss_cleanup = ShellScript(f"""
-                #!/bin/bash
-
-                docker stop {docker_container_name} || true
-                docker kill {docker_container_name} || true
-                docker rm {docker_container_name} || true
-                """)
-                ss_cleanup.start()
-                ss_cleanup.wait()
+            else:
+                if gpu:
+                    gpu_opt = '--gpus all'
+                else:
+                    gpu_opt = ''
+                docker_container_name = _random_string(8) + '_' + name
+                # May not want to use -t below as it has the potential to mess up line feeds in the parent process!
+                if (sys.platform == "win32"):
+                    if 1: # pragma: no cover
+                        ## This win32 section needs to be updated!
+                        winpath_ = lambda a : '/' + a.replace('\\','/').replace(':','')
+                        container_ = _docker_form_of_container_string(container)
+                        temp_path_ = winpath_(temp_path)
+                        code_path_ = winpath_(code_path)
+                        kachery_storage_dir_ = winpath_(os.getenv('KACHERY_STORAGE_DIR'))
+                        print('temp_path_: ' + temp_path_)
+                        run_outside_container_script = f'''
+                            docker run --name {docker_container_name} -i {gpu_opt} ^
+                            -v {kachery_storage_dir_}:/kachery-storage ^
+                            -v {temp_path_}:/run_in_container ^
+                            -v {code_path_}:{code_in_container_path}:ro ^
+                            {container_} ^
+                            bash /run_in_container/run.sh'''
+                else:
+                    run_outside_container_script = """
+                    #!/bin/bash
+
+                    # {label} ({name} {version})
+
+                    exec docker run --name {docker_container_name} -i {gpu_opt} \\
+                        -v /etc/localtime:/etc/localtime:ro \\
+                        -v /etc/passwd:/etc/passwd -u `id -u`:`id -g` \\
+                        -v $KACHERY_STORAGE_DIR:/kachery-storage \\
+                        -v {temp_path}:/run_in_container \\
+                        -v {code_path}:{code_in_container_path}:ro \\
+                        -v /tmp:/tmp \\
+                        -v $HOME:$HOME \\
+                        {container} \\
+                        bash /run_in_container/run.sh
+                    """.format(
+                        docker_container_name=docker_container_name,
+                        gpu_opt=gpu_opt,
+                        container=_docker_form_of_container_string(container),
+                        temp_path=temp_path,
+                        code_path=code_path,
+                        code_in_container_path=code_in_container_path,
+                        label=label,
+                        name=name,
+                        version=version
+                    )
+            print('#############################################################')
+            print(run_outside_container_script)
+            print('#############################################################')
+
+            try:
+                ss = ShellScript(run_outside_container_script, keep_temp_files=False, label='run_outside_container', docker_container_name=docker_container_name)
+                ss.start()
+                timer = time.time()
+                did_timeout = False
+                while True:
+                    retcode = ss.wait(0.02)
+                    if retcode is not None:
+                        break
+                    elapsed = time.time() - timer
+                    if timeout is not None:
+                        if elapsed > timeout:
+                            print(f'Stopping job due to timeout {elapsed} > {timeout}')
+                            did_timeout = True
+                            ss.stop()
+            finally:
+                if docker_container_name is not None:
+                    ss_cleanup = ShellScript(f"""
+                    #!/bin/bash
+
+                    docker stop {docker_container_name} || true
+                    docker kill {docker_container_name} || true
+                    docker rm {docker_container_name} || true
+                    """)
+                    ss_cleanup.start()
+                    ss_cleanup.wait()
+
+        _record_span('run in container' if container is not None else 'run job script', timestamp_run, time.time(),
+            job_id=job_serialized['job_id'], container=container)
 
         # Need to think about the rest of this function
         if (retcode != 0) and (not did_timeout):
+            # nothing refers to the console log of the job in this case
+            if os.path.exists(console_log_path):
+                os.remove(console_log_path)
             # This is a genuine framework exception because if it were a function exception, we'd get that reported in the runtime_info
-            raise Exception('Unexpected non-zero exit code ({}) running [{}] in container {}'.format(retcode, label, container))
+            raise Exception('Unexpected non-zero exit code ({}) running [{}] in container {}{}'.format(retcode, label, container, _runner_output_tail(temp_path)))
+        if did_timeout and not os.path.exists(os.path.join(temp_path, 'result.json')):
+            if os.path.exists(console_log_path):
+                os.remove(console_log_path)
+            raise Exception(f'Job timed out after {timeout} seconds: [{label}]')
 
         with open(os.path.join(temp_path, 'result.json')) as f:
             obj = json.load(f)
+        # spans recorded by the runner
+        _add_trace_events(obj.get('trace_events', None))
         retval = _deserialize_item(obj['retval'])
         runtime_info = obj['runtime_info']
+        if 'console_log' in runtime_info:
+            runtime_info['console_log']['path'] = console_log_path
+            _finalize_console_log(runtime_info['console_log'])
         success = obj['success']
         error = obj['error']
         if not success:
@@ -277,15 +293,109 @@ def _run_serialized_job_in_container(job_serialized):
         
         return success, retval, runtime_info, error
 
-def _write_python_code_to_directory(dirname: str, code: dict) -> None:
-    if os.path.exists(dirname):
-        raise Exception(
-            'Cannot write code to already existing directory: {}'.format(dirname))
-    os.mkdir(dirname)
-    for item in code['files']:
-        fname0 = dirname + '/' + item['name']
-        with open(fname0, 'w', newline='\n') as f:
-            f.write(item['content'])
-    for item in code['dirs']:
-        _write_python_code_to_directory(
-            dirname + '/' + item['name'], item['content'])
+def _runner_output_tail(temp_path: str, num_lines: int=20) -> str:
+    # The last lines written by the runner outside of the console capture (e.g., a failed import of hither2)
+    fname = os.path.join(temp_path, 'runner_out.txt')
+    if not os.path.exists(fname):
+        return ''
+    with open(fname, 'r', errors='replace') as f:
+        lines = f.read().splitlines()[-num_lines:]
+    if len(lines) == 0:
+        return ''
+    return ':\n' + '\n'.join(lines)
+
+def _materialize_runner_script() -> str:
+    return _materialize_file('runners', 'run.py', _RUNNER_SCRIPT)
+
+# Runs a job inside the container: python3 run.py <job config file>
+# The result is written to result.json in the directory of the job config file.
+_RUNNER_SCRIPT = """#!/usr/bin/env python
+
+import importlib
+import os
+import sys
+import json
+import traceback
+
+def main():
+    job_config_path = sys.argv[1]
+    try:
+        import hither2.runtime
+        ok_import_hither2 = True
+    except Exception as e:
+        traceback.print_exc()
+        retval = None
+        success = False
+        error = str(e)
+        runtime_info = dict()
+        ok_import_hither2 = False
+
+    if ok_import_hither2:
+        from hither2.runtime import ConsoleCapture, _ResourceMonitor
+        from hither2.runtime import enable_tracing, _span, _set_trace_process_name, _job_trace_events
+        from hither2.runtime import _Profile
+        from hither2.runtime import _deserialize_item, _serialize_item, _copy_structure_with_changes
+        from hither2.runtime import _resolve_files_in_item, _decode_payload
+        from hither2.runtime import File
+
+        with open(job_config_path, 'rb') as f:
+            data = bytearray(os.path.getsize(job_config_path))
+            f.readinto(data)
+        job_config = _decode_payload(data)
+        function_name = job_config['function_name']
+        label = job_config['label']
+        kwargs = _deserialize_item(job_config['kwargs'])
+        job_id = job_config.get('job_id', None)
+        if job_config.get('trace', False):
+            enable_tracing()
+            _set_trace_process_name('container' if job_config.get('in_container', False) else 'job script')
+        profile = _Profile(job_config.get('profile', False))
+        with _ResourceMonitor(cgroup=job_config.get('in_container', False)) as rm:
+            with ConsoleCapture(label=label, show_console=job_config['show_console'], log_path=job_config.get('console_log_path', None)) as cc:
+                print('###### RUNNING: ' + label)
+                try:
+                    function = getattr(importlib.import_module('function_src'), function_name)
+                    if not job_config['no_resolve_input_files']:
+                        with _span('resolve input files', job_id=job_id):
+                            kwargs = _resolve_files_in_item(kwargs)
+                    with _span('run function', job_id=job_id, function_name=function_name):
+                        with profile:
+                            retval = function(**kwargs)
+                    with _span('store results', job_id=job_id):
+                        retval = _copy_structure_with_changes(retval, File.kache_numpy_array)
+                    success = True
+                    error = None
+                except Exception as e:
+                    traceback.print_exc()
+                    retval = None
+                    success = False
+                    error = str(e)
+        
+        with _span('serialize result', job_id=job_id):
+            retval = _serialize_item(retval)
+        
+        runtime_info = cc.runtime_info()
+        runtime_info['resource_usage'] = rm.resource_usage()
+        if job_config.get('profile', False):
+            runtime_info['profile'] = profile.store(function_name)
+        trace_events = _job_trace_events(job_id) if job_config.get('trace', False) else None
+    else:
+        trace_events = None
+    result = dict(
+        retval=retval,
+        success=success,
+        runtime_info=runtime_info,
+        error=error,
+        trace_events=trace_events
+    )
+    with open(os.path.join(os.path.dirname(os.path.abspath(job_config_path)), 'result.json'), 'w') as f:
+        json.dump(result, f)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        raise
+"""
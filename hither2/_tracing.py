@@ -0,0 +1,148 @@
+from contextlib import contextmanager
+import json
+import os
+import random
+import socket
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Tuple, Union
+
+# Timestamped spans of the stages of the jobs (queueing, cache lookup, code upload, container
+# preparation, file transfers, execution, ...), recorded when tracing is enabled and exported in
+# the Chrome trace event format (viewable in chrome://tracing or https://ui.perfetto.dev).
+#
+# Spans recorded in other processes (parallel/slurm workers, containers, compute resources)
+# travel back with the job in runtime_info['trace_events'] and are merged into the trace of
+# the process that waits for the job. Those processes then forget the spans of the job.
+
+# The recorded events by (pid, tid, ts, name), so that the events of a job may be merged more than once
+_trace_events: Dict[Tuple[Any, Any, Any, Any], dict] = dict()
+# The keys of the spans of each job, for _job_trace_events
+_job_trace_event_keys: Dict[str, List[Tuple[Any, Any, Any, Any]]] = dict()
+_trace_lock = threading.Lock()
+# Processes in different containers or on different machines may have the same pid
+_trace_pid = random.randint(1, 2 ** 31 - 1)
+_trace_process_name = 'hither2'
+
+def _new_trace_pid() -> None:
+    global _trace_pid
+    _trace_pid = random.randint(1, 2 ** 31 - 1)
+
+if hasattr(os, 'register_at_fork'):
+    # e.g., the processes of the ParallelJobHandler
+    os.register_at_fork(after_in_child=_new_trace_pid)
+
+def enable_tracing() -> None:
+    """Start recording the spans of the stages of the jobs (see export_trace).
+
+    Also enables tracing in the processes started from this one.
+    """
+    os.environ['HITHER_TRACE'] = 'TRUE'
+
+def disable_tracing() -> None:
+    os.environ.pop('HITHER_TRACE', None)
+
+def tracing_enabled() -> bool:
+    return os.getenv('HITHER_TRACE', None) == 'TRUE'
+
+def export_trace(path: Union[str, None]=None) -> dict:
+    """Export the recorded spans in the Chrome trace event format
+
+    Parameters
+    ----------
+    path : Union[str, None], optional
+        The json file to write, by default None
+
+    Returns
+    -------
+    dict
+        The trace, i.e., {'traceEvents': [...], 'displayTimeUnit': 'ms'}
+    """
+    with _trace_lock:
+        trace = dict(traceEvents=list(_trace_events.values()), displayTimeUnit='ms')
+    if path is not None:
+        with open(path, 'w') as f:
+            json.dump(trace, f)
+    return trace
+
+def reset_trace() -> None:
+    global _trace_events, _job_trace_event_keys
+    with _trace_lock:
+        _trace_events = dict()
+        _job_trace_event_keys = dict()
+
+def _set_trace_process_name(name: str) -> None:
+    global _trace_process_name
+    _trace_process_name = name
+
+@contextmanager
+def _span(name: str, *, job_id: Union[str, None]=None, **args) -> Iterator[None]:
+    if not tracing_enabled():
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        _record_span(name, start, time.time(), job_id=job_id, **args)
+
+def _record_span(name: str, start: float, end: float, *, job_id: Union[str, None]=None, **args) -> None:
+    if not tracing_enabled():
+        return
+    if job_id is not None:
+        args['job_id'] = job_id
+    event = dict(
+        name=name,
+        cat='hither2',
+        ph='X',
+        ts=start * 1e6,
+        dur=max(0, end - start) * 1e6,
+        pid=_trace_pid,
+        tid=threading.get_ident() % (2 ** 31),
+        args=args
+    )
+    _add_trace_events([_process_name_event(), event])
+
+def _process_name_event() -> dict:
+    return dict(
+        name='process_name',
+        ph='M',
+        pid=_trace_pid,
+        args=dict(name=f'{_trace_process_name} ({socket.gethostname()}, pid {os.getpid()})')
+    )
+
+def _add_trace_events(events: Union[List[dict], None]) -> None:
+    # Events already recorded are skipped, so that the events of a job may be merged more than once
+    if not events:
+        return
+    with _trace_lock:
+        for event in events:
+            key = (event['pid'], event.get('tid', None), event.get('ts', None), event['name'])
+            if key in _trace_events:
+                continue
+            _trace_events[key] = event
+            job_id = event['args'].get('job_id', None) if event['ph'] == 'X' else None
+            if job_id is not None:
+                _job_trace_event_keys.setdefault(job_id, []).append(key)
+
+def _trace_events_end(events: Union[List[dict], None]) -> Union[float, None]:
+    # The time (in seconds) at which the last of the spans ended
+    ends = [(e['ts'] + e['dur']) / 1e6 for e in (events or []) if e['ph'] == 'X']
+    if len(ends) == 0:
+        return None
+    return max(ends)
+
+def _job_trace_events(job_id: str, forget: bool=False) -> List[dict]:
+    # The events of a job along with the names of the processes where they were recorded, for runtime_info['trace_events']
+    with _trace_lock:
+        keys = _job_trace_event_keys.pop(job_id, []) if forget else _job_trace_event_keys.get(job_id, [])
+        events = [_trace_events.pop(key) if forget else _trace_events[key] for key in keys]
+        # (see _process_name_event for the key)
+        process_name_keys = [(pid, None, None, 'process_name') for pid in sorted(set([e['pid'] for e in events]))]
+        return [_trace_events[key] for key in process_name_keys if key in _trace_events] + events
+
+def _attach_job_trace_events(job_id: str, runtime_info: Union[Dict[str, Any], None], forget: bool=False) -> None:
+    # forget: the events are sent along with the job, so this process need not keep them
+    if not tracing_enabled() or runtime_info is None:
+        return
+    runtime_info['trace_events'] = _job_trace_events(job_id, forget=forget)
@@ -1,11 +1,23 @@
 from typing import Union, List, Any, Callable
+import base64
+import io
 import random
+import sys
 from ._enums import HitherFileType
 from .file import File
 
-def _serialize_item(x, require_jsonable=True):
+def _serialize_item(x, require_jsonable=True, encode_arrays=True):
+    # encode_arrays=False leaves ndarrays in place, for binary payloads (see _payload.py)
     if isinstance(x, File):
         return x.serialize()
+    elif _is_ndarray(x) and not encode_arrays:
+        return x
+    elif _is_ndarray(x):
+        # small arrays are embedded inline (larger ones are boxed into kachery Files upstream)
+        return dict(
+            _type='ndarray',
+            npy_b64=_npy_to_b64(x)
+        )
     # TODO: move these cases where they belong
     # elif isinstance(x, np.integer):
     #     return int(x)
@@ -17,15 +29,15 @@ def _serialize_item(x, require_jsonable=True):
     elif type(x) == dict:
         ret = dict()
         for key, val in x.items():
-            ret[key] = _serialize_item(val, require_jsonable=require_jsonable)
+            ret[key] = _serialize_item(val, require_jsonable=require_jsonable, encode_arrays=encode_arrays)
         return ret
     elif type(x) == list:
-        return [_serialize_item(val, require_jsonable=require_jsonable) for val in x]
+        return [_serialize_item(val, require_jsonable=require_jsonable, encode_arrays=encode_arrays) for val in x]
     elif type(x) == tuple:
         # we need to distinguish between a tuple and list for json serialization
         return dict(
             _type='tuple',
-            data=_serialize_item(list(x), require_jsonable=require_jsonable)
+            data=_serialize_item(list(x), require_jsonable=require_jsonable, encode_arrays=encode_arrays)
         )
     else:
         if _is_jsonable(x):
@@ -49,6 +61,8 @@ def _deserialize_item(x):
     if type(x) == dict:
         if '_type' in x and x['_type'] == 'tuple':
             return _deserialize_item(tuple(x['data']))
+        if '_type' in x and x['_type'] == 'ndarray':
+            return _b64_to_npy(x['npy_b64'])
         if File.can_deserialize(x):
             return File.deserialize(x)
         ret = dict()
@@ -59,22 +73,32 @@ def _deserialize_item(x):
         return [_deserialize_item(val) for val in x]
     elif type(x) == tuple:
         return tuple([_deserialize_item(val) for val in x])
+    elif _is_ndarray(x):
+        # decoded from a binary payload
+        return x
     else:
         if _is_jsonable(x):
             # this will capture int, float, str, bool
             return x
     raise Exception(f'Unable to deserialize item of type: {type(x)}')
 
-# Might be useful to keep these around even though we don't use them any more
-# def _npy_to_b64(x):
-#     f = io.BytesIO()
-#     np.save(f, x)
-#     return base64.b64encode(f.getvalue()).decode('utf-8')
-
-# def _b64_to_npy(x):
-#     bytes0 = base64.b64decode(x.encode())
-#     f = io.BytesIO(bytes0)
-#     return np.load(f)
+def _is_ndarray(x):
+    # numpy is slow to import and is not needed unless the job involves arrays, which
+    # cannot exist before numpy has been imported (by the function or by a deserialized array)
+    np = sys.modules.get('numpy', None)
+    return np is not None and isinstance(x, np.ndarray)
+
+def _npy_to_b64(x):
+    import numpy as np
+    f = io.BytesIO()
+    np.save(f, x, allow_pickle=False)
+    return base64.b64encode(f.getvalue()).decode('utf-8')
+
+def _b64_to_npy(x):
+    import numpy as np
+    bytes0 = base64.b64decode(x.encode())
+    f = io.BytesIO(bytes0)
+    return np.load(f, allow_pickle=False)
 
 def _utctime():
     from datetime import datetime, timezone
@@ -1,17 +1,38 @@
+from collections import OrderedDict
+import os
 import time
 import kachery as ka
 from .core import _serialize_item, _deserialize_job, _prepare_container
-from ._util import _random_string, _utctime
+from ._util import _random_string, _utctime, _flatten_nested_collection
+from ._prefetch import _Prefetcher, DEFAULT_PREFETCH_MAX_BYTES
+from ._payload import PAYLOAD_FORMATS, _encode_payload, _decode_document_payload
+from ._payload import _compress_document_field, _decompress_document_field, _compression_codecs
+from ._consolelog import read_console_log, _finalize_console_log
+from ._tracing import _span, _record_span, _add_trace_events, _attach_job_trace_events, _set_trace_process_name, tracing_enabled
 from .database import Database
 from ._enums import JobStatus
 from .file import File
 
+# Number of seconds for which a compute resource instance holds its claim on a job without renewal
+DEFAULT_LEASE_DURATION = 60
+# Number of seconds between heartbeats written to active_compute_resources
+HEARTBEAT_INTERVAL = 3
+# Number of loaded function code objects kept in memory
+MAX_NUM_CACHED_CODE_OBJECTS = 50
+# Number of times a job status update that failed to be written is retried before giving up
+MAX_JOB_UPDATE_ATTEMPTS = 3
+# Job handlers that have not reported for this many seconds are considered inactive
+JOB_HANDLER_EXPIRATION = 10
+# Number of seconds between refreshes of the cached set of active job handlers
+ACTIVE_JOB_HANDLERS_REFRESH_INTERVAL = 3
+
 # TODO: Functionalize, tighten.
 # TODO: Consider filtering db query/filter/update statements through an interface function.
 # TODO: Inject a JobManager into this instead of relying on redirection through core._prepare_container?
 
 class ComputeResource:
-    def __init__(self, *, database: Database, compute_resource_id, kachery, job_handler, job_cache=None):
+    def __init__(self, *, database: Database, compute_resource_id, kachery, job_handler, job_cache=None, prefetch_max_bytes=DEFAULT_PREFETCH_MAX_BYTES,
+                lease_duration=DEFAULT_LEASE_DURATION):
         self._database = database
         self._compute_resource_id = compute_resource_id
         self._kachery = kachery
@@ -19,9 +40,30 @@ class ComputeResource:
         self._database = database
         self._timestamp_database_poll = 0
         self._timestamp_last_action = time.time()
+        self._timestamp_report_active = 0
+        # Wakes up _iterate() as soon as a job is submitted to this compute resource
+        self._notifier = database.watch('hither2_jobs', dict(
+            compute_resource_id=compute_resource_id,
+            compute_resource_status=JobStatus.PENDING.value
+        ))
         self._job_handler = job_handler
         self._job_cache = job_cache
         self._jobs = dict()
+        # jobs whose input files are being downloaded before they are handed to the job handler
+        self._jobs_awaiting_input_files = dict()
+        self._prefetcher = _Prefetcher(max_bytes=prefetch_max_bytes)
+        # Jobs are claimed by this instance for lease_duration seconds at a time (renewed while
+        # the jobs are held), so that several instances can serve the same compute resource id
+        self._lease_duration = lease_duration
+        self._timestamp_lease_renewal = 0
+        # ids of the active job handlers, refreshed from the database every ACTIVE_JOB_HANDLERS_REFRESH_INTERVAL seconds
+        self._active_job_handler_ids = set()
+        self._timestamp_active_job_handlers_refresh = 0
+        # recently loaded code objects, by sha1 path (least recently used first)
+        self._code_objects = OrderedDict()
+        # job status updates waiting to be written in one bulk write at the end of the iteration (by job id)
+        self._pending_job_updates = dict()
+        _set_trace_process_name('compute resource ' + compute_resource_id)
     def clear(self):
         db = self._get_db()
         db.delete_many(dict(
@@ -37,22 +79,28 @@ class ComputeResource:
         self._iterate_timer = time.time()
         db = self._get_db()
 
+        if time.time() - self._timestamp_report_active > HEARTBEAT_INTERVAL:
+            self._report_active()
+
         elapsed_database_poll = time.time() - self._timestamp_database_poll
-        if elapsed_database_poll > self._poll_interval():
+        if self._notifier.poll_due(elapsed_database_poll, self._poll_interval()):
             self._timestamp_database_poll = time.time()
 
-            self._report_active()
-
-            # Handle pending jobs
-            query = dict(
-                compute_resource_id=self._compute_resource_id,
-                last_modified_by_compute_resource=False,
-                status=JobStatus.QUEUED.value,
-                compute_resource_status=JobStatus.PENDING.value  # status on the compute resource
-            )
-            for doc in db.find(query):
+            # Handle pending jobs, claiming them one at a time. Handling a job may take a while
+            # (e.g., pulling its container image), so the leases are extended between claims.
+            while True:
+                self._renew_leases_if_due()
+                doc = self._claim_next_pending_job()
+                if doc is None:
+                    break
                 self._report_action()
                 self._handle_pending_job(doc)
+
+        # Extend the leases on the jobs we hold
+        self._renew_leases_if_due()
+
+        # Hand over the jobs whose input files have finished downloading
+        self._handle_jobs_awaiting_input_files()
         
         # Handle jobs
         job_ids = list(self._jobs.keys())
@@ -62,10 +110,7 @@ class ComputeResource:
             if job._status == JobStatus.RUNNING:
                 if reported_status != JobStatus.RUNNING:
                     print(f'Job running: {job_id}')
-                    filter0 = dict(
-                        compute_resource_id=self._compute_resource_id,
-                        job_id=job_id
-                    )
+                    filter0 = self._claimed_job_filter(job_id)
                     update = {
                         '$set': dict(
                             status=JobStatus.RUNNING.value,
@@ -73,20 +118,22 @@ class ComputeResource:
                             last_modified_by_compute_resource=True
                         )
                     }
-                    db.update_one(filter0, update=update)
+                    self._queue_job_update(filter0, update)
                     self._report_action()
                     setattr(job, '_reported_status', JobStatus.RUNNING)
             elif job._status == JobStatus.FINISHED:
                 print(f'Job finished: {job_id}')
+                _record_span('in job handler', getattr(job, '_timestamp_handled', time.time()), time.time(), job_id=job_id)
                 self._handle_finished_job(job)
                 if self._job_cache is not None:
                     self._job_cache.cache_job_result(job)
                 del self._jobs[job_id]
             elif job._status == JobStatus.ERROR:
-                # _print_console_out(job._runtime_info['console_out'])
                 print(job._exception)
                 print(f'Job error: {job_id}')
-                self._mark_job_as_error(job_id=job_id, runtime_info=job._runtime_info, exception=job._exception)
+                _record_span('in job handler', getattr(job, '_timestamp_handled', time.time()), time.time(), job_id=job_id)
+                self._mark_job_as_error(job_id=job_id, runtime_info=job._runtime_info, exception=job._exception,
+                    compression_codecs=getattr(job, '_compression_codecs', None))
                 del self._jobs[job_id]
             
             # check if handler is still active
@@ -94,46 +141,185 @@ class ComputeResource:
                 handler_id = getattr(job, '_handler_id')
                 if handler_id not in active_job_handler_ids:
                     print(f'Removing job because client handler is no longer active: {job_id}')
-                    self._job_handler.cancel_job(job_id)
-                    filter0 = dict(
-                        compute_resource_id=self._compute_resource_id,
-                        job_id=job_id
-                    )
-                    db.delete_many(filter0)
-                    del self._jobs[job_id]
+                    db.delete_many(self._claimed_job_filter(job_id))
+                    self._forget_job(job_id)
         
+        self._flush_job_updates()
+
         self._job_handler.iterate()
     
+    def _queue_job_update(self, filter0, update):
+        job_id = filter0['job_id']
+        if job_id in self._pending_job_updates:
+            # a later update of the same job takes precedence (the bulk write is unordered)
+            self._pending_job_updates[job_id]['set'].update(update['$set'])
+        else:
+            self._pending_job_updates[job_id] = dict(filter=filter0, set=dict(update['$set']), num_attempts=0)
+
+    def _flush_job_updates(self):
+        if len(self._pending_job_updates) == 0:
+            return
+        from pymongo import UpdateOne
+        from pymongo.errors import BulkWriteError
+        pending = list(self._pending_job_updates.values())
+        self._pending_job_updates = dict()
+        db = self._get_db()
+        errors = dict()
+        try:
+            db.bulk_write([UpdateOne(p['filter'], {'$set': p['set']}) for p in pending], ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get('writeErrors', []):
+                errors[err['index']] = err.get('errmsg', 'unknown error')
+        except Exception as e:
+            # nothing was confirmed as written; keep everything for the next attempt
+            print(f'Warning: problem updating jobs in database (will retry): {e}')
+            for p in pending:
+                self._queue_job_update(p['filter'], {'$set': p['set']})
+            return
+        for index, p in enumerate(pending):
+            if index not in errors:
+                self._database.notify('hither2_jobs', {**p['filter'], **p['set']})
+                continue
+            job_id = p['filter']['job_id']
+            p['num_attempts'] += 1
+            if p['num_attempts'] < MAX_JOB_UPDATE_ATTEMPTS:
+                print(f'Warning: problem updating job in database (will retry): {job_id}: {errors[index]}')
+                self._pending_job_updates[job_id] = p
+            elif p['set'].get('status', None) != JobStatus.ERROR.value:
+                # for example, the result is too large for the document; report that to the client instead
+                print(f'Unable to update job in database: {job_id}: {errors[index]}')
+                self._queue_job_update(p['filter'], {'$set': dict(
+                    status=JobStatus.ERROR.value,
+                    compute_resource_status=JobStatus.ERROR.value,
+                    result=None,
+                    runtime_info=None,
+                    exception=f'Unable to update job in database: {errors[index]}',
+                    last_modified_by_compute_resource=True
+                )})
+            else:
+                print(f'Unable to update job in database: {job_id}: {errors[index]}')
+
+    def _claim_next_pending_job(self):
+        # Atomically find a job that is pending on this compute resource (or whose lease held by
+        # another instance has expired) and mark it as claimed by this instance
+        from pymongo import ReturnDocument
+        db = self._get_db()
+        now = _utctime()
+        query = {
+            'compute_resource_id': self._compute_resource_id,
+            '$or': [
+                dict(
+                    last_modified_by_compute_resource=False,
+                    status=JobStatus.QUEUED.value,
+                    compute_resource_status=JobStatus.PENDING.value,  # status on the compute resource
+                    claimed_by=None
+                ),
+                dict(
+                    status={'$in': [JobStatus.QUEUED.value, JobStatus.RUNNING.value]},
+                    compute_resource_status={'$in': [JobStatus.PENDING.value, JobStatus.QUEUED.value, JobStatus.RUNNING.value]},
+                    claim_expires={'$lt': now},
+                    # our own jobs are still held by us, even if we were too busy to renew their leases
+                    claimed_by={'$ne': self._instance_id}
+                )
+            ]
+        }
+        update = {
+            '$set': dict(
+                claimed_by=self._instance_id,
+                claim_expires=now + self._lease_duration
+            )
+        }
+        return db.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+
+    def _renew_leases_if_due(self):
+        if time.time() - self._timestamp_lease_renewal > self._lease_duration / 3:
+            self._timestamp_lease_renewal = time.time()
+            self._renew_leases()
+
+    def _renew_leases(self):
+        job_ids = list(self._jobs.keys()) + list(self._jobs_awaiting_input_files.keys())
+        if len(job_ids) == 0:
+            return
+        db = self._get_db()
+        query = dict(
+            compute_resource_id=self._compute_resource_id,
+            claimed_by=self._instance_id,
+            job_id={'$in': job_ids}
+        )
+        update = {
+            '$set': dict(
+                claim_expires=_utctime() + self._lease_duration
+            )
+        }
+        result = db.update_many(query, update=update)
+        if result.matched_count == len(job_ids):
+            return
+        # Another instance claimed the jobs whose leases expired (or the jobs were removed),
+        # so our updates of them would be dropped anyway
+        held_job_ids = set([doc['job_id'] for doc in db.find(query, projection=dict(_id=False, job_id=True))])
+        for job_id in job_ids:
+            if job_id not in held_job_ids:
+                print(f'Lost the claim on job: {job_id}')
+                self._forget_job(job_id)
+
+    def _forget_job(self, job_id):
+        if job_id in self._jobs:
+            self._job_handler.cancel_job(job_id)
+            del self._jobs[job_id]
+        if job_id in self._jobs_awaiting_input_files:
+            del self._jobs_awaiting_input_files[job_id]
+            self._prefetcher.release(job_id)
+        self._pending_job_updates.pop(job_id, None)
+
+    def _claimed_job_filter(self, job_id):
+        # Updates only apply while this instance still holds the claim on the job
+        return dict(
+            compute_resource_id=self._compute_resource_id,
+            job_id=job_id,
+            claimed_by=self._instance_id
+        )
+
     def _get_active_job_handler_ids(self):
+        if time.time() - self._timestamp_active_job_handlers_refresh > ACTIVE_JOB_HANDLERS_REFRESH_INTERVAL:
+            self._refresh_active_job_handler_ids()
+        return self._active_job_handler_ids
+    
+    def _refresh_active_job_handler_ids(self):
+        self._timestamp_active_job_handlers_refresh = time.time()
         db = self._get_db(collection='active_job_handlers')
         db_jobs = self._get_db()
 
-        # remove the expired job handlers
-        t0 = _utctime() - 10
-        query = dict(
-            utctime={'$lt': t0}
-        )
-        for doc in db.find(query):
-            handler_id = doc['handler_id']
-            print(f'Removing job handler: {handler_id}')
-            db.delete_many(dict(handler_id=handler_id))
-            db_jobs.delete_many(dict(handler_id=handler_id))
+        t0 = _utctime() - JOB_HANDLER_EXPIRATION
+        active_handler_ids = set()
+        expired_handler_ids = []
+        for doc in db.find({}, projection=dict(_id=False, handler_id=True, utctime=True)):
+            if doc['utctime'] < t0:
+                expired_handler_ids.append(doc['handler_id'])
+            else:
+                active_handler_ids.add(doc['handler_id'])
+
+        # remove the expired job handlers and their jobs
+        if len(expired_handler_ids) > 0:
+            for handler_id in expired_handler_ids:
+                print(f'Removing job handler: {handler_id}')
+            db.delete_many(dict(handler_id={'$in': expired_handler_ids}))
+            db_jobs.delete_many(dict(handler_id={'$in': expired_handler_ids}))
 
-        # return handler ids for those that were not removed
-        return [doc['handler_id'] for doc in db.find({})]
+        self._active_job_handler_ids = active_handler_ids
     
     def _handle_pending_job(self, doc):
         job_id = doc["job_id"]
-        label = doc['job_serialized']['label']
+        # the codecs that the client can decompress (older clients only sent compress_payloads)
+        compression_codecs = doc.get('compression_codecs', ['zlib']) if doc.get('compress_payloads', False) else None
+        job_serialized = _decode_document_payload(_decompress_document_field(doc['job_serialized'], kachery=self._kachery))
+        job_serialized['kwargs'] = _decompress_document_field(job_serialized['kwargs'], kachery=self._kachery)
+        label = job_serialized['label']
         print(f'Queuing job: {label}')
         
-        job_serialized = doc['job_serialized']
         if job_serialized['code'] is not None:
             try:
-                code_obj = ka.load_object(job_serialized['code'], fr=self._kachery)
-                if code_obj is None:
-                    raise Exception("Kachery returned no serialized code for function.")
-                job_serialized['code'] = code_obj
+                with _span('load code', job_id=job_id):
+                    job_serialized['code'] = self._load_code(job_serialized['code'])
             except Exception as e:
                 exc = f'Error loading code for function {label}: {job_serialized["code"]} ({str(e)})'
                 print(exc)
@@ -146,7 +332,8 @@ class ComputeResource:
             self._mark_job_as_error(job_id=job_id, exception=Exception(exc), runtime_info=None)
             return
         try:
-            _prepare_container(container)
+            with _span('wait for container', job_id=job_id, container=container):
+                _prepare_container(container)
         except Exception as e:
             print(f'Error preparing container for pending job: {label}')
             print(e)
@@ -155,49 +342,88 @@ class ComputeResource:
         
         job = _deserialize_job(job_serialized)
         if self._job_cache:
-            self._job_cache.check_job(job)
-        db = self._get_db()
-        filter0 = dict(
-            compute_resource_id=self._compute_resource_id,
-            job_id=doc['job_id']
-        )
+            with _span('job cache lookup', job_id=job_id):
+                self._job_cache.check_job(job)
+        filter0 = self._claimed_job_filter(job_id)
+        setattr(job, '_payload_format', doc.get('payload_format', 'json'))
+        setattr(job, '_compression_codecs', compression_codecs)
         if job._status == JobStatus.FINISHED:
             print(f'Found job in cache: {label}')
             self._handle_finished_job(job)
         elif job._status == JobStatus.ERROR:
             print(f'Found error job in cache: {label}')
-            self._mark_job_as_error(job_id=job_id, exception=job._exception, runtime_info=job._runtime_info)
+            self._mark_job_as_error(job_id=job_id, exception=job._exception, runtime_info=job._runtime_info, compression_codecs=compression_codecs)
         else:
-            try:
-                job.download_parameter_files_if_needed(kachery=self._kachery)
-            except Exception as e:
-                print(f'Error downloading input files for job: {label}')
-                print(e)
-                self._mark_job_as_error(job_id=job_id, exception=e, runtime_info=None)
-                return
-            self._jobs[job_id] = job
-            self._job_handler.handle_job(job)
+            # Download the input files in the background so that the transfers overlap
+            # with the jobs that are already running. The job is handed to the job handler
+            # in _handle_jobs_awaiting_input_files once the downloads complete.
+            files = _flatten_nested_collection(job._wrapped_function_arguments, _type=File)
+            self._prefetcher.request(job_id, files, kachery=self._kachery, required=True)
+            setattr(job, '_timestamp_prefetch_requested', time.time())
+            setattr(job, '_handler_id', doc['handler_id'])
+            # The handler reports itself active just before submitting a job, so it may
+            # be newer than our cached list of active handlers
+            self._active_job_handler_ids.add(doc['handler_id'])
+            self._jobs_awaiting_input_files[job_id] = job
             update = {
                 '$set': dict(
                     compute_resource_status=JobStatus.QUEUED.value,
                     last_modified_by_compute_resource=True
                 )
             }
-            db.update_one(filter0, update=update)
+            self._queue_job_update(filter0, update)
             setattr(job, '_reported_status', JobStatus.QUEUED)
-            setattr(job, '_handler_id', doc['handler_id'])
     
+    def _load_code(self, sha1_path):
+        # The code objects are content-addressed, so the ones already loaded can be reused
+        if sha1_path in self._code_objects:
+            self._code_objects.move_to_end(sha1_path)
+            return self._code_objects[sha1_path]
+        code_obj = ka.load_object(sha1_path, fr=self._kachery)
+        if code_obj is None:
+            raise Exception("Kachery returned no serialized code for function.")
+        self._code_objects[sha1_path] = code_obj
+        while len(self._code_objects) > MAX_NUM_CACHED_CODE_OBJECTS:
+            self._code_objects.popitem(last=False)
+        return code_obj
+
+    def _handle_jobs_awaiting_input_files(self):
+        for job_id in list(self._jobs_awaiting_input_files.keys()):
+            if not self._prefetcher.is_done(job_id):
+                continue
+            job = self._jobs_awaiting_input_files[job_id]
+            del self._jobs_awaiting_input_files[job_id]
+            exc = self._prefetcher.get_exception(job_id)
+            self._prefetcher.release(job_id)
+            _record_span('download input files', getattr(job, '_timestamp_prefetch_requested'), time.time(), job_id=job_id)
+            if exc is not None:
+                print(f'Error downloading input files for job: {job._label}')
+                print(exc)
+                self._mark_job_as_error(job_id=job_id, exception=exc, runtime_info=None)
+                continue
+            self._jobs[job_id] = job
+            setattr(job, '_timestamp_handled', time.time())
+            self._job_handler.handle_job(job)
+
     def _handle_finished_job(self, job):
-        job.kache_results_if_needed(kachery=self._kachery)
-        self._mark_job_as_finished(job_id=job._job_id, runtime_info=job._runtime_info, result=job._result)
+        with _span('store results', job_id=job._job_id):
+            job.kache_results_if_needed(kachery=self._kachery)
+            payload_format = getattr(job, '_payload_format', 'json')
+            if payload_format == 'json':
+                result = _serialize_item(job._result)
+            else:
+                result = _encode_payload(_serialize_item(job._result, encode_arrays=False), payload_format)
+        self._mark_job_as_finished(job_id=job._job_id, runtime_info=job._runtime_info, result=result,
+            compression_codecs=getattr(job, '_compression_codecs', None))
     
-    def _mark_job_as_error(self, *, job_id, runtime_info, exception):
+    def _mark_job_as_error(self, *, job_id, runtime_info, exception, compression_codecs=None):
         print(f'Job error: {job_id}')
-        db = self._get_db()
-        filter0 = dict(
-            compute_resource_id=self._compute_resource_id,
-            job_id=job_id
-        )
+        self._store_console_log(runtime_info)
+        self._store_profile(runtime_info)
+        self._attach_trace_events(job_id, runtime_info)
+        if compression_codecs:
+            runtime_info = _compress_document_field(runtime_info, kachery=self._kachery, codecs=compression_codecs)
+        filter0 = self._claimed_job_filter(job_id)
         update = {
             '$set': dict(
                 status=JobStatus.ERROR.value,
@@ -208,28 +434,57 @@ class ComputeResource:
                 last_modified_by_compute_resource=True
             )
         }
-        db.update_one(filter0, update=update)
+        self._queue_job_update(filter0, update)
         self._report_action()
     
-    def _mark_job_as_finished(self, *, job_id, runtime_info, result):
-        db = self._get_db()
-        filter0 = dict(
-            compute_resource_id=self._compute_resource_id,
-            job_id=job_id
-        )
+    def _mark_job_as_finished(self, *, job_id, runtime_info, result, compression_codecs=None):
+        self._store_console_log(runtime_info)
+        self._store_profile(runtime_info)
+        self._attach_trace_events(job_id, runtime_info)
+        if compression_codecs:
+            runtime_info = _compress_document_field(runtime_info, kachery=self._kachery, codecs=compression_codecs)
+            result = _compress_document_field(result, kachery=self._kachery, codecs=compression_codecs)
+        filter0 = self._claimed_job_filter(job_id)
         update = {
             '$set': dict(
                 status=JobStatus.FINISHED.value,
                 compute_resource_status=JobStatus.FINISHED.value,
-                result=_serialize_item(result),
+                result=result,
                 runtime_info=runtime_info,
                 exception=None,
                 last_modified_by_compute_resource=True
             )
         }
-        db.update_one(filter0, update=update)
+        self._queue_job_update(filter0, update)
         self._report_action()
     
+    def _store_console_log(self, runtime_info):
+        # The console log was stored in the local kachery storage when the job completed
+        if runtime_info is None or runtime_info.get('console_log', None) is None:
+            return
+        console_log = runtime_info['console_log']
+        _finalize_console_log(console_log)
+        if self._kachery is None or console_log.get('sha1_path', None) is None:
+            return
+        path = ka.load_file(console_log['sha1_path'])
+        if path is not None:
+            ka.store_file(path, to=self._kachery)
+    
+    def _store_profile(self, runtime_info):
+        # The profile stats were stored in the local kachery storage by the job
+        if self._kachery is None or runtime_info is None or runtime_info.get('profile', None) is None:
+            return
+        path = ka.load_file(runtime_info['profile']['sha1_path'])
+        if path is not None:
+            ka.store_file(path, to=self._kachery)
+
+    def _attach_trace_events(self, job_id, runtime_info):
+        # Send the spans of the job (including those recorded by the job handler's processes) to the client
+        if runtime_info is None or not tracing_enabled():
+            return
+        _add_trace_events(runtime_info.get('trace_events', None))
+        _attach_job_trace_events(job_id, runtime_info, forget=True)
+
     def _report_action(self):
         self._timestamp_last_action = time.time()
     
@@ -244,6 +499,7 @@ class ComputeResource:
         else:
             return 6
     def _report_active(self):
+        self._timestamp_report_active = time.time()
         db = self._get_db(collection='active_compute_resources')
         filter = dict(
             compute_resource_id=self._compute_resource_id
@@ -252,6 +508,8 @@ class ComputeResource:
             '$set': dict(
                 compute_resource_id=self._compute_resource_id,
                 kachery=self._kachery,
+                payload_formats=PAYLOAD_FORMATS,
+                compression_codecs=_compression_codecs(),
                 utctime=_utctime()
             )
         }
@@ -261,7 +519,9 @@ class ComputeResource:
         return self._database.collection(collection)
 
 def _print_console_out(x):
-    for a in x['lines']:
+    # x is either runtime_info['console_out'] or runtime_info['console_log']
+    lines = x['lines'] if 'lines' in x else read_console_log(x)
+    for a in lines:
         t = _fmt_time(a['timestamp'])
         txt = a['text']
         print(f'{t}: {txt}')
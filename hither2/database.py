@@ -1,11 +1,18 @@
+import time
 from ._load_config import _load_preset_config_from_github
+from ._notifications import LocalNotificationBus, _ChangeNotifier, _MongoChangeStreamNotifier
 
 class Database:
-    def __init__(self, *, mongo_url, database):
+    def __init__(self, *, mongo_url, database, notification_bus: LocalNotificationBus=None):
         self._mongo_url = mongo_url
         self._database = database
+        self._notification_bus = notification_bus
         self._client = None
         self._client_db_url = None
+        # counts of the commands sent to the server (see get_query_stats)
+        self._command_counts = dict()
+        self._timestamp_query_stats = time.time()
+        self._num_commands_at_query_stats = 0
     @staticmethod
     def preset(name):
         config = _load_preset_config_from_github(url='https://raw.githubusercontent.com/laboratorybox/hither2/config/config/2020a.json', name=name)
@@ -20,9 +27,45 @@ class Database:
         if url != self._client_db_url:
             if self._client is not None:
                 self._client.close()
-            self._client = pymongo.MongoClient(url, retryWrites=False)
+            self._client = pymongo.MongoClient(url, retryWrites=False, event_listeners=[_create_command_counter(self._command_counts)])
             self._client_db_url = url
         return self._client[self._database][collection_name]
+    def watch(self, collection_name, match) -> _ChangeNotifier:
+        # Returns a notifier that signals when documents matching <match> (field equality) may have
+        # been inserted or modified, using the local notification bus if one was provided, or
+        # otherwise a Mongo change stream when the server supports them
+        if self._notification_bus is not None:
+            return _ChangeNotifier(self._notification_bus.subscribe(collection_name, match), push_active=True)
+        return _MongoChangeStreamNotifier(self.collection(collection_name), match)
+    def get_query_stats(self):
+        # Returns the number of database commands issued so far (in total and by command name)
+        # and the rate of commands per second since the previous call
+        num_commands = sum(self._command_counts.values())
+        elapsed = time.time() - self._timestamp_query_stats
+        rate = (num_commands - self._num_commands_at_query_stats) / elapsed if elapsed > 0 else 0
+        self._timestamp_query_stats = time.time()
+        self._num_commands_at_query_stats = num_commands
+        return dict(
+            num_commands=num_commands,
+            commands_by_name=dict(self._command_counts),
+            commands_per_second=rate
+        )
+    def notify(self, collection_name, doc):
+        # Called after writing to a collection. Mongo change streams pick up writes on their own,
+        # so this only matters for the local notification bus.
+        if self._notification_bus is not None:
+            self._notification_bus.publish(collection_name, doc)
 
     # TODO: Have this class be more responsible for mediating access to the jobs stored in the Mongo db.
-    # Can serve as a Job-class-aware interface.
\ No newline at end of file
+    # Can serve as a Job-class-aware interface.
+
+def _create_command_counter(command_counts):
+    import pymongo.monitoring
+    class CommandCounter(pymongo.monitoring.CommandListener):
+        def started(self, event):
+            command_counts[event.command_name] = command_counts.get(event.command_name, 0) + 1
+        def succeeded(self, event):
+            pass
+        def failed(self, event):
+            pass
+    return CommandCounter()
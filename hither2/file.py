@@ -1,16 +1,20 @@
-from numpy import ndarray
+import os
 from os import stat
 from os.path import basename
 from typing import Any, List, Union
 
 from ._enums import HitherFileType # TODO: Not yet used; hard-to-track errors in serialization
-import kachery as ka
+
+# Arrays of at most this many bytes are embedded directly in serialized jobs and
+# results rather than being stored as separate kachery files
+INLINE_ARRAY_MAX_BYTES = int(os.getenv('HITHER_INLINE_ARRAY_MAX_BYTES', str(16 * 1024)))
 
 class File:
     def __init__(self, path, item_type='file'):
         if path.startswith('sha1://') or path.startswith('sha1dir://'):
             self._sha1_path = path
         else:
+            import kachery as ka
             self._sha1_path = ka.store_file(path, basename=_get_basename_from_path(path))
         self.path = self._sha1_path
         self._item_type = item_type
@@ -24,7 +28,7 @@ class File:
         return ret
 
 # TODO: Ths "item type" field should be replaced with an enum.
-    def resolve(self) -> Union[str, ndarray]:
+    def resolve(self) -> Union[str, Any]:
         """Ensure that this file is available in Kachery, if it is of type 'file',
         and if it is a boxed numpy array, replace it with the actual numpy array representation.
 
@@ -32,11 +36,12 @@ class File:
             Exception: Thrown if an unrecognized item type exists for the item type.
 
        Returns:
-            Union[str, ndarray] -- Path to the file, if this File represents a file
+            Union[str, numpy.ndarray] -- Path to the file, if this File represents a file
             tracked by kachery; otherwise a numpy array, if this File represents a
             numpy array that was boxed into a kachery file for inter-resource portability.
         """
         if self._item_type == 'file':
+            import kachery as ka
             path = ka.load_file(self._sha1_path)
             assert path is not None, f'Unable to load file: {self._sha1_path} from kachery.'
             return path
@@ -48,6 +53,7 @@ class File:
     def array(self):
         if self._item_type != 'ndarray':
             raise Exception('This file is not of type ndarray')
+        import kachery as ka
         x = ka.load_npy(self._sha1_path)
         if x is None:
             raise Exception(f'Unable to load npy file: {self._sha1_path}')
@@ -56,6 +62,7 @@ class File:
     def ensure_local_availability(self, kachery_src:Union[str, None] = None) -> None:
         # look for file locally or in the specified remote, if any.
         # If found locally, we're done; if found in the kachery source, this downloads it.
+        import kachery as ka
         local_path = ka.load_file(self._sha1_path, fr=kachery_src)
         if local_path is not None:
             return
@@ -77,6 +84,7 @@ class File:
         Keyword Arguments:
             kachery_dest {Union[str, None]} -- Kachery store to store the file. (default: {None})
         """
+        import kachery as ka
         ka.store_file(self._sha1_path, to=kachery_dest)
 
     @staticmethod
@@ -91,11 +99,16 @@ class File:
 
     @staticmethod
     def kache_numpy_array(x: Any) -> Any:
-        if not isinstance(x, ndarray): return x
+        from ._util import _is_ndarray
+        if not _is_ndarray(x): return x
+        if x.nbytes <= INLINE_ARRAY_MAX_BYTES and not x.dtype.hasobject:
+            # small arrays are serialized inline (see _serialize_item)
+            return x
         return File._kache_numpy_array(x)
 
     @staticmethod
-    def _kache_numpy_array(ary: ndarray) -> 'File':
+    def _kache_numpy_array(ary: Any) -> 'File':
+        import kachery as ka
         path = ka.store_npy(ary)
         return File(path, item_type = 'ndarray')
 
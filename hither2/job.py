@@ -8,9 +8,13 @@ import kachery as ka
 from ._Config import Config
 from ._enums import JobStatus
 from .file import File
-from ._generate_source_code_for_function import _generate_source_code_for_function
+from ._generate_source_code_for_function import _generate_source_code_for_function, _function_code_fingerprint
 from .remotejobhandler import RemoteJobHandler
-from ._run_serialized_job_in_container import _run_serialized_job_in_container
+from ._run_serialized_job_in_container import CONTAINER_PAYLOAD_FORMAT
+from ._file_transfer import _ensure_files_available_locally, _resolve_files_in_item
+from ._file_availability import _files_are_available_locally
+from ._tracing import _span, _attach_job_trace_events
+from .runtime import _run_job_code, _run_job_function
 from ._util import _random_string, _docker_form_of_container_string, _deserialize_item, _serialize_item, _flatten_nested_collection, _copy_structure_with_changes
 
 
@@ -19,12 +23,15 @@ class Job:
     def __init__(self, *, f, wrapped_function_arguments,
                 job_manager, job_handler, job_cache, container, label,
                 download_results, job_timeout: Union[float, None], code=None, function_name=None,
-                function_version=None, job_id=None, no_resolve_input_files=False):
+                function_version=None, job_id=None, no_resolve_input_files=False, profile=False, code_fingerprint=None):
         self._f = f
         self._code = code
+        # the fingerprint of the code, when the job was deserialized with its code (see _code_fingerprint)
+        self._given_code_fingerprint = code_fingerprint
         self._function_name = function_name
         self._function_version = function_version
         self._no_resolve_input_files = no_resolve_input_files
+        self._profile = profile
         self._label = label
         self._wrapped_function_arguments = \
             _copy_structure_with_changes(wrapped_function_arguments, File.kache_numpy_array, _as_side_effect=False)
@@ -100,6 +107,8 @@ class Job:
                 raise self._exception
             elif self._status == JobStatus.QUEUED:
                 pass
+            elif self._status == JobStatus.PREPARING:
+                pass
             elif self._status == JobStatus.RUNNING:
                 pass
             else:
@@ -136,12 +145,7 @@ class Job:
         """
         actual_result = self._result if results is None else results
         result_items = _flatten_nested_collection(actual_result, _type=File)
-        for item in result_items:
-            assert isinstance(item, File), "Filter failed."
-            info = ka.get_file_info(item._sha1_path, fr=None)
-            if info is None:
-                return False
-        return True
+        return _files_are_available_locally(result_items)
 
     def ensure_job_results_available_locally(self, job: Any) -> Any:
         """Ensures that all results produced by Jobs that the present Job depends upon
@@ -226,30 +230,22 @@ class Job:
         return deepcopy(self._runtime_info)
 
     def _execute(self):
-        if self._container is not None:
-            job_serialized = self._serialize(generate_code=True)
-            success, result, runtime_info, error = _run_serialized_job_in_container(job_serialized)
-            self._runtime_info = runtime_info
-            if success:
-                self._result = result
-                self._status = JobStatus.FINISHED
-            else:
-                assert error is not None
-                assert error != 'None'
-                self._exception = Exception(error)
-                self._status = JobStatus.ERROR
+        # A job deserialized without its function (e.g., by a slurm worker) runs its generated code in a subprocess
+        if self._container is not None or (self._f is None and self._code is not None):
+            with _span('serialize job', job_id=self._job_id):
+                job_serialized = self._serialize(generate_code=True, encode_arrays=(CONTAINER_PAYLOAD_FORMAT == 'json'))
+            ret = _run_job_code(job_serialized)
         else:
             assert self._f is not None, 'Cannot execute job outside of container when function is not available'
-            try:
-                if not self._no_resolve_input_files:
-                    self.resolve_files_in_wrapped_arguments()
-                ret = self._f(**self._wrapped_function_arguments)
-                self._result = _copy_structure_with_changes(ret, File.kache_numpy_array, _as_side_effect=False)
-                # self._result = _deserialize_item(_serialize_item(ret))
-                self._status = JobStatus.FINISHED
-            except Exception as e:
-                self._status = JobStatus.ERROR
-                self._exception = e
+            # The job may run in a thread of a process that does other things, so only count this thread's cpu time
+            ret = _run_job_function(self._f, self._wrapped_function_arguments, job_id=self._job_id, function_name=self._function_name,
+                no_resolve_input_files=self._no_resolve_input_files, profile=self._profile, per_thread=True)
+        self._status = ret['status']
+        self._result = ret['result']
+        self._exception = ret['exception']
+        self._runtime_info = ret['runtime_info']
+        # so that the spans recorded here reach the process waiting for the job (see _tracing.py)
+        _attach_job_trace_events(self._job_id, self._runtime_info)
 
     def _efficiency_job_hash(self):
         # For purpose of efficiently handling the exact same job queued multiple times simultaneously
@@ -282,22 +278,16 @@ class Job:
 
     # TODO: is str the correct type for kachery parameter?
     def download_results_if_needed(self, kachery:Union[str, None] = None) -> None:
-        for f in _flatten_nested_collection(self._result, _type=File):
-            assert isinstance(f, File), "Filter failed."
-            f.ensure_local_availability(kachery)
+        _ensure_files_available_locally(self._result, kachery)
 
     def download_parameter_files_if_needed(self, kachery:Union[str, None] = None) -> None:
-        for a in _flatten_nested_collection(self._wrapped_function_arguments, _type=File):
-            assert isinstance(a, File), "Filter failed."
-            a.ensure_local_availability(kachery)
+        _ensure_files_available_locally(self._wrapped_function_arguments, kachery)
 
     def resolve_files_in_wrapped_arguments(self) -> None:
         """Handles file availability and unboxing of numpy arrays from Kachery files for
         items in the Job's wrapped function arguments.
         """
-        self._wrapped_function_arguments = \
-            _copy_structure_with_changes(self._wrapped_function_arguments,
-                lambda r: r.resolve(), _type = File, _as_side_effect = False)
+        self._wrapped_function_arguments = _resolve_files_in_item(self._wrapped_function_arguments)
 
     # TODO: Make this part of the .result() method? Would need to access info about
     # the "don't-resolve-results" parameter.
@@ -305,8 +295,7 @@ class Job:
         """Handles file availability and unboxing of numpy arrays from Kachery files for
         items in the Job's result.
         """
-        self._result = _copy_structure_with_changes(self._result,
-            lambda r: r.resolve(), _type = File, _as_side_effect = False)
+        self._result = _resolve_files_in_item(self._result)
 
     # TODO: What guarantee do we have that these are actually all complete? Should have a check for it
     def resolve_wrapped_job_values(self) -> None:
@@ -373,36 +362,57 @@ class Job:
         return True
 
     
-    def _serialize(self, generate_code:bool):
+    def _generate_code(self):
+        if self._code is not None:
+            return self._code
+        assert self._f is not None, 'Cannot serialize function with generate_code=True when function and code are both not available'
+        additional_files = getattr(self._f, '_hither_additional_files', [])
+        local_modules = getattr(self._f, '_hither_local_modules', [])
+        return _generate_source_code_for_function(self._f, name=self._function_name, additional_files=additional_files, local_modules=local_modules)
+    
+    def _code_fingerprint(self) -> Union[str, None]:
+        # Changes whenever the code generated for this job's function would change.
+        # None if the code was not generated from a local function.
+        if self._code is not None:
+            return self._given_code_fingerprint
+        if self._f is None:
+            return None
+        additional_files = getattr(self._f, '_hither_additional_files', [])
+        local_modules = getattr(self._f, '_hither_local_modules', [])
+        return _function_code_fingerprint(self._f, name=self._function_name, additional_files=additional_files, local_modules=local_modules)
+    
+    def _serialize(self, generate_code:bool, encode_arrays:bool=True, code=None):
+        # code may be provided (with generate_code=True) by callers that have already generated
+        # (or stored) the code for this job's function
         function_name = self._function_name
         function_version = self._function_version
         if generate_code:
-            if self._code is not None:
-                code = self._code
-            else:
-                assert self._f is not None, 'Cannot serialize function with generate_code=True when function and code are both not available'
-                additional_files = getattr(self._f, '_hither_additional_files', [])
-                local_modules = getattr(self._f, '_hither_local_modules', [])
-                code = _generate_source_code_for_function(self._f, name=function_name, additional_files=additional_files, local_modules=local_modules)
+            if code is None:
+                code = self._generate_code()
+            # so that the code need not be hashed to find it in the code cache (see _code_cache.py)
+            code_fingerprint = self._code_fingerprint()
             function = None
         else:
             assert self._f is not None, 'Cannot serialize function with generate_code=False when function is not available'
             code = None
+            code_fingerprint = None
             function = self._f
         x = dict(
             job_id=self._job_id,
             function=function,
             code=code,
+            code_fingerprint=code_fingerprint,
             function_name=function_name,
             function_version=function_version,
             label=self._label,
-            kwargs=_serialize_item(self._wrapped_function_arguments),
+            kwargs=_serialize_item(self._wrapped_function_arguments, encode_arrays=encode_arrays),
             container=self._container,
             download_results=self._download_results,
             job_timeout=self._job_timeout,
-            no_resolve_input_files=self._no_resolve_input_files
+            no_resolve_input_files=self._no_resolve_input_files,
+            profile=self._profile
         )
-        x = _serialize_item(x, require_jsonable=False)
+        x = _serialize_item(x, require_jsonable=False, encode_arrays=encode_arrays)
         return x
     
     @staticmethod
@@ -422,5 +432,7 @@ class Job:
             job_handler=None,
             job_cache=None,
             job_id=j['job_id'],
-            no_resolve_input_files=j['no_resolve_input_files']
+            no_resolve_input_files=j['no_resolve_input_files'],
+            profile=j.get('profile', False),
+            code_fingerprint=j.get('code_fingerprint', None)
         )
@@ -5,6 +5,7 @@ from .database import Database
 from ._util import _deserialize_item, _flatten_nested_collection
 from ._enums import JobStatus
 from .file import File
+from ._file_availability import _files_are_available_locally
 
 # TODO: provide wrapper for calls to Database
 # TODO: Handle checking for locality of files (may need to pull out that function from Job.py)
@@ -18,6 +19,9 @@ class JobCache:
     def check_job(self, job) -> bool:
         if self._force_run:
             return False
+        if job._profile:
+            # the cached result would come without a profile (see load_profiles)
+            return False
         hash0 = self._compute_job_hash(job)
         query = dict(
             hash=hash0
@@ -26,10 +30,12 @@ class JobCache:
         doc = db.find_one(query)
         if doc is None:
             return False
-        if 'status' not in doc or doc['status'] not in JobStatus.complete_statuses():
+        # the status is stored as its value (see cache_job_result)
+        status = JobStatus(doc['status']) if 'status' in doc else None
+        if status not in JobStatus.complete_statuses():
             return False
 
-        if doc['status'] == JobStatus.FINISHED:
+        if status == JobStatus.FINISHED:
             result0 = _deserialize_item(doc['result'])
             if not _check_file_results_exist_locally(result0):
                 print(f'Found result in cache, but files do not exist locally: {job._label}')
@@ -38,14 +44,14 @@ class JobCache:
             job._result = result0 # TODO: Can combine this with below? See what happens if not set?
             job._exception = None
             print(f'Using cached result for job: {job._label} ({job._function_name} {job._function_version})')
-        elif doc['status'] == JobStatus.ERROR:
+        elif status == JobStatus.ERROR:
             if self._cache_failing and (not self._rerun_failing):
                 job._result = None
                 job._exception = Exception(doc['exception']) # TODO: Can combine with above? What if unset?
                 print(f'Using cached error for job: {job._label} ({job._function_name} {job._function_version})')
             else:
                 return False
-        job._status = doc['status']
+        job._status = status
         job._runtime_info = doc['runtime_info']
         return True
 
@@ -85,7 +91,4 @@ class JobCache:
 
 def _check_file_results_exist_locally(x):
     files = _flatten_nested_collection(x, _type=File)
-    for f in files:
-        local_path = ka.get_file_info(f._sha1_path, fr=None)
-        if local_path is None: return False
-    return True
\ No newline at end of file
+    return _files_are_available_locally(files)
\ No newline at end of file
@@ -4,10 +4,9 @@ import multiprocessing
 from multiprocessing.connection import Connection
 import time
 
-import hither2 as hi
-
 from ._basejobhandler import BaseJobHandler
 from ._enums import JobStatus
+from .runtime import execute_serialized_job
 
 class ParallelJobHandler(BaseJobHandler):
     def __init__(self, num_workers):
@@ -72,14 +71,7 @@ class ParallelJobHandler(BaseJobHandler):
 def _pjh_run_job(pipe_to_parent: Connection, serialized_job: Any, kachery_config: dict) -> None:
     import kachery as ka
     ka.set_config(**kachery_config)
-    job = hi._deserialize_job(serialized_job)
-    job._execute()
-    ret = dict(
-        result=job._result,
-        status=job._status,
-        exception=job._exception,
-        runtime_info=job._runtime_info
-    )
+    ret = execute_serialized_job(serialized_job)
     pipe_to_parent.send(ret)
     # wait for message to return
     while True:
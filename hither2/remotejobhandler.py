@@ -1,17 +1,24 @@
 from types import SimpleNamespace
 import time
-from typing import Dict
+from typing import Dict, List, Union
 import kachery as ka
 #from hither2 import _deserialize_item
 from ._basejobhandler import BaseJobHandler
 from .database import Database
 from ._enums import JobStatus
 from .file import File
+from ._file_transfer import _for_each_file
 from ._load_config import _load_preset_config_from_github
+from ._payload import _check_payload_format, _encode_payload, _decode_document_payload
+from ._payload import _compress_document_field, _decompress_document_field, _compression_codecs
+from ._tracing import _span, _record_span, _add_trace_events, _trace_events_end, tracing_enabled
 from ._util import _random_string, _utctime, _deserialize_item, _flatten_nested_collection
 
+# Number of seconds between heartbeats written to active_job_handlers
+HEARTBEAT_INTERVAL = 3
+
 class RemoteJobHandler(BaseJobHandler):
-    def __init__(self, *, database: Database, compute_resource_id):
+    def __init__(self, *, database: Database, compute_resource_id, payload_format='json', compress_payloads=False):
         self.is_remote = True
         
         self._database = database
@@ -22,6 +29,11 @@ class RemoteJobHandler(BaseJobHandler):
 
         self._timestamp_database_poll = 0
         self._timestamp_last_action = time.time()
+        self._timestamp_report_active = 0
+        # kachery sha1 paths of the code already stored for a function, by code fingerprint (see Job._code_fingerprint)
+        self._code_sha1_paths: Dict[str, str] = dict()
+        # job documents waiting to be inserted in one batch on the next iteration
+        self._pending_job_docs = []
 
         self._internal_counts = SimpleNamespace(
             num_jobs=0,
@@ -44,6 +56,30 @@ class RemoteJobHandler(BaseJobHandler):
         if doc is None:
             raise Exception(f'No active compute resource found: {compute_resource_id}')
         self._kachery = doc['kachery']
+
+        # Wakes up iterate() as soon as the compute resource modifies one of our jobs
+        self._notifier = self._database.watch('hither2_jobs', dict(
+            handler_id=self._handler_id,
+            last_modified_by_compute_resource=True
+        ))
+
+        # Use the requested payload format only if the compute resource supports it
+        _check_payload_format(payload_format)
+        supported_payload_formats = doc.get('payload_formats', ['json'])
+        if payload_format not in supported_payload_formats:
+            print(f'Warning: compute resource {compute_resource_id} does not support payload format {payload_format}. Using json.')
+            payload_format = 'json'
+        self._payload_format = payload_format
+        # Whether kwargs, results and runtime info in the job documents are compressed
+        # (and spilled to kachery when large), with a codec that the compute resource supports
+        self._compression_codecs: Union[List[str], None] = None
+        if compress_payloads:
+            supported_codecs = doc.get('compression_codecs', None)
+            if supported_codecs is None:
+                print(f'Warning: compute resource {compute_resource_id} does not support compressed payloads. Not compressing.')
+            else:
+                self._compression_codecs = [c for c in _compression_codecs() if c in supported_codecs]
+        self._compress_payloads = self._compression_codecs is not None
     
     @staticmethod
     def preset(name):
@@ -54,21 +90,31 @@ class RemoteJobHandler(BaseJobHandler):
     def handle_job(self, job):
         super(RemoteJobHandler, self).handle_job(job)
         self._internal_counts.num_jobs += 1
-        self._report_active()
 
-        for f in _flatten_nested_collection(job._wrapped_function_arguments, _type=File):
-            self._send_file_as_needed(f)
+        files = _flatten_nested_collection(job._wrapped_function_arguments, _type=File)
+        with _span('upload input files', job_id=job._job_id, num_files=len(files)):
+            _for_each_file(files, self._send_file_as_needed, kachery=self._kachery, label='Uploading')
 
-        job_serialized = job._serialize(generate_code=True)
-        # send the code to the kachery
-        job_serialized['code'] = ka.store_object(job_serialized['code'], to=self._kachery)
+        with _span('store code', job_id=job._job_id):
+            code = self._store_code_as_needed(job)
+        with _span('serialize job', job_id=job._job_id):
+            job_serialized = job._serialize(generate_code=True, code=code, encode_arrays=(self._payload_format == 'json'))
+            if self._payload_format != 'json':
+                job_serialized = _encode_payload(job_serialized, self._payload_format)
+                if self._compress_payloads:
+                    job_serialized = _compress_document_field(job_serialized, kachery=self._kachery, codecs=self._compression_codecs)
+            elif self._compress_payloads:
+                job_serialized['kwargs'] = _compress_document_field(job_serialized['kwargs'], kachery=self._kachery, codecs=self._compression_codecs)
 
-        db = self._get_db()
         doc = dict(
             compute_resource_id=self._compute_resource_id,
             handler_id=self._handler_id,
             job_id=job._job_id,
             job_serialized=job_serialized,
+            payload_format=self._payload_format,
+            compress_payloads=self._compress_payloads,
+            # for the results and runtime info
+            compression_codecs=_compression_codecs(),
             status=JobStatus.QUEUED.value,
             compute_resource_status=JobStatus.PENDING.value,
             runtime_info=None,
@@ -76,7 +122,8 @@ class RemoteJobHandler(BaseJobHandler):
             last_modified_by_compute_resource=False,
             client_code=None
         )
-        db.insert_one(doc)
+        # inserted by _insert_pending_job_docs() on the next iteration
+        self._pending_job_docs.append(doc)
         self._jobs[job._job_id] = job
 
         self._report_action()
@@ -85,10 +132,13 @@ class RemoteJobHandler(BaseJobHandler):
         print('Warning: not yet able to cancel job of remotejobhandler')
     
     def iterate(self):
+        if len(self._pending_job_docs) > 0 or time.time() - self._timestamp_report_active > HEARTBEAT_INTERVAL:
+            # report before inserting jobs so that the compute resource sees this handler as active
+            self._report_active()
+        self._insert_pending_job_docs()
         elapsed_database_poll = time.time() - self._timestamp_database_poll
-        if elapsed_database_poll > self._poll_interval():
+        if self._notifier.poll_due(elapsed_database_poll, self._poll_interval()):
             self._timestamp_database_poll = time.time()
-            self._report_active()
 
             self._iterate_timer = time.time()
             db = self._get_db()
@@ -104,7 +154,8 @@ class RemoteJobHandler(BaseJobHandler):
                     client_code=client_code
                 )
             }
-            db.update_many(query, update=update)
+            if db.update_many(query, update=update).modified_count == 0:
+                return
             for doc in db.find(dict(client_code=client_code)):
                 self._report_action()
                 job_id = doc['job_id']
@@ -118,22 +169,78 @@ class RemoteJobHandler(BaseJobHandler):
                     elif compute_resource_status == JobStatus.FINISHED:
                         print(f'Job finished: {job_id}')
                         self._internal_counts.num_finished_jobs += 1
-                        j._runtime_info = doc['runtime_info']
+                        j._runtime_info = _decompress_document_field(doc['runtime_info'], kachery=self._kachery)
+                        self._record_polling_lag(job_id, j._runtime_info)
                         j._status = JobStatus.FINISHED
-                        j._result = _deserialize_item(doc['result'])
+                        result = _decompress_document_field(doc['result'], kachery=self._kachery)
+                        j._result = _deserialize_item(_decode_document_payload(result))
                         for f in _flatten_nested_collection(j._result, _type=File):
                             setattr(f, '_remote_job_handler', self)
                         del self._jobs[job_id]
                     elif compute_resource_status == JobStatus.ERROR:
                         print(f'Job error: {job_id}')
                         self._internal_counts.num_errored_jobs += 1
-                        j._runtime_info = doc['runtime_info']
+                        j._runtime_info = _decompress_document_field(doc['runtime_info'], kachery=self._kachery)
+                        self._record_polling_lag(job_id, j._runtime_info)
                         j._status = JobStatus.ERROR
                         j._exception = Exception(doc['exception'])
                         del self._jobs[job_id]
                     else:
                         raise Exception(f'Unexpected compute resource status: {compute_resource_status}')
     
+    def _record_polling_lag(self, job_id, runtime_info):
+        # From the last span recorded by the compute resource to when we found out that the job completed
+        if runtime_info is None or not tracing_enabled():
+            return
+        events = runtime_info.get('trace_events', None)
+        end = _trace_events_end(events)
+        if end is not None:
+            _add_trace_events(events)
+            _record_span('database polling lag', end, time.time(), job_id=job_id)
+
+    def _insert_pending_job_docs(self):
+        if len(self._pending_job_docs) == 0:
+            return
+        from pymongo.errors import BulkWriteError
+        docs = self._pending_job_docs
+        self._pending_job_docs = []
+        errors = dict()
+        try:
+            self._get_db().insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get('writeErrors', []):
+                # a duplicate _id means that the document was inserted by an earlier attempt
+                # (insert_many sets the _id of the documents)
+                if err.get('code', None) != 11000:
+                    errors[err['index']] = err.get('errmsg', 'unknown error')
+        except Exception as e:
+            # nothing was confirmed as inserted; try again on the next iteration
+            print(f'Warning: problem inserting jobs in database (will retry): {e}')
+            self._pending_job_docs = docs + self._pending_job_docs
+            return
+        for index, doc in enumerate(docs):
+            if index not in errors:
+                self._database.notify('hither2_jobs', doc)
+                continue
+            # for example, the document is too large
+            job_id = doc['job_id']
+            print(f'Unable to insert job in database: {job_id}: {errors[index]}')
+            j = self._jobs.pop(job_id, None)
+            if j is not None:
+                self._internal_counts.num_errored_jobs += 1
+                j._status = JobStatus.ERROR
+                j._exception = Exception(f'Unable to insert job in database: {errors[index]}')
+
+    def _store_code_as_needed(self, job) -> str:
+        # Send the code of the job's function to the kachery, only once per version of the code
+        fingerprint = job._code_fingerprint()
+        if fingerprint is not None and fingerprint in self._code_sha1_paths:
+            return self._code_sha1_paths[fingerprint]
+        sha1_path = ka.store_object(job._generate_code(), to=self._kachery)
+        if fingerprint is not None:
+            self._code_sha1_paths[fingerprint] = sha1_path
+        return sha1_path
+
     def _load_file(self, sha1_path):
         return ka.load_file(sha1_path, fr=self._kachery)
 
@@ -154,6 +261,7 @@ class RemoteJobHandler(BaseJobHandler):
         raise Exception('This case not yet supported (we need to transfer data from one compute resource to another)')
         
     def _report_active(self):
+        self._timestamp_report_active = time.time()
         db = self._get_db(collection='active_job_handlers')
         filter = dict(
             handler_id=self._handler_id
@@ -181,7 +289,7 @@ class RemoteJobHandler(BaseJobHandler):
             return 6
 
     def cleanup(self):
-        pass
+        self._notifier.close()
 
     def _get_db(self, collection='hither2_jobs'):
         return self._database.collection(collection)
@@ -0,0 +1,98 @@
+from typing import Any, Callable, Dict, Union
+
+# Also imported from here by the worker scripts (see the runner in _run_serialized_job_in_container.py
+# and the srun script in slurmjobhandler.py)
+from ._consolecapture import ConsoleCapture
+from ._enums import JobStatus
+from ._file_transfer import _resolve_files_in_item
+from ._filelock import FileLock
+from ._payload import _encode_payload, _decode_payload
+from ._profiling import _Profile
+from ._resource_usage import _ResourceMonitor
+from ._tracing import enable_tracing, _span, _set_trace_process_name, _job_trace_events, _attach_job_trace_events
+from ._util import _serialize_item, _deserialize_item, _copy_structure_with_changes
+from .file import File
+
+# The part of hither2 needed to execute serialized jobs, for the worker processes: the workers of
+# the parallel and slurm job handlers and the runner of containerized jobs. It does not depend on the
+# job manager, the config, the job handlers or the database, and together with the decorators it can
+# be shipped with the code of the functions instead of the whole package (see RUNTIME_MODULES).
+
+# The modules of hither2 that are shipped with the code of the functions when HITHER_RUNTIME_ONLY_CODE=TRUE
+# (see _generate_source_code_for_function.py). The relative imports of these modules must stay within this
+# list (see tests/test_code_generation.py), except for the import of core by the run() of the decorated
+# functions, since a function that runs hither2 jobs itself needs the whole package.
+RUNTIME_MODULES = [
+    '__init__.py', 'runtime.py', '_decorators.py',
+    '_consolecapture.py', '_consolelog.py', '_enums.py', '_file_transfer.py', '_filelock.py', '_payload.py',
+    '_profiling.py', '_resource_usage.py', '_temporarydirectory.py', '_tracing.py', '_util.py', 'file.py',
+    # for jobs run in a container (or from their code) by execute_serialized_job
+    '_run_serialized_job_in_container.py', '_code_cache.py', '_containerpool.py', '_containerregistry.py',
+    '_shellscript.py', '_preventkeyboardinterrupt.py'
+]
+
+def execute_serialized_job(job_serialized: Dict[str, Any]) -> Dict[str, Any]:
+    """Execute a job that was serialized by the job handler (see Job._serialize)
+
+    Parameters
+    ----------
+    job_serialized : Dict[str, Any]
+        The serialized job, with either the function (generate_code=False) or its code
+
+    Returns
+    -------
+    Dict[str, Any]
+        dict(status=<JobStatus>, result=<result>, exception=<Exception or None>, runtime_info=<runtime info>)
+    """
+    if job_serialized['container'] is not None or job_serialized['function'] is None:
+        # the kwargs may hold arrays that were left in place for a binary payload (see _payload.py)
+        from ._run_serialized_job_in_container import CONTAINER_PAYLOAD_FORMAT
+        job_serialized = dict(job_serialized, kwargs=_serialize_item(job_serialized['kwargs'], encode_arrays=(CONTAINER_PAYLOAD_FORMAT == 'json')))
+        ret = _run_job_code(job_serialized)
+    else:
+        # A worker runs one job at a time, so the cpu time of the whole process is counted
+        ret = _run_job_function(
+            job_serialized['function'],
+            _deserialize_item(job_serialized['kwargs']),
+            job_id=job_serialized['job_id'],
+            function_name=job_serialized['function_name'],
+            no_resolve_input_files=job_serialized['no_resolve_input_files'],
+            profile=job_serialized.get('profile', False)
+        )
+    # so that the spans recorded here reach the process waiting for the job (see _tracing.py)
+    _attach_job_trace_events(job_serialized['job_id'], ret['runtime_info'], forget=True)
+    return ret
+
+def _run_job_code(job_serialized: Dict[str, Any]) -> Dict[str, Any]:
+    # Runs the code of the function in a subprocess (in its container, if any)
+    from ._run_serialized_job_in_container import _run_serialized_job_in_container, CONTAINER_PAYLOAD_FORMAT
+    success, result, runtime_info, error = _run_serialized_job_in_container(job_serialized, payload_format=CONTAINER_PAYLOAD_FORMAT)
+    if success:
+        return dict(status=JobStatus.FINISHED, result=result, exception=None, runtime_info=runtime_info)
+    assert error is not None
+    assert error != 'None'
+    return dict(status=JobStatus.ERROR, result=None, exception=Exception(error), runtime_info=runtime_info)
+
+def _run_job_function(f: Callable, kwargs: Dict[str, Any], *, job_id: Union[str, None], function_name: str,
+        no_resolve_input_files: bool, profile: bool, per_thread: bool=False) -> Dict[str, Any]:
+    # Runs the function in this process
+    result = None
+    exception = None
+    profiler = _Profile(profile)
+    with _ResourceMonitor(per_thread=per_thread) as rm:
+        try:
+            if not no_resolve_input_files:
+                with _span('resolve input files', job_id=job_id):
+                    kwargs = _resolve_files_in_item(kwargs)
+            with _span('run function', job_id=job_id, function_name=function_name):
+                with profiler:
+                    ret = f(**kwargs)
+            result = _copy_structure_with_changes(ret, File.kache_numpy_array, _as_side_effect=False)
+            status = JobStatus.FINISHED
+        except Exception as e:
+            status = JobStatus.ERROR
+            exception = e
+    runtime_info = rm.runtime_info()
+    if profile:
+        runtime_info['profile'] = profiler.store(function_name)
+    return dict(status=status, result=result, exception=exception, runtime_info=runtime_info)
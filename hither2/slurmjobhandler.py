@@ -13,6 +13,8 @@ from ._enums import JobStatus
 from typing import Optional, List, Union
 import json
 from .core import Job, _deserialize_item
+from ._payload import _encode_payload, _decode_payload, _check_payload_format, _payload_file_extension
+from ._resource_usage import _summarize_resource_usage, _suggest_num_cores
 from os import rename
 
 DEFAULT_JOB_TIMEOUT = 1200
@@ -26,7 +28,8 @@ class SlurmJobHandler(BaseJobHandler):
         use_slurm: bool=True,
         time_limit_per_batch: Optional[float]=None,  # number of seconds or None
         max_simultaneous_batches: Optional[int]=None,
-        additional_srun_opts: List[str]=[]
+        additional_srun_opts: List[str]=[],
+        payload_format: str='json'
     ):
         """Constructor for slurm job handler
 
@@ -37,14 +40,18 @@ class SlurmJobHandler(BaseJobHandler):
         num_workers_per_batch : int
             Number of worker tasks to spawn for each batch
         num_cores_per_job : int
-            Number of cpu cores to allocate for each worker task
+            Number of cpu cores to allocate for each worker task (see suggest_num_cores_per_job)
         use_slurm : bool
             Whether to use slurm (if False, will use local computer without slurm)
         time_limit_per_batch : Optional[float], optional
             If a number, the maximum duration of a batch in seconds, by default None
         additional_srun_opts : List[str], optional
             A list of additional string options to send to srun (only applies of use_slurm is True), by default []
+        payload_format : str, optional
+            How jobs and results are encoded for the workers: 'json', or 'pickle5' for a binary
+            format that transfers numpy arrays without base64 encoding, by default 'json'
         """
+        _check_payload_format(payload_format)
         if not os.path.exists(working_dir):
             os.mkdir(working_dir)
         handler_dir = os.path.join(working_dir, 'tmp_slurm_job_handler_' + _random_string(8))
@@ -55,11 +62,15 @@ class SlurmJobHandler(BaseJobHandler):
         self._time_limit_per_batch = time_limit_per_batch
         self._max_simultaneous_batches = max_simultaneous_batches
         self._additional_srun_opts = additional_srun_opts
+        self._payload_format = payload_format
         self._batches: dict = dict()
         self._halted: bool = False
         self._last_batch_id: int = 0
         self._handler_dir: str = handler_dir
         self._unassigned_jobs: List[Job] = []
+        # For the resource usage summary of the completed jobs
+        self._jobs_to_account: List[Job] = []
+        self._resource_usages: List[dict] = []
 
     def handle_job(self, job: Job):
         """Queue a job to run in a batch. This is called from the framework (e.g., the job manager)
@@ -77,6 +88,7 @@ class SlurmJobHandler(BaseJobHandler):
             if job_timeout > self._time_limit_per_batch:
                 raise Exception('Cannot execute job. Job timeout exceeds time limit for batch type: {} > {}'.format(job_timeout, self._time_limit_per_batch))                
         self._unassigned_jobs.append(job)
+        self._jobs_to_account.append(job)
 
     def iterate(self) -> None:
         """Called by the framework to take care of business.
@@ -102,6 +114,37 @@ class SlurmJobHandler(BaseJobHandler):
                 unassigned_jobs_after.append(job)
         self._unassigned_jobs = unassigned_jobs_after
 
+        # Record the resource usage of the completed jobs
+        jobs_to_account_after = []
+        for job in self._jobs_to_account:
+            if job._status in JobStatus.complete_statuses():
+                if job._runtime_info is not None and job._runtime_info.get('resource_usage', None) is not None:
+                    self._resource_usages.append(job._runtime_info['resource_usage'])
+            else:
+                jobs_to_account_after.append(job)
+        self._jobs_to_account = jobs_to_account_after
+
+    def resource_usage_summary(self) -> dict:
+        """Summary of the resources used by the jobs completed so far
+
+        Returns
+        -------
+        dict
+            num_jobs, the mean, 90th percentile and max of the number of cores used (cpu time / elapsed time),
+            the max peak RSS (peak_rss_bytes_max), and the total bytes read and written
+        """
+        return _summarize_resource_usage(self._resource_usages)
+
+    def suggest_num_cores_per_job(self) -> Optional[int]:
+        """A value for num_cores_per_job based on the number of cores actually used by the jobs completed so far
+
+        Returns
+        -------
+        Optional[int]
+            The number of cores used by 90% of the jobs, or None if no job has completed
+        """
+        return _suggest_num_cores(self._resource_usages)
+
     def isFinished(self) -> bool:
         """Whether all queued jobs have finished
 
@@ -182,7 +225,8 @@ class SlurmJobHandler(BaseJobHandler):
             num_cores_per_job=self._num_cores_per_job,
             use_slurm=self._use_slurm,
             time_limit=self._time_limit_per_batch,
-            additional_srun_opts=self._additional_srun_opts
+            additional_srun_opts=self._additional_srun_opts,
+            payload_format=self._payload_format
         )
         self._batches[batch_id] = new_batch
         new_batch.start()
@@ -198,7 +242,8 @@ class _Batch():
         num_cores_per_job: int,
         use_slurm: bool,
         time_limit: Union[float, None],
-        additional_srun_opts: List[str]
+        additional_srun_opts: List[str],
+        payload_format: str
     ):
         """Constructor for _Batch class internal to SlurmJobHandler
 
@@ -225,7 +270,7 @@ class _Batch():
 
         # Create the workers
         for i in range(self._num_workers):
-            self._workers.append(_Worker(base_path=self._working_dir + '/worker_{}'.format(i)))
+            self._workers.append(_Worker(base_path=self._working_dir + '/worker_{}'.format(i), payload_format=payload_format))
 
         self._slurm_process = _SlurmProcess(
             working_dir=self._working_dir,
@@ -233,7 +278,8 @@ class _Batch():
             num_cores_per_job=self._num_cores_per_job,
             additional_srun_opts=self._additional_srun_opts,
             use_slurm=self._use_slurm,
-            time_limit=self._time_limit
+            time_limit=self._time_limit,
+            payload_format=payload_format
         )
 
     def isPending(self) -> bool:
@@ -428,7 +474,7 @@ class _Batch():
 
 
 class _Worker():
-    def __init__(self, base_path: str):
+    def __init__(self, base_path: str, payload_format: str='json'):
         """Constructor for _Worker of _Batch of SlurmJobHandler
 
         Parameters
@@ -436,14 +482,18 @@ class _Worker():
         base_path : str
             The base path of file names that this worker deals with
             [base_path]_claimed.txt
-            [base_path]_job.json
-            [base_path]_result.json
-            and corresponding lock files
+            [base_path]_job.[ext]
+            [base_path]_result.[ext]
+            and corresponding lock files, where ext is json or bin depending on the payload format
+        payload_format : str
+            The payload format used for the job and result files
         """
         self._job: Optional[Job] = None
         self._job_finish_timestamp: Optional[float] = None
         self._base_path: str = base_path
         self._has_started: bool = False
+        self._payload_format = payload_format
+        self._payload_ext = _payload_file_extension(payload_format)
 
     def hasJob(self) -> bool:
         """Whether this worker has a job
@@ -484,14 +534,15 @@ class _Worker():
         None
         """
         self._job = job
-        job_serialized = self._job._serialize(generate_code=True)
-        job_fname = self._base_path + '_job.json'
+        job_serialized = self._job._serialize(generate_code=True, encode_arrays=(self._payload_format == 'json'))
+        job_payload = _encode_payload(job_serialized, self._payload_format)
+        job_fname = self._base_path + '_job.' + self._payload_ext
         num_tries = 3
         for try_count in range(1, num_tries + 1):
             try:
                 with FileLock(job_fname + '.lock', exclusive=True):
-                    with open(job_fname, 'w') as f:
-                        json.dump(job_serialized, f)
+                    with open(job_fname, 'wb') as f:
+                        f.write(job_payload)
                 break
             except:
                 if try_count < num_tries:
@@ -517,15 +568,15 @@ class _Worker():
         if not self._job:
             # If we don't have a job, then we don't need to take care of any business.
             return
-        job_fname = self._base_path + '_job.json'
-        result_fname = self._base_path + '_result.json'
+        job_fname = self._base_path + '_job.' + self._payload_ext
+        result_fname = self._base_path + '_result.' + self._payload_ext
         result_serialized: Optional[dict] = None
         with FileLock(result_fname + '.lock', exclusive=False):
             if os.path.exists(result_fname):
                 # The result file exists. So the active job must have completed.
-                with open(result_fname, 'r') as f:
+                with open(result_fname, 'rb') as f:
                     # Here's the result object that we will deal with below
-                    result_serialized = json.load(f)
+                    result_serialized = _decode_payload(f.read())
 
                 # Let's remove the _job.json.complete file if it exists
                 if os.path.exists(job_fname + '.complete'):
@@ -553,7 +604,7 @@ class _Worker():
 
         if result_serialized:
             # Here's the result that we read above
-            self._job._status = result_serialized['status']
+            self._job._status = JobStatus(result_serialized['status'])
             self._job._result = _deserialize_item(result_serialized['result'])
             if result_serialized['exception'] is not None:
                 self._job._exception = Exception(result_serialized['exception'])
@@ -565,7 +616,7 @@ class _Worker():
             self._job_finish_timestamp = time.time()
 
 class _SlurmProcess():
-    def __init__(self, working_dir: str, num_workers: int, additional_srun_opts: List[str], use_slurm: bool, time_limit: Optional[float], num_cores_per_job: int):
+    def __init__(self, working_dir: str, num_workers: int, additional_srun_opts: List[str], use_slurm: bool, time_limit: Optional[float], num_cores_per_job: int, payload_format: str='json'):
         """Constructor for a slurm process (corresponding to a batch)
 
         Parameters
@@ -582,6 +633,8 @@ class _SlurmProcess():
             The time limit in seconds for this slurm batch
         num_cores_per_job : int
             Number of cpu cores devoted to each job / worker
+        payload_format : str
+            The payload format used for the job and result files
         """
         self._working_dir = working_dir
         self._num_workers = num_workers
@@ -591,6 +644,7 @@ class _SlurmProcess():
         if self._num_cores_per_job is None:
             self._num_cores_per_job = 1
         self._time_limit = time_limit
+        self._payload_format = payload_format
 
     def start(self) -> None:
         """Start the slurm process
@@ -609,12 +663,15 @@ class _SlurmProcess():
                 import random
                 import traceback
                 import kachery as ka
-                from hither2 import FileLock
-                from hither2 import _deserialize_job, _serialize_item
+                from hither2.runtime import FileLock
+                from hither2.runtime import execute_serialized_job, _serialize_item
+                from hither2.runtime import _encode_payload, _decode_payload
 
                 working_dir = '{self._working_dir}'
                 num_workers = {self._num_workers}
                 running_fname = '{running_fname}'
+                payload_format = '{self._payload_format}'
+                payload_ext = '{_payload_file_extension(self._payload_format)}'
 
                 kachery_config = json.loads('{kachery_config_json}')
                 try:
@@ -644,8 +701,8 @@ class _SlurmProcess():
                 if worker_num is None:
                     raise Exception('Unable to claim worker file.')
 
-                job_fname = working_dir + '/worker_{{}}_job.json'.format(worker_num)
-                result_fname = working_dir + '/worker_{{}}_result.json'.format(worker_num)
+                job_fname = working_dir + '/worker_{{}}_job.{{}}'.format(worker_num, payload_ext)
+                result_fname = working_dir + '/worker_{{}}_result.{{}}'.format(worker_num, payload_ext)
 
                 def _serialize_exception(e):
                     if e is None:
@@ -679,8 +736,8 @@ class _SlurmProcess():
                             with FileLock(job_fname + '.lock', exclusive=False):
                                 if (os.path.exists(job_fname)) and not (os.path.exists(result_fname)):
                                     num_found = num_found + 1
-                                    with open(job_fname, 'r') as f:
-                                        job_serialized = json.load(f)
+                                    with open(job_fname, 'rb') as f:
+                                        job_serialized = _decode_payload(f.read())
                         except:
                             traceback.print_exc()
                             print('WARNING: Unexpected problem loading job object file in worker. Trying to continue.')
@@ -691,19 +748,18 @@ class _SlurmProcess():
                         
                         # If we have a job to do, then let's do it
                         if job_serialized:
-                            job = _deserialize_job(job_serialized)
-                            job._execute()
+                            ret = execute_serialized_job(job_serialized)
                             result = dict(
-                                result=job._result,
-                                status=job._status,
-                                exception=_serialize_exception(job._exception),
-                                runtime_info=job._runtime_info
+                                result=ret['result'],
+                                status=ret['status'].value,
+                                exception=_serialize_exception(ret['exception']),
+                                runtime_info=ret['runtime_info']
                             )
-                            result_serialized = _serialize_item(result)
+                            result_serialized = _serialize_item(result, encode_arrays=(payload_format == 'json'))
                             with FileLock(result_fname + '.lock', exclusive=True):
-                                with open(result_fname + '.tmp', 'w') as f:
+                                with open(result_fname + '.tmp', 'wb') as f:
                                     # Write the result
-                                    json.dump(result_serialized, f)
+                                    f.write(_encode_payload(result_serialized, payload_format))
                                 os.rename(result_fname + '.tmp', result_fname)
                         time.sleep(0.2)
                 except:
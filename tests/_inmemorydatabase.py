@@ -0,0 +1,32 @@
+import hither2 as hi
+
+# An in-memory stand-in for the Mongo database, shared by the tests and the benchmarks
+
+class _InMemoryCollection:
+    # Just enough of a pymongo collection for the JobCache (equality queries and $set updates)
+    def __init__(self):
+        self._docs = []
+
+    def find_one(self, query):
+        for doc in self._docs:
+            if all([doc.get(k, None) == v for k, v in query.items()]):
+                return dict(doc)
+        return None
+
+    def update_one(self, query, update, upsert=False):
+        for doc in self._docs:
+            if all([doc.get(k, None) == v for k, v in query.items()]):
+                doc.update(update['$set'])
+                return
+        if upsert:
+            self._docs.append(dict(query, **update['$set']))
+
+class _InMemoryDatabase(hi.Database):
+    def __init__(self, database: str='hither2_tests'):
+        super().__init__(mongo_url=None, database=database)
+        self._collections = dict()
+
+    def collection(self, collection_name):
+        if collection_name not in self._collections:
+            self._collections[collection_name] = _InMemoryCollection()
+        return self._collections[collection_name]
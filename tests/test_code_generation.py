@@ -0,0 +1,120 @@
+import importlib.util
+import os
+from hither2._generate_source_code_for_function import _function_code_fingerprint
+
+def test_code_fingerprint_tracks_source_changes(tmp_path):
+    fname = os.path.join(str(tmp_path), 'myfunc.py')
+    with open(fname, 'w') as f:
+        f.write('def myfunc():\n    return 1\n')
+    spec = importlib.util.spec_from_file_location('myfunc', fname)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    def fingerprint():
+        return _function_code_fingerprint(module.myfunc, name='myfunc', additional_files=[], local_modules=[])
+
+    fp1 = fingerprint()
+    assert fingerprint() == fp1
+    # files that are not shipped with the code do not matter
+    with open(os.path.join(str(tmp_path), 'notes.txt'), 'w') as f:
+        f.write('notes')
+    assert fingerprint() == fp1
+    with open(fname, 'a') as f:
+        f.write('\n# modified\n')
+    assert fingerprint() != fp1
+
+def test_generated_code_is_memoized(tmp_path, monkeypatch):
+    import hither2._generate_source_code_for_function as gen
+    fname = os.path.join(str(tmp_path), 'myfunc2.py')
+    with open(fname, 'w') as f:
+        f.write('def myfunc2():\n    return 1\n')
+    spec = importlib.util.spec_from_file_location('myfunc2', fname)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    def generate():
+        return gen._generate_source_code_for_function(module.myfunc2, name='myfunc2', additional_files=[], local_modules=[])
+
+    code1 = generate()
+    opened = []
+    def counting_open(path, *args, **kwargs):
+        opened.append(path)
+        return open(path, *args, **kwargs)
+    monkeypatch.setattr(gen, 'open', counting_open, raising=False)
+    assert generate() == code1
+    assert opened == []
+
+    with open(fname, 'a') as f:
+        f.write('\n# modified\n')
+    code2 = generate()
+    assert opened == [tmp_path.as_posix() + '/myfunc2.py']
+    assert [x['content'] for x in code2['files'] if x['name'] == 'myfunc2.py'][0].endswith('# modified\n')
+
+def test_materialized_code_is_shared(tmp_path, monkeypatch):
+    from hither2._code_cache import _materialize_code
+    monkeypatch.setenv('KACHERY_STORAGE_DIR', str(tmp_path))
+    code = dict(files=[dict(name='a.py', content='x = 1\n')], dirs=[dict(name='b', content=dict(files=[dict(name='c.py', content='')], dirs=[]))])
+    path = _materialize_code(code)
+    assert _materialize_code(code) == path
+    with open(os.path.join(path, 'function_src', 'a.py')) as f:
+        assert f.read() == 'x = 1\n'
+    assert os.path.exists(os.path.join(path, 'function_src', 'b', 'c.py'))
+    assert not os.access(os.path.join(path, 'function_src', 'a.py'), os.W_OK) or os.geteuid() == 0
+    code['files'][0]['content'] = 'x = 2\n'
+    assert _materialize_code(code) != path
+
+def test_shipped_code_runs_with_only_the_runtime(tmp_path, monkeypatch):
+    # only the runtime part of hither2 is shipped with the code of the function (see runtime.py)
+    import subprocess
+    import sys
+    import hither2._generate_source_code_for_function as gen
+    from hither2._code_cache import _materialize_code
+    from hither2._generate_source_code_for_function import _generate_source_code_for_function
+    from .functions import functions as fun
+    monkeypatch.setattr(gen, 'RUNTIME_ONLY_CODE', True)
+    monkeypatch.setenv('KACHERY_STORAGE_DIR', str(tmp_path))
+    code = _generate_source_code_for_function(fun.add, name='add', additional_files=[], local_modules=[])
+    path = _materialize_code(code)
+    hither2_dir = os.path.join(path, 'function_src', '_local_modules', 'hither2')
+    assert 'core.py' not in os.listdir(hither2_dir)
+    env = dict(os.environ, PYTHONPATH=f'{path}:{path}/function_src/_local_modules')
+    script = 'import hither2.runtime, function_src; print(hither2.__file__); print(function_src.add(x=1, y=2)); print(hasattr(hither2, "ComputeResource"))'
+    out = subprocess.check_output([sys.executable, '-c', script], env=env, cwd=str(tmp_path)).decode().split()
+    assert os.path.realpath(out[0]) == os.path.realpath(os.path.join(hither2_dir, '__init__.py'))
+    assert out[1] == '3'
+    # the attributes from the modules that are not shipped are missing
+    assert out[2] == 'False'
+
+def test_runtime_modules_import_only_runtime_modules():
+    # including the imports inside functions, which would only fail once the code is shipped
+    import ast
+    from hither2.runtime import RUNTIME_MODULES
+    hither2_dir = os.path.dirname(os.path.abspath(importlib.util.find_spec('hither2').origin))
+    unresolved = []
+    for fname in RUNTIME_MODULES:
+        with open(os.path.join(hither2_dir, fname), 'r') as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and node.level == 1 and f'{node.module}.py' not in RUNTIME_MODULES:
+                unresolved.append((fname, node.module))
+    # running hither2 jobs from within a function needs the whole package
+    assert unresolved == [('_decorators.py', 'core')]
+
+def test_unused_code_is_removed(tmp_path, monkeypatch):
+    from hither2._code_cache import _materialize_code, _remove_unused_code
+    monkeypatch.setenv('KACHERY_STORAGE_DIR', str(tmp_path))
+    code = dict(files=[dict(name='a.py', content='x = 1\n')], dirs=[dict(name='b', content=dict(files=[dict(name='c.py', content='')], dirs=[]))])
+    path1 = _materialize_code(code, fingerprint='1' * 40)
+    assert os.path.basename(path1) == '1' * 40
+    path2 = _materialize_code(dict(files=[], dirs=[]))
+    os.utime(path1, (0, 0))
+    _remove_unused_code(max_age_sec=3600)
+    assert not os.path.exists(path1)
+    assert os.path.exists(path2)
+    # using the code keeps it
+    os.utime(path2, (0, 0))
+    assert _materialize_code(dict(files=[], dirs=[])) == path2
+    _remove_unused_code(max_age_sec=3600)
+    assert os.path.exists(path2)
+    _remove_unused_code(max_age_sec=0)
+    assert os.listdir(os.path.join(str(tmp_path), 'hither2_code_cache')) == []
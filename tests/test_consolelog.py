@@ -0,0 +1,73 @@
+import os
+import sys
+import hither2 as hi
+
+def test_console_log(tmp_path):
+    log_path = str(tmp_path / 'console_logs' / 'job1.jsonl')
+    with hi.ConsoleCapture(label='job1', show_console=False, log_path=log_path) as cc:
+        print('line 1')
+        sys.stdout.flush()
+        lines, offset = hi.tail_console_log(dict(path=log_path))
+        assert [a['text'] for a in lines] == ['line 1']
+        print('line 2\nline 3')
+        print('problem', file=sys.stderr)
+    runtime_info = cc.runtime_info()
+    assert 'console_out' not in runtime_info
+    assert runtime_info['console_log']['path'] == log_path
+
+    lines, offset2 = hi.tail_console_log(runtime_info['console_log'], offset=offset)
+    assert [a['text'] for a in lines] == ['line 2', 'line 3', 'problem']
+    assert [a['stderr'] for a in lines] == [False, False, True]
+    assert hi.tail_console_log(runtime_info['console_log'], offset=offset2) == ([], offset2)
+    assert len(hi.read_console_log(runtime_info['console_log'])) == 4
+
+def test_console_capture_in_memory():
+    with hi.ConsoleCapture(label='job2', show_console=False) as cc:
+        print('hello')
+    runtime_info = cc.runtime_info()
+    assert [a['text'] for a in runtime_info['console_out']['lines']] == ['hello']
+
+def test_console_capture_max_lines():
+    with hi.ConsoleCapture(label='job3', show_console=False, max_lines=10) as cc:
+        for i in range(100):
+            print(f'line {i}')
+        print('a\nb', file=sys.stderr)
+    console_out = cc.runtime_info()['console_out']
+    texts = [a['text'] for a in console_out['lines']]
+    assert texts == ['line 0', 'line 1', 'line 2', 'line 3', 'line 4', 'line 97', 'line 98', 'line 99', 'a', 'b']
+    assert console_out['lines'][-1]['stderr'] and not console_out['lines'][-3]['stderr']
+    assert console_out['num_dropped_lines'] == 92
+
+def test_console_capture_partial_lines():
+    with hi.ConsoleCapture(label='job4', show_console=False) as cc:
+        print('a', 1, 'b')
+        sys.stdout.write('progress 1\rprogress 2\r')
+        sys.stdout.write('no newline')
+    texts = [a['text'] for a in cc.runtime_info()['console_out']['lines']]
+    assert texts == ['a 1 b', 'progress 1', 'progress 2', 'no newline']
+
+def test_console_log_of_rerun_job(tmp_path):
+    log_path = str(tmp_path / 'console_logs' / 'job5.jsonl')
+    for text in ['first run', 'second run']:
+        with hi.ConsoleCapture(label='job5', show_console=False, log_path=log_path) as cc:
+            print(text)
+    assert [a['text'] for a in hi.read_console_log(cc.runtime_info()['console_log'])] == ['second run']
+
+def test_console_log_flush_partial_line(tmp_path):
+    log_path = str(tmp_path / 'console_logs' / 'job6.jsonl')
+    with hi.ConsoleCapture(label='job6', show_console=False, log_path=log_path):
+        sys.stdout.write('working...')
+        sys.stdout.flush()
+        lines, _ = hi.tail_console_log(dict(path=log_path))
+        assert [a['text'] for a in lines] == ['working...']
+
+def test_console_log_is_stored_when_job_completes(tmp_path, general):
+    from hither2._consolelog import _finalize_console_log
+    log_path = str(tmp_path / 'console_logs' / 'job7.jsonl')
+    with hi.ConsoleCapture(label='job7', show_console=False, log_path=log_path) as cc:
+        print('done')
+    console_log = cc.runtime_info()['console_log']
+    _finalize_console_log(console_log)
+    assert console_log['sha1_path'] is not None
+    assert not os.path.exists(log_path)
+    assert [a['text'] for a in hi.read_console_log(console_log)] == ['done']
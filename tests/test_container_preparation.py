@@ -0,0 +1,72 @@
+import threading
+import hither2 as hi
+from hither2._jobmanager import _JobManager
+from hither2.core import _global_job_manager
+from .functions import functions as fun
+
+def test_jobs_wait_for_container_preparation_in_background(general, monkeypatch):
+    pull_started = threading.Event()
+    release_pull = threading.Event()
+    def slow_pull(self, container):
+        pull_started.set()
+        release_pull.wait(10)
+    monkeypatch.setattr(_JobManager, '_do_pull_docker_image', slow_pull)
+    monkeypatch.setattr(_JobManager, '_container_preparations', dict())
+    monkeypatch.setattr(_JobManager, '_prepared_docker_images', dict())
+    monkeypatch.delenv('HITHER_USE_SINGULARITY', raising=False)
+    monkeypatch.delenv('HITHER_DO_NOT_PULL_DOCKER_IMAGES', raising=False)
+
+    with hi.Config(container=True):
+        job1 = fun.add.run(x=1, y=2)
+    job2 = fun.add.run(x=3, y=4)
+    hi.wait(0)
+    assert pull_started.wait(10)
+    # the job without a container runs while the image is being pulled
+    assert job2.wait(10) == 7
+    assert job1.get_status() == hi.JobStatus.PREPARING
+
+    release_pull.set()
+    for _ in range(500):
+        # stop before the job would be run in the container
+        _global_job_manager.prepare_containers_for_queued_jobs()
+        if job1.get_status() != hi.JobStatus.PREPARING:
+            break
+        threading.Event().wait(0.01)
+    assert job1.get_status() == hi.JobStatus.QUEUED
+    hi.reset()
+
+def test_prepared_docker_images_are_remembered_across_processes(general, monkeypatch):
+    import hither2._jobmanager as jm
+    import hither2._containerregistry as registry
+    pulled = []
+    class FakeShellScript:
+        def __init__(self, script):
+            self._script = script
+        def start(self):
+            pulled.append(self._script)
+        def wait(self):
+            return 0
+    monkeypatch.setattr(jm, 'ShellScript', FakeShellScript)
+    image_ids = dict()
+    monkeypatch.setattr(jm, '_docker_image_id', lambda container: image_ids.get(container, None))
+    monkeypatch.setattr(registry, '_docker_image_id', lambda container: image_ids.get(container, None))
+
+    image_ids['docker://example/image:1'] = 'sha256:aaa'
+    # separate job managers stand in for separate processes: only the on-disk registry is shared
+    _JobManager()._do_pull_docker_image('docker://example/image:1')
+    assert len(pulled) == 1
+    _JobManager()._do_pull_docker_image('docker://example/image:1')
+    assert len(pulled) == 1
+    # pulled again when the local image is gone or has changed
+    image_ids['docker://example/image:1'] = 'sha256:bbb'
+    _JobManager()._do_pull_docker_image('docker://example/image:1')
+    assert len(pulled) == 2
+
+    # tags are pulled again once the pull is older than the ttl, digests are not
+    monkeypatch.setattr(registry, 'DOCKER_PULL_TTL', 0)
+    _JobManager()._do_pull_docker_image('docker://example/image:1')
+    assert len(pulled) == 3
+    image_ids['docker://example/image@sha256:ccc'] = 'sha256:ccc'
+    _JobManager()._do_pull_docker_image('docker://example/image@sha256:ccc')
+    _JobManager()._do_pull_docker_image('docker://example/image@sha256:ccc')
+    assert len(pulled) == 4
@@ -0,0 +1,29 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+import hither2 as hi
+
+def _modules_after(statement):
+    # the modules loaded in a fresh interpreter after running the statement
+    code = f'import json, sys; {statement}; print(json.dumps(sorted(sys.modules.keys())))'
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(hi.__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([package_dir] + [p for p in [os.getenv('PYTHONPATH')] if p]))
+    out = subprocess.check_output([sys.executable, '-c', code], env=env)
+    return set(json.loads(out.decode().strip().splitlines()[-1]))
+
+def test_worker_import_is_minimal():
+    # what the worker scripts import (see runtime.py)
+    modules = _modules_after('import hither2.runtime; import hither2; hither2.function')
+    for m in ['numpy', 'kachery', 'pymongo', 'hither2.core', 'hither2.job', 'hither2._jobmanager', 'hither2._Config',
+              'hither2.computeresource', 'hither2.database', 'hither2.paralleljobhandler', 'hither2.slurmjobhandler',
+              'hither2.remotejobhandler']:
+        assert m not in modules
+
+def test_lazy_attributes():
+    assert 'ComputeResource' in dir(hi)
+    assert hi.JobStatus.FINISHED.value == 'finished'
+    assert hi.ParallelJobHandler.__name__ == 'ParallelJobHandler'
+    with pytest.raises(AttributeError):
+        hi.not_an_attribute
@@ -0,0 +1,29 @@
+import hither2 as hi
+from .functions import functions as fun
+from ._inmemorydatabase import _InMemoryDatabase
+
+def test_job_cache_hit_for_local_job(general):
+    job_cache = hi.JobCache(database=_InMemoryDatabase())
+    with hi.Config(container=False, job_cache=job_cache):
+        job1 = fun.add.run(x=1, y=2)
+    assert job1.wait() == 3
+
+    with hi.Config(container=False):
+        job2 = fun.add.run(x=1, y=2)
+        job3 = fun.add.run(x=1, y=3)
+    assert job_cache.check_job(job2)
+    assert job2.get_status() == hi.JobStatus.FINISHED
+    assert job2.get_result() == 3
+    assert not job_cache.check_job(job3)
+
+def test_job_cache_skipped_for_profiled_job(general):
+    job_cache = hi.JobCache(database=_InMemoryDatabase())
+    with hi.Config(container=False, job_cache=job_cache):
+        job1 = fun.add.run(x=1, y=2)
+    assert job1.wait() == 3
+
+    with hi.Config(container=False, profile=True):
+        job2 = fun.add.run(x=1, y=2)
+    assert not job_cache.check_job(job2)
+    assert job2.wait() == 3
+    hi.load_profiles(job2)
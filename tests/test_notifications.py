@@ -0,0 +1,24 @@
+import hither2 as hi
+from hither2._notifications import _ChangeNotifier, SAFETY_POLL_INTERVAL
+
+def test_local_notification_bus():
+    bus = hi.LocalNotificationBus()
+    event = bus.subscribe('hither2_jobs', dict(compute_resource_id='cr1', compute_resource_status='pending'))
+    notifier = _ChangeNotifier(event, push_active=True)
+    assert not notifier.poll_due(0.5, 0.1)
+    assert notifier.poll_due(SAFETY_POLL_INTERVAL + 1, 0.1)
+
+    bus.publish('hither2_jobs', dict(compute_resource_id='cr2', compute_resource_status='pending'))
+    bus.publish('other_collection', dict(compute_resource_id='cr1', compute_resource_status='pending'))
+    assert not notifier.poll_due(0.5, 0.1)
+
+    # fields missing from the published document do not exclude it
+    bus.publish('hither2_jobs', dict(compute_resource_id='cr1', job_id='j1'))
+    assert notifier.poll_due(0.5, 0.1)
+    assert not notifier.poll_due(0.5, 0.1)
+
+def test_change_notifier_without_push():
+    bus = hi.LocalNotificationBus()
+    notifier = _ChangeNotifier(bus.subscribe('hither2_jobs', dict()), push_active=False)
+    assert notifier.poll_due(0.5, 0.1)
+    assert not notifier.poll_due(0.05, 0.1)
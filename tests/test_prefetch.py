@@ -0,0 +1,27 @@
+import hither2 as hi
+import hither2._prefetch as prefetch
+from hither2._prefetch import _Prefetcher
+
+class _RemoteOnlyKachery:
+    # Every file is 600 bytes and only available from the remote kachery
+    @staticmethod
+    def get_file_info(sha1_path, fr=None):
+        return None if fr is None else dict(size=600)
+
+def test_required_request_larger_than_budget(monkeypatch):
+    monkeypatch.setattr(prefetch, 'ka', _RemoteOnlyKachery)
+    monkeypatch.setattr(hi.File, 'ensure_local_availability', lambda self, kachery_src=None: None)
+    files = [hi.File('sha1://' + c * 40 + '/x.dat') for c in 'ab']
+    p = _Prefetcher(max_bytes=1000)
+    p.request('job1', files[:1], kachery='remote', required=True)
+    p.request('job2', files, kachery='remote', required=True)
+    for key in ['job1', 'job2']:
+        p._requests[key].future.result(timeout=10)
+        assert p.get_exception(key) is None
+    assert p.num_bytes() == 1800
+    # with the budget taken, files of non-required requests are left for the job
+    p.request('job3', [hi.File('sha1://' + 'c' * 40 + '/x.dat')], kachery='remote')
+    p._requests['job3'].future.result(timeout=10)
+    assert p.num_bytes() == 1800
+    p.release('job2')
+    assert p.num_bytes() == 600
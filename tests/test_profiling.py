@@ -0,0 +1,17 @@
+import pytest
+import hither2 as hi
+from .functions import functions as fun
+
+def test_profile_jobs(general):
+    with hi.Config(container=False, profile=True):
+        jobs = [fun.add.run(x=i, y=1) for i in range(3)]
+    with hi.Config(container=False):
+        job_not_profiled = fun.add.run(x=1, y=1)
+    hi.wait()
+    assert [job.get_result() for job in jobs] == [1, 2, 3]
+    assert job_not_profiled.get_runtime_info().get('profile', None) is None
+    stats = hi.load_profiles(jobs)
+    ncalls = [v[1] for k, v in stats.stats.items() if k[2] == 'add']
+    assert ncalls == [3]
+    with pytest.raises(Exception):
+        hi.load_profiles(job_not_profiled)
@@ -0,0 +1,39 @@
+import subprocess
+import time
+from hither2._resource_usage import _ResourceMonitor, _summarize_resource_usage, _suggest_num_cores
+
+def test_resource_monitor():
+    with _ResourceMonitor(sample_interval=0.05) as rm:
+        timer = time.time()
+        while time.time() - timer < 0.2:
+            pass
+        subprocess.run(['sleep', '0.3'])
+    runtime_info = rm.runtime_info()
+    resource_usage = runtime_info['resource_usage']
+    assert resource_usage['wall_time_sec'] >= 0.5
+    assert resource_usage['cpu_user_sec'] + resource_usage['cpu_system_sec'] >= 0.1
+    assert resource_usage['peak_rss_bytes'] > 0
+    assert resource_usage['num_child_processes'] >= 1
+
+def test_resource_monitor_per_thread():
+    with _ResourceMonitor(per_thread=True, sample_interval=0.05) as rm:
+        subprocess.run(['sleep', '0.1'])
+    resource_usage = rm.resource_usage()
+    assert resource_usage['wall_time_sec'] >= 0.1
+    # the memory, io and child processes of the whole process would not be the job's
+    assert 'peak_rss_bytes' not in resource_usage
+    assert 'io_read_bytes' not in resource_usage
+    assert 'num_child_processes' not in resource_usage
+
+def test_suggest_num_cores():
+    resource_usages = [
+        dict(wall_time_sec=10, cpu_user_sec=c * 10, cpu_system_sec=0, peak_rss_bytes=1000)
+        for c in [1, 1, 1.5, 2, 2, 2, 2, 2, 2, 3.5]
+    ]
+    summary = _summarize_resource_usage(resource_usages)
+    assert summary['num_jobs'] == 10
+    assert summary['cores_used_max'] == 3.5
+    assert summary['cores_used_p90'] == 2
+    assert _suggest_num_cores(resource_usages) == 2
+    assert _suggest_num_cores(resource_usages[:9]) == 2
+    assert _suggest_num_cores([]) is None
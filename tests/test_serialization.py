@@ -0,0 +1,48 @@
+import numpy as np
+import hither2 as hi
+from hither2.file import INLINE_ARRAY_MAX_BYTES
+
+def test_small_array_is_serialized_inline(general):
+    x = np.arange(12, dtype=np.float32).reshape((3, 4))
+    y = hi.File.kache_numpy_array(x)
+    assert isinstance(y, np.ndarray)
+    s = hi._serialize_item(dict(a=[y, (1, y)]))
+    assert s['a'][0]['_type'] == 'ndarray'
+    z = hi._deserialize_item(s)
+    np.testing.assert_array_equal(z['a'][0], x)
+    np.testing.assert_array_equal(z['a'][1][1], x)
+    assert z['a'][0].dtype == x.dtype
+
+def test_large_array_is_kached(general):
+    x = np.zeros(INLINE_ARRAY_MAX_BYTES // 8 + 1)
+    y = hi.File.kache_numpy_array(x)
+    assert isinstance(y, hi.File)
+    np.testing.assert_array_equal(y.array(), x)
+
+def test_payload_formats(general):
+    x = dict(a=np.arange(6).reshape((2, 3)), b=(1, 'two'), c=[dict(d=None)])
+    for payload_format in hi.PAYLOAD_FORMATS:
+        s = hi._serialize_item(x, encode_arrays=(payload_format == 'json'))
+        y = hi._deserialize_item(hi._decode_payload(hi._encode_payload(s, payload_format)))
+        np.testing.assert_array_equal(y['a'], x['a'])
+        assert y['b'] == x['b']
+        assert y['c'] == x['c']
+    # arrays decoded from a binary payload are writable
+    y = hi._decode_payload(hi._encode_payload(dict(a=np.zeros(10)), 'pickle5'))
+    y['a'][0] = 1
+
+def test_compressed_document_fields(general):
+    from hither2._payload import _compress_document_field, _decompress_document_field
+    x = dict(lines=['some console output'] * 5000)
+    y = _compress_document_field(x, kachery=None)
+    assert y['_type'] == 'hither2_compressed'
+    assert _decompress_document_field(y, kachery=None) == x
+    payload = hi._encode_payload(dict(a=np.zeros(100000)), 'pickle5')
+    y = _compress_document_field(payload, kachery=None)
+    assert _decompress_document_field(y, kachery=None) == payload
+    # small values are left alone
+    assert _compress_document_field(dict(a=1), kachery=None) == dict(a=1)
+    # only codecs that the reader supports are used
+    y = _compress_document_field(x, kachery=None, codecs=['zlib'])
+    assert y['codec'] == 'zlib'
+    assert _decompress_document_field(y, kachery=None) == x
@@ -0,0 +1,18 @@
+import os
+import hither2 as hi
+from .functions import functions as fun
+
+def test_slurm_job_handler_without_slurm(general, tmp_path, monkeypatch):
+    # the workers are separate python processes
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(hi.__file__)))
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join([package_dir] + [p for p in [os.getenv('PYTHONPATH')] if p]))
+    # The workers deserialize the jobs without their functions and run the generated code
+    sjh = hi.SlurmJobHandler(working_dir=str(tmp_path / 'slurm-job-handler'), use_slurm=False,
+        num_workers_per_batch=2, num_cores_per_job=1)
+    try:
+        with hi.Config(container=False, job_handler=sjh):
+            jobs = [fun.add.run(x=i, y=1) for i in range(3)]
+        assert [job.wait(timeout=120) for job in jobs] == [1, 2, 3]
+        assert jobs[0].get_runtime_info() is not None
+    finally:
+        sjh.cleanup()
@@ -0,0 +1,48 @@
+import json
+import hither2 as hi
+from .functions import functions as fun
+
+def test_trace_of_job(general, tmp_path):
+    hi.reset_trace()
+    hi.enable_tracing()
+    try:
+        with hi.Config(container=False):
+            job = fun.add.run(x=1, y=2)
+        assert job.wait() == 3
+    finally:
+        hi.disable_tracing()
+    trace_path = str(tmp_path / 'trace.json')
+    hi.export_trace(trace_path)
+    with open(trace_path, 'r') as f:
+        trace = json.load(f)
+    spans = [e for e in trace['traceEvents'] if e['ph'] == 'X' and e['args'].get('job_id', None) == job._job_id]
+    names = [e['name'] for e in spans]
+    for name in ['queued', 'submit to job handler', 'run function', 'in job handler']:
+        assert name in names
+    assert all([e['dur'] >= 0 for e in spans])
+    assert len(job.get_runtime_info()['trace_events']) > 0
+
+def test_tracing_disabled(general):
+    hi.reset_trace()
+    with hi.Config(container=False):
+        job = fun.add.run(x=1, y=2)
+    assert job.wait() == 3
+    assert hi.export_trace()['traceEvents'] == []
+    assert 'trace_events' not in job.get_runtime_info()
+
+def test_forget_job_trace_events(general):
+    from hither2._tracing import _record_span, _attach_job_trace_events
+    hi.reset_trace()
+    hi.enable_tracing()
+    try:
+        _record_span('run function', 1, 2, job_id='job1')
+        _record_span('run function', 3, 4, job_id='job2')
+        runtime_info: dict = dict()
+        _attach_job_trace_events('job1', runtime_info, forget=True)
+    finally:
+        hi.disable_tracing()
+    assert [e['ph'] for e in runtime_info['trace_events']] == ['M', 'X']
+    # the events of job1 were sent along with it, the process name is still needed for job2
+    events = hi.export_trace()['traceEvents']
+    assert [(e['ph'], e['args'].get('job_id', None)) for e in events] == [('M', None), ('X', 'job2')]
+    hi.reset_trace()